@@ -1,10 +1,10 @@
-from rdbtools.parser import RdbCallback, RdbParser, DebugCallback
+from rdbtools.parser import RdbCallback, RdbParser, DebugCallback, STOP_PARSING, KeyInfo, ElementEncoding, ElementSummary, expiry_to_datetime
 from rdbtools.callbacks import JSONCallback, DiffCallback, ProtocolCallback, KeyValsOnlyCallback, KeysOnlyCallback
-from rdbtools.memprofiler import MemoryCallback, PrintAllKeys, StatsAggregator, PrintJustKeys
+from rdbtools.memprofiler import MemoryCallback, PrintAllKeys, StatsAggregator, PrintJustKeys, NamespaceTree
 
 __version__ = '0.1.15'
 VERSION = tuple(map(int, __version__.split('.')))
 
 __all__ = [
-    'RdbParser', 'RdbCallback', 'JSONCallback', 'DiffCallback', 'MemoryCallback', 'ProtocolCallback', 'KeyValsOnlyCallback', 'KeysOnlyCallback', 'PrintJustKeys']
+    'RdbParser', 'RdbCallback', 'STOP_PARSING', 'KeyInfo', 'ElementEncoding', 'ElementSummary', 'expiry_to_datetime', 'JSONCallback', 'DiffCallback', 'MemoryCallback', 'ProtocolCallback', 'KeyValsOnlyCallback', 'KeysOnlyCallback', 'PrintJustKeys', 'NamespaceTree']
 
@@ -0,0 +1,104 @@
+import bisect
+
+# Allocators look the sizes below this up in a table, built once per allocator and architecture
+LOOKUP_TABLE_SIZE = 16 * 1024
+
+
+def jemalloc_size_classes(lg_quantum):
+    """
+    The size classes of jemalloc built with a quantum of 2**`lg_quantum` bytes : powers of two below the quantum,
+    the first four multiples of the quantum, then four classes per doubling, up to 2**64
+    """
+    quantum = 1 << lg_quantum
+    classes = []
+    size = 8
+    while size < quantum:
+        classes.append(size)
+        size *= 2
+    classes.extend(quantum * i for i in range(1, 5))
+    base = 4 * quantum
+    while True:
+        for i in range(1, 5):
+            size = base + base // 4 * i
+            if size >= 2**64:
+                return classes
+            classes.append(size)
+        base *= 2
+
+
+class Allocator(object):
+    """
+    Model of a memory allocator, which rounds up each requested size to the size it actually uses.
+    Subclasses implement `round_up`. `allocation` looks up the sizes below LOOKUP_TABLE_SIZE in a table
+    computed when the allocator is created, see `get_allocator` for shared instances.
+    """
+    name = None
+
+    def __init__(self, architecture=64):
+        self.architecture = int(architecture)
+        self._table = [self.round_up(size) for size in range(LOOKUP_TABLE_SIZE)]
+
+    def allocation(self, size):
+        if size < LOOKUP_TABLE_SIZE:
+            return self._table[size]
+        return self.round_up(size)
+
+    def round_up(self, size):
+        raise NotImplementedError
+
+
+class SizeClassAllocator(Allocator):
+    """An allocator that hands out the smallest of its `size_classes` that fits, and sizes above them as they are"""
+    size_classes = ()
+
+    def round_up(self, size):
+        idx = bisect.bisect_left(self.size_classes, size)
+        return self.size_classes[idx] if idx < len(self.size_classes) else size
+
+
+class Jemalloc4(SizeClassAllocator):
+    """jemalloc 4.0, as bundled with redis 3.2 to 4.0, with the 8 byte quantum the memory report has always used"""
+    name = 'jemalloc4'
+    size_classes = jemalloc_size_classes(3)
+
+
+class Jemalloc5(SizeClassAllocator):
+    """jemalloc 5, as bundled with redis 5.0 and later, with the 16 byte quantum of x86-64 and arm64 builds"""
+    name = 'jemalloc5'
+    size_classes = jemalloc_size_classes(4)
+
+
+class LibcMalloc(Allocator):
+    """
+    glibc malloc, used by redis builds with MALLOC=libc. Each chunk has a size header and is aligned
+    to twice the size of a pointer. Chunks above the mmap threshold are mapped as whole pages.
+    """
+    name = 'libc'
+    MMAP_THRESHOLD = 128 * 1024
+    PAGE_SIZE = 4096
+
+    def __init__(self, architecture=64):
+        self._header = 8 if int(architecture) == 64 else 4
+        self._alignment = 2 * self._header
+        self._min_chunk = 4 * self._header
+        super(LibcMalloc, self).__init__(architecture)
+
+    def round_up(self, size):
+        if size >= self.MMAP_THRESHOLD:
+            return (size + 2 * self._header + self.PAGE_SIZE - 1) // self.PAGE_SIZE * self.PAGE_SIZE
+        return max(self._min_chunk, (size + self._header + self._alignment - 1) // self._alignment * self._alignment)
+
+
+ALLOCATORS = dict((allocator.name, allocator) for allocator in (Jemalloc4, Jemalloc5, LibcMalloc))
+
+_instances = {}
+
+
+def get_allocator(name='jemalloc4', architecture=64):
+    """Return the shared instance of the allocator model `name` (one of ALLOCATORS) for `architecture`"""
+    if name not in ALLOCATORS:
+        raise Exception('get_allocator', 'Invalid allocator %s, expected one of %s' % (name, ', '.join(sorted(ALLOCATORS))))
+    key = (name, int(architecture))
+    if key not in _instances:
+        _instances[key] = ALLOCATORS[name](architecture)
+    return _instances[key]
@@ -1,8 +1,8 @@
-import calendar
 import codecs
 import json
 
-from rdbtools.parser import RdbCallback
+from rdbtools.parser import RdbCallback, STRING_CHUNK_SIZE
+from rdbtools.encodehelpers import STRING_ESCAPE_RAW
 from rdbtools import encodehelpers
 
 
@@ -136,6 +136,8 @@ class JSONCallback(RdbCallback):
 
 
 class KeysOnlyCallback(RdbCallback):
+    lazy_lzf_strings = True
+
     def __init__(self, out, string_escape=None):
         super(KeysOnlyCallback, self).__init__(string_escape)
         self._out = out
@@ -148,27 +150,15 @@ class KeysOnlyCallback(RdbCallback):
     
     def start_hash(self, key, length, expiry, info):
         self._keyout(key)
-    
-    def hset(self, key, field, value):
-        self._keyout(key)
 
     def start_set(self, key, cardinality, expiry, info):
         self._keyout(key)
-
-    def sadd(self, key, member):
-        self._keyout(key)
     
     def start_list(self, key, expiry, info):
         self._keyout(key)
 
-    def rpush(self, key, value) :
-        self._keyout(key)
-
     def start_sorted_set(self, key, length, expiry, info):
         self._keyout(key)
-
-    def zadd(self, key, score, member):
-        self._keyout(key)
         
     def start_stream(self, key, listpacks_count, expiry, info):
         self._keyout(key)
@@ -358,30 +348,33 @@ class DiffCallback(RdbCallback):
         self._out.write(b'\r\n')
 
 
-def _unix_timestamp(dt):
-     return calendar.timegm(dt.utctimetuple())
-
-
 class ProtocolCallback(RdbCallback):
+    # EXPIREAT only needs the expiries as Unix timestamps
+    raw_key_metadata = True
+
     def __init__(self, out, string_escape=None, emit_expire=True, amend_expire=0):
         super(ProtocolCallback, self).__init__(string_escape)
         self._emit_expire = emit_expire
         self._amend_expire = (amend_expire > 0)
-        self._expire_delta = calendar.datetime.timedelta(seconds=amend_expire)
+        self._expire_delta = int(amend_expire * 1000)
         self._out = out
+        if self._escape == STRING_ESCAPE_RAW:
+            # unescaped values are written as they are read, other escapes need the whole value
+            self.string_chunk_size = STRING_CHUNK_SIZE
         self.reset()
 
     def reset(self):
         self._expires = {}
 
-    def set_expiry(self, key, dt):
+    def set_expiry(self, key, expiry):
+        """`expiry` is in milliseconds since the epoch"""
         if self._amend_expire:
-            dt = dt + self._expire_delta
-        self._expires[key] = dt
+            expiry = expiry + self._expire_delta
+        self._expires[key] = expiry
 
     def get_expiry_seconds(self, key):
         if key in self._expires:
-            return _unix_timestamp(self._expires[key])
+            return self._expires[key] // 1000
         return None
 
     def expires(self, key):
@@ -413,6 +406,22 @@ class ProtocolCallback(RdbCallback):
         self.emit(b'SET', key, value)
         self.post_expiry(key)
 
+    def set_start(self, key, length, expiry, info):
+        self.pre_expiry(key, expiry)
+        self._out.write(b'*3\r\n')
+        for arg in (b'SET', key):
+            val = encodehelpers.apply_escape_bytes(arg, self._escape)
+            self._out.write(codecs.encode("$%s\r\n" % len(val), 'ascii'))
+            self._out.write(val + b"\r\n")
+        self._out.write(codecs.encode("$%s\r\n" % length, 'ascii'))
+
+    def set_chunk(self, key, chunk):
+        self._out.write(chunk)
+
+    def set_end(self, key):
+        self._out.write(b"\r\n")
+        self.post_expiry(key)
+
     # Hash handling
 
     def start_hash(self, key, length, expiry, info):
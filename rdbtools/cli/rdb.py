@@ -2,25 +2,52 @@
 from __future__ import print_function
 import os
 import sys
-from argparse import ArgumentParser
-from rdbtools import RdbParser, JSONCallback, DiffCallback, MemoryCallback, ProtocolCallback, PrintAllKeys, KeysOnlyCallback, KeyValsOnlyCallback
+import datetime
+from argparse import ArgumentParser, ArgumentTypeError
+from rdbtools import RdbParser, JSONCallback, DiffCallback, MemoryCallback, ProtocolCallback, PrintAllKeys, KeysOnlyCallback, KeyValsOnlyCallback, NamespaceTree
+from rdbtools.memprofiler import min_bytes_filters
 from rdbtools.encodehelpers import ESCAPE_CHOICES
 from rdbtools.parser import HAS_PYTHON_LZF as PYTHON_LZF_INSTALLED
+from rdbtools.readers import READER_ENGINES
+from rdbtools.allocators import ALLOCATORS
+from rdbtools.keyindex import open_index
+from rdbtools.parallel import profile_memory
 
 
 def eprint(*args, **kwargs):
     """Print a string to the stderr stream"""
     print(*args, file=sys.stderr, **kwargs)
 
+def to_datetime(arg):
+    """Times are given as seconds since the epoch, or as an ISO 8601 date and time in UTC"""
+    try:
+        return datetime.datetime.utcfromtimestamp(float(arg))
+    except ValueError:
+        pass
+    for time_format in ("%Y-%m-%dT%H:%M:%S", "%Y-%m-%d %H:%M:%S", "%Y-%m-%d"):
+        try:
+            return datetime.datetime.strptime(arg, time_format)
+        except ValueError:
+            pass
+    raise ArgumentTypeError("invalid time %s, expected seconds since the epoch or YYYY-MM-DDTHH:MM:SS" % arg)
+
+def to_bytes(arg):
+    """Command line arguments are text on python 3, keys are bytes"""
+    if isinstance(arg, bytes):
+        return arg
+    return arg.encode('utf-8')
+
 VALID_TYPES = ("hash", "set", "string", "list", "sortedset")
 def main():
     usage = """usage: %(prog)s [options] /path/to/dump.rdb
 
-Example : %(prog)s --command json -k "user.*" /var/redis/6379/dump.rdb"""
+Example : %(prog)s --command json -k "user.*" /var/redis/6379/dump.rdb
+Example : redis-cli --rdb - | %(prog)s --command memory -
+Example : %(prog)s --command json --lookup-prefix "session:" /var/redis/6379/dump.rdb"""
 
     parser = ArgumentParser(prog='rdb', usage=usage)
     parser.add_argument("-c", "--command", dest="command", required=True,
-                  help="Command to execute. Valid commands are json, diff, justkeys, justkeyvals, memory and protocol", metavar="CMD")
+                  help="Command to execute. Valid commands are json, diff, justkeys, justkeyvals, memory, namespaces and protocol", metavar="CMD")
     parser.add_argument("-f", "--file", dest="output",
                   help="Output file", metavar="FILE")
     parser.add_argument("-n", "--db", dest="dbs", action="append",
@@ -29,6 +56,35 @@ Example : %(prog)s --command json -k "user.*" /var/redis/6379/dump.rdb"""
                   help="Keys to export. This can be a regular expression")
     parser.add_argument("-o", "--not-key", dest="not_keys", default=None,
                   help="Keys Not to export. This can be a regular expression")
+    parser.add_argument("--key-prefix", dest="key_prefixes", action="append", metavar="PREFIX",
+                  help="Keys to export start with this prefix. Multiple prefixes can be provided")
+    parser.add_argument("--key-glob", dest="key_globs", action="append", metavar="PATTERN",
+                  help="Keys to export match this glob style pattern, as for the KEYS command. Multiple patterns can be provided")
+    parser.add_argument("--keys-file", dest="keys_file", default=None, metavar="FILE",
+                  help="Keys to export are listed in this file, one per line")
+    parser.add_argument("--stop-when-found", dest="stop_when_found", default=False, action='store_true',
+                  help="With --keys-file, stop reading the dump file once every key in the file has been found")
+    parser.add_argument("--max-keys", dest="max_keys", default=None, type=int, metavar="N",
+                  help="Stop reading the dump file after N keys")
+    parser.add_argument("--sample", dest="sample", default=None, type=float, metavar="RATE",
+                  help="Only process a sample of the keys, picked by a hash of the key name, e.g. 0.01 for 1%% of the keys")
+    parser.add_argument("--expires-before", dest="expires_before", default=None, type=to_datetime, metavar="TIME",
+                  help="Keys to export expire before this time, in seconds since the epoch or as YYYY-MM-DDTHH:MM:SS in UTC")
+    parser.add_argument("--expires-after", dest="expires_after", default=None, type=to_datetime, metavar="TIME",
+                  help="Keys to export expire after this time, in seconds since the epoch or as YYYY-MM-DDTHH:MM:SS in UTC")
+    ttl_group = parser.add_mutually_exclusive_group(required=False)
+    ttl_group.add_argument("--has-ttl", dest="has_ttl", default=None, action='store_true',
+                  help="Keys to export have an expiry")
+    ttl_group.add_argument("--no-ttl", dest="has_ttl", action='store_false',
+                  help="Keys to export have no expiry")
+    parser.add_argument("--min-idle", dest="min_idle", default=None, type=int, metavar="SECONDS",
+                  help="Keys to export have been idle for at least this long. Needs a dump of a server with an LRU maxmemory-policy")
+    parser.add_argument("--max-freq", dest="max_freq", default=None, type=int, metavar="N",
+                  help="Keys to export have an LFU frequency of at most N. Needs a dump of a server with an LFU maxmemory-policy")
+    parser.add_argument("--min-elements", dest="min_elements", default=None, type=int, metavar="N",
+                  help="Keys to export have at least N elements")
+    parser.add_argument("--min-serialized-size", dest="min_serialized_size", default=None, type=int, metavar="BYTES",
+                  help="Strings and compact encodings to export take at least this many bytes in the dump file")
     parser.add_argument("-t", "--type", dest="types", action="append",
                   help="""Data types to include. Possible values are string, hash, set, sortedset, list. Multiple typees can be provided. 
                     If not specified, all data types will be returned""")
@@ -36,16 +92,65 @@ Example : %(prog)s --command json -k "user.*" /var/redis/6379/dump.rdb"""
                   help="Limit memory output to keys greater to or equal to this value (in bytes)")
     parser.add_argument("-l", "--largest", dest="largest", default=None,
                   help="Limit memory output to only the top N keys (by size)")
+    parser.add_argument("--allocator", dest="allocator", choices=sorted(ALLOCATORS), default='jemalloc4',
+                  help="With memory and namespaces commands, the allocator whose size classes allocations are rounded to: "
+                       "jemalloc4 (default), jemalloc5 or libc")
+    parser.add_argument("--delimiters", dest="delimiters", default=":", metavar="CHARS",
+                  help="With namespaces command, split keys into namespaces after each of these characters (default :)")
+    parser.add_argument("--largest-by", dest="largest_by", choices=("type", "database"), default=None,
+                  help="With --largest, output the top N keys of each type or of each database")
+    parser.add_argument("--largest-snapshot", dest="largest_snapshot", default=None, metavar="FILE",
+                  help="With --largest, rewrite FILE with the top N keys found so far every minute while parsing")
     parser.add_argument("-e", "--escape", dest="escape", choices=ESCAPE_CHOICES,
                   help="Escape strings to encoding: %s (default), %s, %s, or %s." % tuple(ESCAPE_CHOICES))
+    parser.add_argument("--engine", dest="engine", choices=READER_ENGINES, default='file',
+                  help="How to read the dump file: file (default), mmap, which memory maps the file and decodes it in place, "
+                       "or readahead, which reads the file on a background thread while decoding it and reports the time spent waiting for I/O")
+    parser.add_argument("--index", dest="index", default=None, metavar="FILE",
+                  help="Key index of the dump file for --lookup and --lookup-prefix, built on first use or when the dump file changes. Defaults to the dump file name with .idx appended")
+    parser.add_argument("--lookup", dest="lookup", action="append", metavar="KEY",
+                  help="Only process this key, read straight from its offset found in the key index. Multiple keys can be provided")
+    parser.add_argument("--lookup-prefix", dest="lookup_prefix", action="append", metavar="PREFIX",
+                  help="Only process keys starting with this prefix, found through the key index. Multiple prefixes can be provided")
+    parser.add_argument("-w", "--workers", dest="workers", default=1, type=int, metavar="N",
+                  help="With memory command, profile the dump file on N processes")
+    parser.add_argument("--lzf-threads", dest="lzf_threads", default=0, type=int, metavar="N",
+                  help="Decompress large LZF compressed values on N threads while parsing. Needs python-lzf to run them in parallel")
     expire_group = parser.add_mutually_exclusive_group(required=False)
     expire_group.add_argument("-x", "--no-expire", dest="no_expire", default=False, action='store_true',
                   help="With protocol command, remove expiry from all keys")
     expire_group.add_argument("-a", "--amend-expire", dest="amend_expire", default=0, type=int, metavar='N',
                   help="With protocol command, add N seconds to key expiry time")
-    parser.add_argument("dump_file", nargs=1, help="RDB Dump file to process")
+    parser.add_argument("dump_file", nargs=1, help="RDB Dump file to process, or - to read it from stdin")
 
     options = parser.parse_args()
+    from_stdin = options.dump_file[0] == '-'
+    if from_stdin and options.engine == 'mmap':
+        parser.error("--engine mmap needs a dump file, it cannot read from stdin")
+    lookups = options.lookup or options.lookup_prefix
+    if from_stdin and (lookups or options.index):
+        parser.error("--index, --lookup and --lookup-prefix need a dump file, they cannot read from stdin")
+    if options.index and not lookups:
+        parser.error("--index is only used to find the keys of --lookup and --lookup-prefix")
+    if options.workers > 1:
+        if options.command not in ('memory', 'namespaces'):
+            parser.error("--workers is only supported with the memory and namespaces commands")
+        if from_stdin or lookups:
+            parser.error("--workers needs the whole dump file, it cannot be used with stdin or --lookup")
+        if options.stop_when_found or options.max_keys is not None:
+            parser.error("--workers cannot stop early, it cannot be used with --stop-when-found or --max-keys")
+    if (options.largest_by or options.largest_snapshot) and options.largest is None:
+        parser.error("--largest-by and --largest-snapshot need --largest")
+    if options.stop_when_found and not options.keys_file:
+        parser.error("--stop-when-found needs --keys-file")
+    if options.max_keys is not None and options.max_keys < 1:
+        parser.error("--max-keys must be at least 1")
+    if options.sample is not None and not 0 < options.sample <= 1:
+        parser.error("--sample must be between 0 and 1")
+    if from_stdin and (options.min_elements is not None or options.min_serialized_size is not None):
+        parser.error("--min-elements and --min-serialized-size need a dump file, they cannot read from stdin")
+    if options.engine == 'readahead' and (options.min_elements is not None or options.min_serialized_size is not None):
+        parser.error("--min-elements and --min-serialized-size need a seekable dump file, they cannot be used with --engine readahead")
     
     filters = {}
     if options.dbs:
@@ -61,6 +166,33 @@ Example : %(prog)s --command json -k "user.*" /var/redis/6379/dump.rdb"""
         
     if options.not_keys:
         filters['not_keys'] = options.not_keys
+
+    if options.key_prefixes:
+        filters['key_prefixes'] = [to_bytes(x) for x in options.key_prefixes]
+
+    if options.key_globs:
+        filters['key_globs'] = [to_bytes(x) for x in options.key_globs]
+
+    if options.keys_file:
+        filters['keys_file'] = options.keys_file
+
+    if options.stop_when_found:
+        filters['stop_when_found'] = True
+
+    if options.max_keys is not None:
+        filters['max_keys'] = options.max_keys
+
+    if options.sample is not None:
+        filters['sample'] = options.sample
+
+    for name in ('expires_before', 'expires_after', 'has_ttl', 'min_idle', 'max_freq', 'min_elements', 'min_serialized_size'):
+        if getattr(options, name) is not None:
+            filters[name] = getattr(options, name)
+
+    if options.command == 'memory' and options.bytes is not None and not from_stdin and options.engine != 'readahead':
+        # keys that are certainly smaller than --bytes are skipped without being decoded
+        for name, value in min_bytes_filters(options.bytes).items():
+            filters[name] = max(value, filters.get(name, 0))
     
     if options.types:
         filters['types'] = []
@@ -78,14 +210,36 @@ Example : %(prog)s --command json -k "user.*" /var/redis/6379/dump.rdb"""
             # Prefer not to depend on Python stdout implementation for writing binary.
             out_file_obj = os.fdopen(sys.stdout.fileno(), 'wb')
 
+        if not PYTHON_LZF_INSTALLED:
+            eprint("WARNING: python-lzf package NOT detected. " +
+                "Compressed values are decompressed in pure python, which is slower. " +
+                "To install it, run the following command:")
+            eprint("")
+            eprint("pip install python-lzf")
+            eprint("")
+
+        if options.workers > 1:
+            if options.command == 'namespaces':
+                stream = NamespaceTree(out_file_obj, options.delimiters, sample_rate=options.sample)
+            else:
+                stream = PrintAllKeys(out_file_obj, options.bytes, options.largest, options.largest_by, options.largest_snapshot)
+            profile_memory(options.dump_file[0], stream, options.workers, filters=filters, string_escape=options.escape,
+                           allocator=options.allocator)
+            return
+
         try:
             callback = {
                 'diff': lambda f: DiffCallback(f, string_escape=options.escape),
                 'json': lambda f: JSONCallback(f, string_escape=options.escape),
                 'justkeys': lambda f: KeysOnlyCallback(f, string_escape=options.escape),
                 'justkeyvals': lambda f: KeyValsOnlyCallback(f, string_escape=options.escape),
-                'memory': lambda f: MemoryCallback(PrintAllKeys(f, options.bytes, options.largest),
-                                                   64, string_escape=options.escape),
+                'memory': lambda f: MemoryCallback(PrintAllKeys(f, options.bytes, options.largest,
+                                                                options.largest_by, options.largest_snapshot),
+                                                   64, string_escape=options.escape, sample_rate=options.sample,
+                                                   allocator=options.allocator),
+                'namespaces': lambda f: MemoryCallback(NamespaceTree(f, options.delimiters, sample_rate=options.sample),
+                                                       64, string_escape=options.escape, sample_rate=options.sample,
+                                                       allocator=options.allocator),
                 'protocol': lambda f: ProtocolCallback(f, string_escape=options.escape,
                                                        emit_expire=not options.no_expire,
                                                        amend_expire=options.amend_expire
@@ -94,16 +248,22 @@ Example : %(prog)s --command json -k "user.*" /var/redis/6379/dump.rdb"""
         except:
             raise Exception('Invalid Command %s' % options.command)
 
-        if not PYTHON_LZF_INSTALLED:
-            eprint("WARNING: python-lzf package NOT detected. " +
-                "Parsing dump file will be very slow unless you install it. " +
-                "To install, run the following command:")
-            eprint("")
-            eprint("pip install python-lzf")
-            eprint("")
-
-        parser = RdbParser(callback, filters=filters)
-        parser.parse(options.dump_file[0])
+        parser = RdbParser(callback, filters=filters, engine=options.engine, lzf_threads=options.lzf_threads)
+        if from_stdin:
+            parser.parse_stream(sys.stdin)
+        elif lookups:
+            dump_file = options.dump_file[0]
+            with open_index(dump_file, options.index, options.engine) as index:
+                entries = []
+                for key in options.lookup or []:
+                    entries.extend(index.lookup(to_bytes(key), filters.get('dbs')))
+                for prefix in options.lookup_prefix or []:
+                    entries.extend(index.lookup_prefix(to_bytes(prefix), filters.get('dbs')))
+            parser.parse_offsets(dump_file, [(e.db, e.offset) for e in entries])
+        else:
+            parser.parse(options.dump_file[0])
+        if parser.read_stats is not None:
+            eprint("Read %d bytes in %.2fs, waited %.2fs for I/O and spent %.2fs decoding" % parser.read_stats)
     finally:
         if options.output and out_file_obj is not None:
             out_file_obj.close()
@@ -4,6 +4,7 @@ import sys
 from string import Template
 from optparse import OptionParser
 from rdbtools import RdbParser, MemoryCallback, PrintAllKeys, StatsAggregator
+from rdbtools.parallel import profile_memory
 
 TEMPLATES_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), os.path.pardir, 'templates'))
 
@@ -11,7 +12,8 @@ def main():
     usage = """usage: %prog [options] /path/to/dump.rdb
 
 Example 1 : %prog -k "user.*" -k "friends.*" -f memoryreport.html /var/redis/6379/dump.rdb
-Example 2 : %prog /var/redis/6379/dump.rdb"""
+Example 2 : %prog /var/redis/6379/dump.rdb
+Example 3 : %prog --sample 0.01 /var/redis/6379/dump.rdb"""
 
     parser = OptionParser(usage=usage)
 
@@ -19,17 +21,27 @@ Example 2 : %prog /var/redis/6379/dump.rdb"""
                   help="Output file", metavar="FILE")
     parser.add_option("-k", "--key", dest="keys", action="append",
                   help="Keys that should be grouped together. Multiple regexes can be provided")
+    parser.add_option("-w", "--workers", dest="workers", default=1, type="int",
+                  help="Number of processes to profile the dump file on", metavar="N")
+    parser.add_option("-s", "--sample", dest="sample", default=None, type="float",
+                  help="Profile a sample of the keys, picked by a hash of the key name, and extrapolate the totals. E.g. 0.01 for 1% of the keys", metavar="RATE")
     
     (options, args) = parser.parse_args()
     
     if len(args) == 0:
         parser.error("Redis RDB file not specified")
     dump_file = args[0]
+    if options.sample is not None and not 0 < options.sample <= 1:
+        parser.error("--sample must be between 0 and 1")
+    filters = {'sample': options.sample} if options.sample is not None else None
     
-    stats = StatsAggregator()
-    callback = MemoryCallback(stats, 64)
-    parser = RdbParser(callback)
-    parser.parse(dump_file)
+    stats = StatsAggregator(key_groupings=options.keys, sample_rate=options.sample)
+    if options.workers > 1:
+        profile_memory(dump_file, stats, options.workers, filters)
+    else:
+        callback = MemoryCallback(stats, 64, sample_rate=options.sample)
+        parser = RdbParser(callback, filters)
+        parser.parse(dump_file)
     stats_as_json = stats.get_json()
 
     with open(os.path.join(TEMPLATES_DIR, "report.html.template"), 'r') as t:
@@ -1,6 +1,6 @@
 # python2->3 compat
 
-import sys, re
+import os, sys, re, array
 
 try:
     xrange
@@ -8,6 +8,11 @@ try:
 except NameError:
     range = range
 
+try:
+    integer_types = (int, long)
+except NameError:
+    integer_types = (int,)
+
 try:
     long
     def isnumber(n):
@@ -23,3 +28,25 @@ else:
     def str2regexp(pattern):
         return re.compile(pattern.encode('utf-8'))
 
+if sys.version_info < (3,):
+    def indexable_bytes(buf):
+        """Return `buf` in a form whose items are ints when indexed"""
+        return bytearray(buf)
+else:
+    def indexable_bytes(buf):
+        return buf
+
+if sys.version_info < (3,):
+    def array_from_bytes(typecode, buf):
+        """Return an array.array of `typecode` holding the machine values in the bytes of `buf`"""
+        values = array.array(typecode)
+        values.fromstring(buf.tobytes() if isinstance(buf, memoryview) else bytes(buf))
+        return values
+else:
+    def array_from_bytes(typecode, buf):
+        values = array.array(typecode)
+        values.frombytes(buf)
+        return values
+
+# os.rename does not replace an existing file on Windows
+replace_file = getattr(os, 'replace', os.rename)
@@ -0,0 +1,385 @@
+import calendar
+import re
+import zlib
+
+from rdbtools.compat import str2regexp
+
+# Above this many prefixes, keys are matched by looking up their leading bytes in one set per prefix length
+# rather than through bytes.startswith, which tries the prefixes one after the other
+MAX_STARTSWITH_PREFIXES = 16
+
+_GLOB_SPECIAL = re.compile(b'[*?\\[\\\\]')
+# regular expressions that only match a literal prefix, with or without a trailing .*
+_LITERAL_PREFIX = re.compile(r'[^.^$*+?{}\[\]\\|()]*(\.\*)?\Z')
+# numbered back references, which no longer refer to the same group once patterns are combined
+_BACK_REFERENCE = re.compile(r'\\[1-9]')
+
+
+def compile_db_filter(filters):
+    """Return the set of database numbers selected by `filters`, or None if every database is selected"""
+    if not 'dbs' in filters or filters['dbs'] is None:
+        return None
+    elif isinstance(filters['dbs'], int):
+        return frozenset((filters['dbs'], ))
+    elif isinstance(filters['dbs'], (list, tuple, set, frozenset)):
+        return frozenset(int(x) for x in filters['dbs']) or None
+    else:
+        raise Exception('compile_db_filter', 'invalid value for dbs in filter %s' % filters['dbs'])
+
+
+def compile_key_filter(filters, type_mapping, key_set=None):
+    """
+    Compile the key and type conditions of `filters` into a single function of `(key, data_type)`,
+    or return None if every key is selected. `type_mapping` maps data types to the names
+    used by the `types` filter. `key_set` is the result of `exact_key_set(filters)`, when the
+    caller already has it.
+
+    The supported conditions are :
+        keys        regular expression that keys must match
+        not_keys    regular expression that keys must not match
+        key_prefixes  list of literal prefixes, keys must start with one of them
+        key_globs   list of Redis style glob patterns (as for KEYS or SCAN MATCH), keys must match one of them
+        key_set     collection of exact keys, keys must be one of them
+        keys_file   file with one exact key per line, keys must be one of them
+        types       list of type names, keys must have one of these types
+        sample      sampling rate between 0 and 1, see `sample_matcher`
+    Keys must satisfy every condition that is given. See `compile_header_filter` and `compile_value_filter`
+    for the conditions on the metadata of keys, and `compile_stop_condition` for the conditions that
+    stop the parse early.
+    """
+    data_types = None
+    if 'types' in filters:
+        if isinstance(filters['types'], bytes):
+            type_names = (filters['types'], )
+        elif isinstance(filters['types'], (list, tuple)):
+            type_names = [str(x) for x in filters['types']]
+        else:
+            raise Exception('compile_key_filter', 'invalid value for types in filter %s' % filters['types'])
+        data_types = frozenset(t for t, name in type_mapping.items() if name in type_names)
+
+    # each check is a function of the key as bytes, whose result is true if the key is selected
+    checks = []
+    if key_set is None:
+        key_set = exact_key_set(filters)
+    if key_set is not None:
+        checks.append(key_set.__contains__)
+
+    if filters.get('key_prefixes'):
+        checks.append(prefix_matcher([to_key(p) for p in filters['key_prefixes']]))
+
+    if filters.get('key_globs'):
+        checks.append(glob_matcher([to_key(g) for g in filters['key_globs']]))
+
+    if filters.get('keys'):
+        checks.append(str2regexp(filters['keys']).match)
+
+    if filters.get('not_keys'):
+        not_keys_match = str2regexp(filters['not_keys']).match
+        checks.append(lambda key: not_keys_match(key) is None)
+
+    if filters.get('sample') is not None:
+        checks.append(sample_matcher(filters['sample']))
+
+    if data_types is None and not checks:
+        return None
+    if data_types is None and len(checks) == 1:
+        check = checks[0]
+        def matches(key, data_type):
+            return bool(check(key if isinstance(key, bytes) else to_key(key)))
+        return matches
+    checks = tuple(checks)
+    def matches(key, data_type):
+        if data_types is not None and data_type not in data_types:
+            return False
+        if not isinstance(key, bytes):
+            key = to_key(key)
+        for check in checks:
+            if not check(key):
+                return False
+        return True
+    return matches
+
+
+def compile_header_filter(filters, raw_expiry=False):
+    """
+    Compile the conditions of `filters` on the metadata stored ahead of each key into a function of
+    `(expiry, idle, freq)`, or return None if there are none. The parser checks them before it reads the key.
+    `expiry` is a datetime, or milliseconds since the epoch if `raw_expiry` is True.
+        expires_before  datetime, keys must expire before it, e.g. to find the keys already expired at that time
+        expires_after   datetime, keys must expire after it
+        has_ttl         True for keys that have an expiry only, False for keys that have none only
+        min_idle        keys must have been idle for at least this many seconds (LRU dumps only)
+        max_freq        keys must have an LFU frequency of at most this (LFU dumps only)
+    Keys whose dump has no idle time or frequency do not match `min_idle` or `max_freq`.
+    """
+    checks = []
+    if filters.get('has_ttl') is not None:
+        has_ttl = bool(filters['has_ttl'])
+        checks.append(lambda expiry, idle, freq: (expiry is not None) == has_ttl)
+    if filters.get('expires_before') is not None:
+        expires_before = filters['expires_before']
+        if raw_expiry:
+            expires_before = to_milliseconds(expires_before)
+        checks.append(lambda expiry, idle, freq: expiry is not None and expiry < expires_before)
+    if filters.get('expires_after') is not None:
+        expires_after = filters['expires_after']
+        if raw_expiry:
+            expires_after = to_milliseconds(expires_after)
+        checks.append(lambda expiry, idle, freq: expiry is not None and expiry > expires_after)
+    if filters.get('min_idle') is not None:
+        min_idle = filters['min_idle']
+        checks.append(lambda expiry, idle, freq: idle is not None and idle >= min_idle)
+    if filters.get('max_freq') is not None:
+        max_freq = filters['max_freq']
+        checks.append(lambda expiry, idle, freq: freq is not None and freq <= max_freq)
+
+    if not checks:
+        return None
+    if len(checks) == 1:
+        return checks[0]
+    checks = tuple(checks)
+    return lambda expiry, idle, freq: all(check(expiry, idle, freq) for check in checks)
+
+
+def compile_value_filter(filters):
+    """
+    Compile the conditions of `filters` on the size of values into a function of `(key, elements, size)`,
+    or return None if there are none. The parser finds `elements` and `size` without decoding the value,
+    see `RdbParser.probe_value`.
+        min_elements         keys must have at least this many elements (strings have one)
+        min_serialized_size  the key and the value must take at least this many bytes in the dump, before
+                             compression. Only strings and the values stored in one piece (ziplists, intsets,
+                             zipmaps and quicklists) are checked, other keys always match.
+    """
+    min_elements = filters.get('min_elements')
+    min_size = filters.get('min_serialized_size')
+    if min_elements is None and min_size is None:
+        return None
+    def matches(key, elements, size):
+        if min_elements is not None and elements < min_elements:
+            return False
+        if min_size is not None and size is not None:
+            return len(key if isinstance(key, bytes) else to_key(key)) + size >= min_size
+        return True
+    return matches
+
+
+def exact_key_set(filters):
+    """Return the set of keys selected by the `key_set` and `keys_file` conditions, or None if there are none"""
+    key_set = None
+    if filters.get('key_set') is not None:
+        key_set = frozenset(to_key(k) for k in filters['key_set'])
+    if filters.get('keys_file'):
+        file_keys = load_key_set(filters['keys_file'])
+        key_set = file_keys if key_set is None else key_set & file_keys
+    return key_set
+
+
+def compile_stop_condition(filters, key_set):
+    """
+    Return a function that is called with each selected key once it has been parsed, and is True when
+    the parse can stop, or None if the whole dump must be parsed. It stops :
+        max_keys          after this many keys
+        stop_when_found   once every key of `key_set`, see `exact_key_set`, has been found in some database
+    Each parse needs a new function.
+    """
+    max_keys = filters.get('max_keys')
+    if filters.get('stop_when_found'):
+        if key_set is None:
+            raise Exception('compile_stop_condition', 'stop_when_found needs a key_set or keys_file filter')
+        wanted = len(key_set)
+    else:
+        wanted = None
+    if max_keys is None and wanted is None:
+        return None
+
+    found = set()
+    count = [0]
+    def done(key):
+        count[0] += 1
+        if max_keys is not None and count[0] >= max_keys:
+            return True
+        if wanted is not None:
+            found.add(key if isinstance(key, bytes) else to_key(key))
+            return len(found) >= wanted
+        return False
+    return done
+
+
+def prefix_matcher(prefixes):
+    """Return a function of a key that is True if it starts with one of `prefixes`"""
+    prefixes = tuple(set(prefixes))
+    if b'' in prefixes:
+        return lambda key: True
+    if len(prefixes) <= MAX_STARTSWITH_PREFIXES:
+        return lambda key: key.startswith(prefixes)
+
+    by_length = {}
+    for prefix in prefixes:
+        by_length.setdefault(len(prefix), set()).add(prefix)
+    # shortest first, so that the most common case of a few short prefixes is tried first
+    buckets = tuple(sorted((length, frozenset(bucket)) for length, bucket in by_length.items()))
+    def matches(key):
+        for length, bucket in buckets:
+            if key[:length] in bucket:
+                return True
+        return False
+    return matches
+
+
+def sample_matcher(rate):
+    """
+    Return a function of a key that is True for a deterministic sample of about `rate` of all keys.
+    Keys are picked by the CRC32 of their name, so the same keys are sampled in every dump.
+    """
+    if not 0 < rate <= 1:
+        raise Exception('sample_matcher', 'invalid sample rate %s, expected a number between 0 and 1' % rate)
+    threshold = int(rate * 0x100000000)
+    crc32 = zlib.crc32
+    return lambda key: crc32(key) & 0xffffffff < threshold
+
+
+def glob_matcher(patterns):
+    """
+    Return a function of a key that is True if it matches one of the glob `patterns`.
+    Literal patterns and patterns that only end with a * are matched without a regular expression.
+    """
+    exact = set()
+    prefixes = []
+    expressions = []
+    for pattern in patterns:
+        special = [m.start() for m in _GLOB_SPECIAL.finditer(pattern)]
+        if not special:
+            exact.add(pattern)
+        elif special == [len(pattern) - 1] and pattern.endswith(b'*'):
+            prefixes.append(pattern[:-1])
+        else:
+            expressions.append(glob_to_regexp(pattern))
+
+    checks = []
+    if exact:
+        exact = frozenset(exact)
+        checks.append(exact.__contains__)
+    if prefixes:
+        checks.append(prefix_matcher(prefixes))
+    if expressions:
+        glob_match = re.compile(b'|'.join(b'(?:' + e + b')' for e in expressions), re.DOTALL).match
+        checks.append(glob_match)
+
+    if len(checks) == 1:
+        return checks[0]
+    checks = tuple(checks)
+    return lambda key: any(check(key) for check in checks)
+
+
+class KeyGroupMatcher(object):
+    """
+    Finds which of several `patterns`, regular expressions that must match from the start of the key
+    as with re.match, a key belongs to. `group` returns the first pattern that matches, or None.
+
+    When every pattern is a literal prefix, such as "user:" or "user:.*", keys are looked up by their
+    leading characters in one dict per prefix length. Otherwise the patterns are combined into one
+    alternation of named groups, so that a key is classified with a single match whatever the number of patterns.
+    This is a class rather than a closure, so that it can be pickled to worker processes.
+    """
+    def __init__(self, patterns):
+        self.patterns = list(patterns)
+        self._by_length = None
+        self._match = None
+        self._expressions = None
+        if all(_LITERAL_PREFIX.match(p) for p in self.patterns):
+            by_length = {}
+            for index, pattern in enumerate(self.patterns):
+                prefix = pattern[:-2] if pattern.endswith('.*') else pattern
+                by_length.setdefault(len(prefix), {}).setdefault(prefix, index)
+            self._by_length = sorted(by_length.items())
+        elif not any(_BACK_REFERENCE.search(p) for p in self.patterns):
+            try:
+                self._match = re.compile('|'.join('(?P<_group%d>%s)' % (i, p) for i, p in enumerate(self.patterns))).match
+            except re.error:
+                pass  # e.g. inline flags, that are only allowed at the start of the whole expression
+        if self._by_length is None and self._match is None:
+            self._expressions = [re.compile(p).match for p in self.patterns]
+
+    def group(self, key):
+        if self._by_length is not None:
+            found = None
+            for length, prefixes in self._by_length:
+                index = prefixes.get(key[:length])
+                if index is not None and (found is None or index < found):
+                    found = index
+            return None if found is None else self.patterns[found]
+        elif self._match is not None:
+            m = self._match(key)
+            return None if m is None else self.patterns[int(m.lastgroup[len('_group'):])]
+        for pattern, match in zip(self.patterns, self._expressions):
+            if match(key):
+                return pattern
+        return None
+
+    def __getstate__(self):
+        return self.patterns
+
+    def __setstate__(self, patterns):
+        self.__init__(patterns)
+
+
+def glob_to_regexp(pattern):
+    """Translate a Redis glob pattern, given as bytes, into an anchored regular expression"""
+    out = []
+    i = 0
+    n = len(pattern)
+    while i < n:
+        c = pattern[i:i + 1]
+        i += 1
+        if c == b'*':
+            out.append(b'.*')
+        elif c == b'?':
+            out.append(b'.')
+        elif c == b'\\' and i < n:
+            out.append(re.escape(pattern[i:i + 1]))
+            i += 1
+        elif c == b'[':
+            negate = pattern[i:i + 1] == b'^'
+            if negate:
+                i += 1
+            ranges = []
+            while i < n and pattern[i:i + 1] != b']':
+                c = pattern[i:i + 1]
+                if c == b'\\' and i + 1 < n:
+                    c = pattern[i + 1:i + 2]
+                    i += 1
+                if pattern[i + 1:i + 2] == b'-' and i + 2 < n and pattern[i + 2:i + 3] != b']':
+                    start, end = sorted((c, pattern[i + 2:i + 3]))
+                    ranges.append(re.escape(start) + b'-' + re.escape(end))
+                    i += 3
+                else:
+                    ranges.append(re.escape(c))
+                    i += 1
+            # like Redis, an unterminated class runs to the end of the pattern
+            i += 1
+            out.append(b'[' + (b'^' if negate else b'') + b''.join(ranges) + b']' if ranges else
+                       (b'(?!)' if not negate else b'.'))
+        else:
+            out.append(re.escape(c))
+    return b''.join(out) + b'\\Z'
+
+
+def load_key_set(filename):
+    """Read a file with one key per line into a set of keys. Line endings are removed, empty lines are ignored."""
+    with open(filename, 'rb') as f:
+        return frozenset(line.rstrip(b'\r\n') for line in f if line.rstrip(b'\r\n'))
+
+
+def to_milliseconds(dt):
+    """Milliseconds since the epoch of a naive UTC datetime"""
+    return calendar.timegm(dt.utctimetuple()) * 1000 + dt.microsecond // 1000
+
+
+def to_key(key):
+    """Keys are bytes, except for keys stored as integers, and keys given as text on python 3"""
+    if isinstance(key, bytes):
+        return key
+    elif isinstance(key, type(u'')):
+        return key.encode('utf-8')
+    return str(key).encode('utf-8')
@@ -0,0 +1,253 @@
+import datetime
+import heapq
+import mmap
+import os
+import shutil
+import struct
+import tempfile
+from collections import namedtuple
+
+from rdbtools.parser import RdbParser, RdbCallback
+from rdbtools.compat import replace_file
+
+# A key index is a sidecar file next to a dump, that maps every key to the offset of its record.
+#
+# <header> <entry> * count <key bytes> * count
+#
+# Entries are fixed width and sorted by (key, db), so a key or a key prefix is found with
+# a binary search over the memory mapped file. The key bytes of all entries follow the entries.
+INDEX_MAGIC = b'RDBKIDX2'
+INDEX_SUFFIX = '.idx'
+
+# magic, dump file size, dump file mtime in ns, last 8 bytes of the dump file, number of entries
+_HEADER = struct.Struct('<8sQQ8sQ')
+# db number, data type, expiry in ms (-1 if none), record offset, key offset, key length
+_ENTRY = struct.Struct('<IBqQQI')
+
+# key length, db number, data type, expiry in ms, record offset of an entry in a sorted run, followed by the key
+_RUN_ENTRY = struct.Struct('<IIBqQ')
+
+# Keys sorted in memory at once while an index is built. The keys of larger dumps are sorted in runs
+# of this many keys written to temporary files, which are then merged.
+INDEX_RUN_SIZE = 1000000
+# Runs merged at once, so that few files are open however large the dump is
+INDEX_MAX_RUNS = 64
+
+_EPOCH = datetime.datetime(1970, 1, 1)
+
+IndexEntry = namedtuple('IndexEntry', ['db', 'key', 'data_type', 'expiry', 'offset'])
+
+
+def build_index(dump_file, index_file=None, engine='file', run_size=INDEX_RUN_SIZE):
+    """
+    Walk `dump_file` once and write a key index for it to `index_file`
+    (`dump_file` + '.idx' by default). Returns the path of the index.
+    At most `run_size` keys are held in memory, larger dumps are sorted in runs on disk next to the index.
+    The index is written to a temporary file first, so that a build that is interrupted never leaves a partial index.
+    """
+    if index_file is None:
+        index_file = dump_file + INDEX_SUFFIX
+    signature = _dump_signature(dump_file)
+    temp_dir = os.path.dirname(os.path.abspath(index_file))
+    parser = RdbParser(RdbCallback(None), engine=engine)
+    runs = []
+    entries = []
+    count = 0
+    temp_file = index_file + '.tmp'
+    try:
+        for db, key, data_type, expiry, offset in parser.scan_keys(dump_file):
+            if not isinstance(key, bytes):
+                key = str(key).encode('ascii')  # a key saved as an integer
+            entries.append((key, db, data_type, _to_milliseconds(expiry), offset))
+            count += 1
+            if len(entries) >= run_size:
+                runs.append(_write_run(sorted(entries), temp_dir))
+                entries = []
+                if len(runs) >= INDEX_MAX_RUNS:
+                    merged = _write_run(heapq.merge(*[_read_run(run) for run in runs]), temp_dir)
+                    for run in runs:
+                        run.close()
+                    runs = [merged]
+        entries.sort()
+        if runs:
+            runs.append(_write_run(entries, temp_dir))
+            entries = heapq.merge(*[_read_run(run) for run in runs])
+
+        with open(temp_file, 'wb') as out:
+            out.write(_HEADER.pack(INDEX_MAGIC, signature[0], signature[1], signature[2], count))
+            # the keys follow the entries, they are kept aside until all the entries are written
+            with tempfile.TemporaryFile(dir=temp_dir) as keys:
+                key_offset = 0
+                for key, db, data_type, expiry, offset in entries:
+                    out.write(_ENTRY.pack(db, data_type, expiry, offset, key_offset, len(key)))
+                    keys.write(key)
+                    key_offset += len(key)
+                keys.seek(0)
+                shutil.copyfileobj(keys, out)
+        replace_file(temp_file, index_file)
+    except:
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+        raise
+    finally:
+        for run in runs:
+            run.close()
+    return index_file
+
+
+def _write_run(entries, temp_dir):
+    """Write sorted `entries`, an iterable, to a temporary file, which is deleted when it is closed"""
+    run = tempfile.TemporaryFile(dir=temp_dir)
+    for key, db, data_type, expiry, offset in entries:
+        run.write(_RUN_ENTRY.pack(len(key), db, data_type, expiry, offset))
+        run.write(key)
+    run.seek(0)
+    return run
+
+
+def _read_run(run):
+    """Yield the entries of a run written by `_write_run`, in order"""
+    while True:
+        header = run.read(_RUN_ENTRY.size)
+        if not header:
+            return
+        key_length, db, data_type, expiry, offset = _RUN_ENTRY.unpack(header)
+        yield run.read(key_length), db, data_type, expiry, offset
+
+
+def open_index(dump_file, index_file=None, engine='file'):
+    """
+    Open the key index of `dump_file`, building it first if it does not exist, cannot be read
+    or was built for an older version of the dump
+    """
+    if index_file is None:
+        index_file = dump_file + INDEX_SUFFIX
+    if not _index_is_current(index_file, dump_file):
+        build_index(dump_file, index_file, engine)
+    return KeyIndex(index_file, dump_file)
+
+
+class KeyIndex(object):
+    """
+    Read access to a key index written by `build_index`.
+
+    Typical usage :
+        with KeyIndex('/var/redis/6379/dump.rdb.idx') as index:
+            entries = index.lookup_prefix(b'session:')
+        parser.parse_offsets('/var/redis/6379/dump.rdb', [(e.db, e.offset) for e in entries])
+
+    If `dump_file` is given, the index is checked against its size, modification time and last 8 bytes.
+    """
+    def __init__(self, index_file, dump_file=None):
+        if os.path.getsize(index_file) < _HEADER.size:
+            raise Exception('KeyIndex', '%s is not a key index' % index_file)
+        with open(index_file, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, dump_size, dump_mtime, dump_tail, self._count = _HEADER.unpack_from(self._map, 0)
+        self._dump_signature = (dump_size, dump_mtime, dump_tail)
+        self._keys_start = _HEADER.size + self._count * _ENTRY.size
+        if magic != INDEX_MAGIC or len(self._map) < self._keys_start:
+            self._map.close()
+            raise Exception('KeyIndex', '%s is not a key index' % index_file)
+        if dump_file is not None and not self.matches(dump_file):
+            self._map.close()
+            raise Exception('KeyIndex', 'Index %s is out of date for %s' % (index_file, dump_file))
+
+    def matches(self, dump_file):
+        """True if this index was built for the current contents of `dump_file`"""
+        return _dump_signature(dump_file) == self._dump_signature
+
+    def __len__(self):
+        return self._count
+
+    def entry(self, i):
+        db, data_type, expiry, offset, key_offset, key_length = _ENTRY.unpack_from(self._map, _HEADER.size + i * _ENTRY.size)
+        return IndexEntry(db, self._key_at(key_offset, key_length), data_type, _from_milliseconds(expiry), offset)
+
+    def _key_at(self, key_offset, key_length):
+        start = self._keys_start + key_offset
+        return self._map[start:start + key_length]
+
+    def _key(self, i):
+        fields = _ENTRY.unpack_from(self._map, _HEADER.size + i * _ENTRY.size)
+        return self._key_at(fields[4], fields[5])
+
+    def _bisect_left(self, key):
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._key(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def lookup(self, key, dbs=None):
+        """Return the entries for `key`, in every database or only in `dbs`"""
+        entries = []
+        i = self._bisect_left(key)
+        while i < self._count and self._key(i) == key:
+            entry = self.entry(i)
+            if not dbs or entry.db in dbs:
+                entries.append(entry)
+            i += 1
+        return entries
+
+    def lookup_prefix(self, prefix, dbs=None):
+        """Return the entries for all keys starting with `prefix`, in every database or only in `dbs`"""
+        entries = []
+        i = self._bisect_left(prefix)
+        while i < self._count and self._key(i).startswith(prefix):
+            entry = self.entry(i)
+            if not dbs or entry.db in dbs:
+                entries.append(entry)
+            i += 1
+        return entries
+
+    def close(self):
+        self._map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def _index_is_current(index_file, dump_file):
+    if not os.path.exists(index_file):
+        return False
+    try:
+        index = KeyIndex(index_file)
+    except Exception:
+        return False  # not an index, or a truncated one, which is rebuilt
+    with index:
+        return index.matches(dump_file)
+
+
+def _dump_signature(dump_file):
+    """
+    The size, modification time in ns and last 8 bytes of `dump_file`. A dump rewritten in the same second
+    with the same size, e.g. by a BGSAVE of a dataset that did not grow, still has another checksum at its end.
+    """
+    stat = os.stat(dump_file)
+    mtime = getattr(stat, 'st_mtime_ns', None)
+    if mtime is None:
+        mtime = int(stat.st_mtime * 1000000000)  # python 2
+    with open(dump_file, 'rb') as f:
+        f.seek(max(stat.st_size - 8, 0))
+        tail = f.read(8).ljust(8, b'\0')
+    return stat.st_size, mtime, tail
+
+
+def _to_milliseconds(expiry):
+    if expiry is None:
+        return -1
+    delta = expiry - _EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1000 + delta.microseconds // 1000
+
+
+def _from_milliseconds(expiry):
+    if expiry < 0:
+        return None
+    return _EPOCH + datetime.timedelta(milliseconds=expiry)
@@ -1,43 +1,132 @@
+import os
+import re
 import sys
+import time
 import codecs
 from collections import namedtuple
-import random
-import bisect
+import math
 from distutils.version import StrictVersion
 try:
     import ujson as json
 except:
     import json
 
-from rdbtools.parser import RdbCallback
+from rdbtools.parser import RdbCallback, expiry_to_datetime, ziplist_entry_size, STRING_CHUNK_SIZE
 from rdbtools.encodehelpers import bytes_to_unicode
+from rdbtools.sketches import Reservoir, QuantileSketch, log_bucket
+from rdbtools.filters import KeyGroupMatcher
+from rdbtools.allocators import get_allocator
+from rdbtools.compat import replace_file
 
-from heapq import heappush, nlargest, heappop
+from heapq import heappush, heapreplace, nlargest, heappop, heapify
 
 ZSKIPLIST_MAXLEVEL=32
 ZSKIPLIST_P=0.25
+# skiplist nodes get a random level, 1 + the number of successes of probability ZSKIPLIST_P up to ZSKIPLIST_MAXLEVEL,
+# so each node is sized with the expected number of levels rather than a random one
+ZSKIPLIST_EXPECTED_LEVEL = (1 - ZSKIPLIST_P ** ZSKIPLIST_MAXLEVEL) / (1 - ZSKIPLIST_P)
 REDIS_SHARED_INTEGERS = 10000
+# Redis saves the strings that hold a 32 bit integer as integers. Raw strings that hold an integer have
+# at least the 10 digits of 2**31, and at most the 20 characters of a 64 bit integer
+MIN_RAW_INTEGER_LENGTH = 10
+MAX_INTEGER_LENGTH = 20
+
+# Most that MemoryCallback adds to a key, besides twice the length of the key and of its value as stored
+# in the dump : the dict entry, robj, sds headers and expiry entry, with room to spare
+MAX_KEY_OVERHEAD = 256
+
+# PrintAllKeys rewrites its snapshot of the largest keys every this many seconds, checking the time
+# once every SNAPSHOT_CHECK_RECORDS records
+SNAPSHOT_INTERVAL = 60
+SNAPSHOT_CHECK_RECORDS = 1000
+
+# NamespaceTree keeps at most this many namespaces, and folds the children of a namespace into wildcards
+# once it has more than NAMESPACE_MAX_CHILDREN of them. Pruning brings the tree down to NAMESPACE_PRUNE_TO of its budget.
+NAMESPACE_MAX_NODES = 10000
+NAMESPACE_MAX_CHILDREN = 100
+NAMESPACE_PRUNE_TO = 0.9
+# key segments that are certainly identifiers : numbers, UUIDs and hex digests
+ID_SEGMENT = re.compile(r'(?:[0-9]+|[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}|[0-9a-fA-F]{16,})\Z')
+
+CSV_HEADERS = ("database", "type", "key", "size_in_bytes", "encoding", "num_elements", "len_largest_element", "expiry")
+
+def min_bytes_filters(min_bytes, redis_version='5.0'):
+    """
+    Return filters that skip, without decoding them, keys that MemoryCallback would certainly size
+    below `min_bytes`. Allocator rounding at most doubles the key and the value, so a key cannot
+    use more than twice its serialized size (see the `min_serialized_size` filter) plus MAX_KEY_OVERHEAD.
+
+    Before redis 3.2, small lists are sized as linked lists, which are much larger than their
+    serialized size, so no key is skipped for these versions.
+    """
+    if StrictVersion(redis_version) < StrictVersion('3.2'):
+        return {}
+    return {'min_serialized_size': max(0, (int(min_bytes) - MAX_KEY_OVERHEAD) // 2)}
+
+# StatsAggregator keeps a random sample of this many points of each scatter
+SCATTER_POINTS = 1000
+# and reports these quantiles of the memory and length of each type
+QUANTILES = (0.5, 0.9, 0.99)
 
 MemoryRecord = namedtuple('MemoryRecord', ['database', 'type', 'key', 'bytes', 'encoding','size', 'len_largest_element', 'expiry'])
 
 class StatsAggregator(object):
-    def __init__(self, key_groupings = None):
+    """
+    Aggregates memory records for the memory report.
+
+    When the keys are a sample, taken with probability `sample_rate` (see the `sample` filter),
+    each key record counts for 1 / `sample_rate` keys in the aggregates and histograms, which makes
+    them Horvitz-Thompson estimates of the totals. The variance of each estimate is kept in
+    `variances`, see `confidence_intervals`. Scatters only have the sampled keys.
+
+    Memory does not grow with the number of keys : histograms have log-scale buckets (see `log_bucket`),
+    scatters are a random sample of at most SCATTER_POINTS points, and the memory and length of each type
+    are summarized in a QuantileSketch, see `quantile`.
+
+    `key_groupings` is a list of regular expressions. Each key is counted in the first one it matches,
+    see `KeyGroupMatcher`, in the `group_memory`, `group_count`, `group_encoding_memory` and
+    `group_encoding_count` aggregates. The encoding aggregates are keyed by "pattern (encoding)".
+    """
+    def __init__(self, key_groupings = None, sample_rate = None):
+        self._key_groups = KeyGroupMatcher(key_groupings) if key_groupings else None
         self.aggregates = {}
+        self.variances = {}
         self.scatters = {}
         self.histograms = {}
+        self.sketches = {}
         self.metadata = {}
+        self._reservoirs = {}
+        self.sample_rate = sample_rate
+        if sample_rate is not None:
+            self.metadata['sample_rate'] = sample_rate
 
     def next_record(self, record):
-        self.add_aggregate('database_memory', record.database, record.bytes)
-        self.add_aggregate('database_memory', 'all', record.bytes)
-        self.add_aggregate('type_memory', record.type, record.bytes)
-        self.add_aggregate('encoding_memory', record.encoding, record.bytes)
+        # records that are not keys (e.g. dict) are not sampled
+        weight = 1
+        if self.sample_rate is not None and record.key is not None:
+            weight = 1.0 / self.sample_rate
+
+        self.add_aggregate('database_memory', record.database, record.bytes, weight)
+        self.add_aggregate('database_memory', 'all', record.bytes, weight)
+        self.add_aggregate('type_memory', record.type, record.bytes, weight)
+        self.add_aggregate('encoding_memory', record.encoding, record.bytes, weight)
         
-        self.add_aggregate('type_count', record.type, 1)
-        self.add_aggregate('encoding_count', record.encoding, 1)
+        self.add_aggregate('type_count', record.type, 1, weight)
+        self.add_aggregate('encoding_count', record.encoding, 1, weight)
+
+        if self._key_groups is not None and record.key is not None:
+            group = self._key_groups.group(record.key)
+            if group is not None:
+                group_encoding = '%s (%s)' % (group, record.encoding)
+                self.add_aggregate('group_memory', group, record.bytes, weight)
+                self.add_aggregate('group_count', group, 1, weight)
+                self.add_aggregate('group_encoding_memory', group_encoding, record.bytes, weight)
+                self.add_aggregate('group_encoding_count', group_encoding, 1, weight)
     
-        self.add_histogram(record.type + "_length", record.size)
-        self.add_histogram(record.type + "_memory", (record.bytes/10) * 10)
+        self.add_histogram(record.type + "_length", record.size, weight)
+        self.add_histogram(record.type + "_memory", record.bytes, weight)
+        self.add_sketch(record.type + "_length", record.size, weight)
+        self.add_sketch(record.type + "_memory", record.bytes, weight)
         
         if record.type == 'list':
             self.add_scatter('list_memory_by_length', record.bytes, record.size)
@@ -54,68 +143,369 @@ class StatsAggregator(object):
         else:
             raise Exception('Invalid data type %s' % record.type)
 
-    def add_aggregate(self, heading, subheading, metric):
+    def add_aggregate(self, heading, subheading, metric, weight=1):
         if not heading in self.aggregates :
             self.aggregates[heading] = {}
         
         if not subheading in self.aggregates[heading]:
             self.aggregates[heading][subheading] = 0
             
-        self.aggregates[heading][subheading] += metric
+        self.aggregates[heading][subheading] += metric * weight
+        if weight != 1:
+            # unbiased estimate of the variance of a Horvitz-Thompson total, when keys are sampled independently
+            variances = self.variances.setdefault(heading, {})
+            variances[subheading] = variances.get(subheading, 0) + (weight * weight - weight) * metric * metric
     
-    def add_histogram(self, heading, metric):
+    def add_histogram(self, heading, metric, weight=1):
         if not heading in self.histograms:
             self.histograms[heading] = {}
 
-        if not metric in self.histograms[heading]:
-            self.histograms[heading][metric] = 1
+        bucket = log_bucket(metric) if metric is not None else None
+        if not bucket in self.histograms[heading]:
+            self.histograms[heading][bucket] = weight
         else :
-            self.histograms[heading][metric] += 1
+            self.histograms[heading][bucket] += weight
     
     def add_scatter(self, heading, x, y):
-        if not heading in self.scatters:
-            self.scatters[heading] = []
-        self.scatters[heading].append([x, y])
+        if not heading in self._reservoirs:
+            self._reservoirs[heading] = Reservoir(SCATTER_POINTS)
+        reservoir = self._reservoirs[heading]
+        reservoir.add([x, y])
+        self.scatters[heading] = reservoir.items
+
+    def add_sketch(self, heading, metric, weight=1):
+        if metric is None:
+            return
+        if not heading in self.sketches:
+            self.sketches[heading] = QuantileSketch()
+        self.sketches[heading].add(metric, weight)
+
+    def quantile(self, heading, q):
+        """
+        Return the quantile `q`, between 0 and 1, of the memory or length of the keys of a type,
+        e.g. `quantile('hash_memory', 0.99)`, within 1% of the actual value. None if there are no such keys.
+        """
+        if not heading in self.sketches:
+            return None
+        return self.sketches[heading].quantile(q)
 
     def set_metadata(self, key, val):
         self.metadata[key] = val
+
+    def merge(self, other):
+        """Add the aggregates, histograms and scatters collected by `other`, e.g. in another process, to this one"""
+        for heading, values in other.aggregates.items():
+            for subheading, metric in values.items():
+                self.add_aggregate(heading, subheading, metric)
+        for heading, values in other.variances.items():
+            variances = self.variances.setdefault(heading, {})
+            for subheading, variance in values.items():
+                variances[subheading] = variances.get(subheading, 0) + variance
+        for heading, values in other.histograms.items():
+            histogram = self.histograms.setdefault(heading, {})
+            for metric, count in values.items():
+                histogram[metric] = histogram.get(metric, 0) + count
+        for heading, reservoir in other._reservoirs.items():
+            self._reservoirs.setdefault(heading, Reservoir(SCATTER_POINTS)).merge(reservoir)
+            self.scatters[heading] = self._reservoirs[heading].items
+        for heading, sketch in other.sketches.items():
+            self.sketches.setdefault(heading, QuantileSketch()).merge(sketch)
+        self.metadata.update(other.metadata)
   
+    def confidence_intervals(self, z=1.96):
+        """
+        Return the `[low, high]` confidence interval of every aggregate, by default at 95%.
+        Aggregates of records that are not sampled are exact, and have an interval of zero width.
+        """
+        intervals = {}
+        for heading, values in self.aggregates.items():
+            variances = self.variances.get(heading, {})
+            intervals[heading] = {}
+            for subheading, estimate in values.items():
+                margin = z * math.sqrt(variances.get(subheading, 0))
+                intervals[heading][subheading] = [max(0, estimate - margin), estimate + margin]
+        return intervals
+
     def get_json(self):
-        return json.dumps({"aggregates": self.aggregates, "scatters": self.scatters, "histograms": self.histograms, "metadata": self.metadata})
+        quantiles = dict((heading, dict(('p%d' % round(q * 100), sketch.quantile(q)) for q in QUANTILES))
+                         for heading, sketch in self.sketches.items())
+        report = {"aggregates": self.aggregates, "scatters": self.scatters, "histograms": self.histograms,
+                  "quantiles": quantiles, "metadata": self.metadata}
+        if self.sample_rate is not None:
+            report["confidence_intervals"] = self.confidence_intervals()
+        return json.dumps(report)
         
+def write_csv_header(out):
+    out.write(codecs.encode(",".join(CSV_HEADERS) + "\n", 'latin-1'))
+
+def write_csv_record(out, record):
+    rec_str = "%d,%s,%s,%d,%s,%d,%d,%s\n" % (
+        record.database, record.type, record.key, record.bytes, record.encoding, record.size,
+        record.len_largest_element,
+        record.expiry.isoformat() if record.expiry else '')
+    out.write(codecs.encode(rec_str, 'latin-1'))
+
 class PrintAllKeys(object):
-    def __init__(self, out, bytes, largest):
+    def __init__(self, out, bytes, largest, largest_by=None, snapshot_file=None, snapshot_interval=SNAPSHOT_INTERVAL):
+        """
+        With `largest`, only the `largest` biggest keys are written, at the end of the dump. They are kept in
+        a min-heap of `largest` records, so memory does not grow with the number of keys.
+        `largest_by` is 'type' or 'database' to keep the `largest` biggest keys of each type or database instead.
+        `snapshot_file` is then rewritten with the biggest keys found so far every `snapshot_interval` seconds.
+        """
         self._bytes = bytes
         self._largest = largest
         self._out = out
-        headers = "%s,%s,%s,%s,%s,%s,%s,%s\n" % (
-            "database", "type", "key", "size_in_bytes", "encoding", "num_elements", "len_largest_element", "expiry")
-        self._out.write(codecs.encode(headers, 'latin-1'))
+        write_csv_header(self._out)
 
+        if largest_by not in (None, 'type', 'database'):
+            raise Exception('PrintAllKeys', 'invalid largest_by %s, expected type or database' % largest_by)
         if self._largest is not None:
-            self._heap = []
+            self._heaps = {}
+            self._group = (lambda record: None) if largest_by is None else (lambda record: getattr(record, largest_by))
+            self._snapshot_file = snapshot_file
+            self._snapshot_interval = snapshot_interval
+            self._next_snapshot = time.time() + snapshot_interval
+            self._records = 0
     
     def next_record(self, record) :
         if record.key is None:
             return  # some records are not keys (e.g. dict)
         if self._largest is None:
             if self._bytes is None or record.bytes >= int(self._bytes):
-                rec_str = "%d,%s,%s,%d,%s,%d,%d,%s\n" % (
-                    record.database, record.type, record.key, record.bytes, record.encoding, record.size,
-                    record.len_largest_element,
-                    record.expiry.isoformat() if record.expiry else '')
-                self._out.write(codecs.encode(rec_str, 'latin-1'))
-        else:
-            heappush(self._heap, (record.bytes, record))
+                write_csv_record(self._out, record)
+            return
+
+        heap = self._heaps.setdefault(self._group(record), [])
+        entry = (record.bytes, record)
+        if len(heap) < int(self._largest):
+            heappush(heap, entry)
+        elif entry > heap[0]:
+            heapreplace(heap, entry)
+        if self._snapshot_file is not None:
+            self._records += 1
+            if self._records % SNAPSHOT_CHECK_RECORDS == 0 and time.time() >= self._next_snapshot:
+                self.write_snapshot()
+
+    def write_snapshot(self):
+        """Replace the snapshot file with the biggest keys found so far, biggest first"""
+        temp_file = self._snapshot_file + '.tmp'
+        with open(temp_file, 'wb') as f:
+            write_csv_header(f)
+            for group in sorted(self._heaps):
+                for bytes, record in sorted(self._heaps[group], reverse=True):
+                    if self._bytes is None or bytes >= int(self._bytes):
+                        write_csv_record(f, record)
+        replace_file(temp_file, self._snapshot_file)
+        self._next_snapshot = time.time() + self._snapshot_interval
 
     def end_rdb(self):
         if self._largest is not None:
-            self._heap = nlargest(int(self._largest), self._heap)
-            self._largest = None
+            if self._snapshot_file is not None:
+                self.write_snapshot()
+            for group in sorted(self._heaps):
+                heap = nlargest(int(self._largest), self._heaps[group])
+                while heap:
+                    bytes, record = heappop(heap)
+                    if self._bytes is None or bytes >= int(self._bytes):
+                        write_csv_record(self._out, record)
+            self._heaps = {}
+
+class _Namespace(object):
+    __slots__ = ('children', 'keys', 'bytes', 'largest_key', 'largest_bytes', 'collapsed', 'pruned', 'error')
+
+    def __init__(self, error=0):
+        self.children = {}
+        self.keys = 0
+        self.bytes = 0
+        self.largest_key = None
+        self.largest_bytes = 0
+        self.collapsed = False
+        self.pruned = 0  # most memory of a pruned child
+        self.error = error
+
+    def add(self, keys, bytes, largest_key, largest_bytes):
+        self.keys += keys
+        self.bytes += bytes
+        if largest_key is not None and (self.largest_key is None or largest_bytes > self.largest_bytes):
+            self.largest_key = largest_key
+            self.largest_bytes = largest_bytes
+
+    def merge(self, other):
+        """Add `other` and its children to this namespace, and return the number of namespaces folded into existing ones"""
+        self.add(other.keys, other.bytes, other.largest_key, other.largest_bytes)
+        self.pruned = max(self.pruned, other.pruned)
+        self.error += other.error
+        self.collapsed = self.collapsed or other.collapsed
+        folded = 1
+        for name, child in other.children.items():
+            if name in self.children:
+                folded += self.children[name].merge(child)
+            else:
+                self.children[name] = child
+        return folded
+
+    def size(self):
+        return 1 + sum(child.size() for child in self.children.values())
+
+class NamespaceTree(object):
+    """
+    Builds the tree of key namespaces, with the memory, number of keys and largest key of each,
+    from the records of a MemoryCallback, in one pass and in bounded memory.
+
+    Keys are split after each of the `delimiters` characters, so that "svc:user:42:name" is counted in
+    the namespaces "svc:", "svc:user:", "svc:user:*:" and "svc:user:*:name". Segments that are numbers,
+    UUIDs or hex digests are replaced by a * wildcard, and so are the children of a namespace once it
+    has more than `max_children`, except those with a large share of its memory.
+
+    The tree keeps at most `max_nodes` namespaces. Past them, the namespaces with the least memory are
+    pruned, leaves first, and are then only counted in their parent. As in the Space-Saving heavy hitters
+    algorithm, a namespace created after one of its siblings was pruned may have missed as many bytes
+    as that sibling had, which is reported as its `error`.
+
+    With `out`, the namespaces are written as CSV at the end of the dump, see `rows`.
+    Keys sampled with probability `sample_rate` count for 1 / `sample_rate` keys.
+    """
+    def __init__(self, out=None, delimiters=':', max_nodes=NAMESPACE_MAX_NODES, max_children=NAMESPACE_MAX_CHILDREN,
+                 sample_rate=None):
+        if not delimiters:
+            raise Exception('NamespaceTree', 'at least one delimiter is needed')
+        self._out = out
+        self.delimiters = delimiters
+        self._split = re.compile('([%s])' % re.escape(delimiters)).split
+        self.max_nodes = max_nodes
+        self.max_children = max_children
+        self.sample_rate = sample_rate
+        self.root = _Namespace()
+        self._nodes = 1
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_out'] = None
+        del state['_split']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._split = re.compile('([%s])' % re.escape(self.delimiters)).split
+
+    def next_record(self, record):
+        if record.key is None:
+            return  # some records are not keys (e.g. dict)
+        weight = 1 if self.sample_rate is None else 1.0 / self.sample_rate
+        keys = weight
+        bytes = record.bytes * weight
+        node = self.root
+        node.add(keys, bytes, record.key, record.bytes)
+        for name in self.segments(record.key):
+            child = node.children.get(name)
+            if child is None:
+                child = self.add_child(node, name)
+            child.add(keys, bytes, record.key, record.bytes)
+            node = child
+        if self._nodes > self.max_nodes:
+            self.prune()
+
+    def segments(self, key):
+        """Split `key` into the names of its namespaces, each ending with its delimiter, with identifiers replaced by *"""
+        parts = self._split(key)
+        is_id = ID_SEGMENT.match
+        names = []
+        for i in range(0, len(parts) - 1, 2):
+            names.append(('*' if is_id(parts[i]) else parts[i]) + parts[i + 1])
+        if parts[-1]:
+            names.append('*' if is_id(parts[-1]) else parts[-1])
+        return names
+
+    def add_child(self, node, name):
+        if node.collapsed or len(node.children) >= self.max_children:
+            if not node.collapsed:
+                self.collapse(node)
+            name = wildcard(name, self.delimiters)
+            child = node.children.get(name)
+            if child is not None:
+                return child
+        child = node.children[name] = _Namespace(node.pruned)
+        self._nodes += 1
+        return child
 
-            while self._heap:
-                bytes, record = heappop(self._heap)
-                self.next_record(record)
+    def collapse(self, node):
+        """
+        Fold the children of `node` into * wildcards, one for each delimiter they end with,
+        except the heavy hitters that have at least 1 / `max_children` of its memory
+        """
+        children = node.children
+        node.children = {}
+        node.collapsed = True
+        for name, child in children.items():
+            if child.bytes * self.max_children < node.bytes:
+                name = wildcard(name, self.delimiters)
+            if name in node.children:
+                self._nodes -= node.children[name].merge(child)
+            else:
+                node.children[name] = child
+
+    def prune(self):
+        """Remove the namespaces with the least memory, leaves first, until the tree is within its budget"""
+        target = int(self.max_nodes * NAMESPACE_PRUNE_TO)
+        # a heap of (bytes, order, name, parent, up) for the leaves, where `up` is the (name, parent, up)
+        # of the parent, so that it becomes a leaf in turn once its last child is pruned
+        leaves = []
+        stack = [(self.root, None)]
+        while stack:
+            node, up = stack.pop()
+            for name, child in node.children.items():
+                if child.children:
+                    stack.append((child, (name, node, up)))
+                else:
+                    leaves.append((child.bytes, len(leaves), name, node, up))
+        heapify(leaves)
+        order = len(leaves)
+        while self._nodes > target and leaves:
+            bytes, _, name, parent, up = heappop(leaves)
+            child = parent.children.pop(name)
+            parent.pruned = max(parent.pruned, child.bytes + child.error)
+            self._nodes -= 1
+            if not parent.children and up is not None:
+                heappush(leaves, (parent.bytes, order) + up)
+                order += 1
+
+    def merge(self, other):
+        """Add the namespaces collected by `other`, e.g. in another process, to this tree"""
+        self.root.merge(other.root)
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            if node.collapsed or len(node.children) > self.max_children:
+                self.collapse(node)
+            stack.extend(node.children.values())
+        self._nodes = self.root.size()
+        if self._nodes > self.max_nodes:
+            self.prune()
+
+    def rows(self):
+        """
+        Yield a `(namespace, keys, bytes, largest_key, largest_key_bytes, error)` tuple for every namespace,
+        depth first, with the namespaces that use the most memory first
+        """
+        stack = [('', self.root)]
+        while stack:
+            prefix, node = stack.pop()
+            if node is not self.root:
+                yield (prefix, node.keys, node.bytes, node.largest_key, node.largest_bytes, node.error)
+            for name, child in sorted(node.children.items(), key=lambda item: item[1].bytes):
+                stack.append((prefix + name, child))
+
+    def end_rdb(self):
+        if self._out is None:
+            return
+        self._out.write(codecs.encode("namespace,keys,size_in_bytes,largest_key,largest_key_size_in_bytes,error\n", 'latin-1'))
+        for row in self.rows():
+            self._out.write(codecs.encode("%s,%d,%d,%s,%d,%d\n" % row, 'latin-1'))
+
+def wildcard(name, delimiters):
+    """The * wildcard that stands for the namespace `name`, with the same delimiter"""
+    return '*' + name[-1] if name and name[-1] in delimiters else '*'
 
 class PrintJustKeys(object):
     def __init__(self, out):
@@ -129,9 +519,27 @@ class MemoryCallback(RdbCallback):
     '''Calculates the memory used if this rdb file were loaded into RAM
         The memory usage is approximate, and based on heuristics.
     '''
-    def __init__(self, stream, architecture, redis_version='5.0', string_escape=None):
+    # only the length of compressed strings is needed
+    lazy_lzf_strings = True
+    # info is only read while a key is started, and expiries are only converted for the records
+    raw_key_metadata = True
+    # integer encoded strings are known from the dump, rather than found by parsing every string
+    element_encodings = True
+    # only the length of large strings is needed, so the parser skips over them
+    string_chunk_size = STRING_CHUNK_SIZE
+    # compact encodings are sized from sizeof_value, their elements are only counted and measured
+    element_summaries = True
+
+    def __init__(self, stream, architecture, redis_version='5.0', string_escape=None, sample_rate=None,
+                 allocator='jemalloc4'):
+        """
+        If the parser only passes a sample of the keys, taken with probability `sample_rate`,
+        the database dicts and internal fragmentation are extrapolated to all keys.
+        `allocator` is the name of the allocator model that allocations are rounded with, see `allocators.ALLOCATORS`.
+        """
         super(MemoryCallback, self).__init__(string_escape)
         self._stream = stream
+        self._sample_rate = sample_rate
         self._dbnum = 0
         self._current_size = 0
         self._current_encoding = None
@@ -153,11 +561,25 @@ class MemoryCallback(RdbCallback):
             self._pointer_size = 4
             self._long_size = 4
             self._architecture = 32
+        self._allocation = get_allocator(allocator, self._architecture).allocation
+
+        # the costs that depend on the version and architecture only, rather than on each element
+        self._legacy_sds = self._redis_version < StrictVersion('3.2')
+        self._quicklist = not self._legacy_sds
+        if not self._quicklist:
+            # lists are sized as linked lists element by element, which needs the strings
+            self.element_summaries = False
+        # before redis 4.0, the elements of hashes, sets, sorted sets and linked lists each had a robj
+        self._element_robj_overhead = self.robj_overhead() if self._redis_version < StrictVersion('4.0') else 0
+        self._hashtable_entry_overhead = 2*self.sizeof_pointer() + 8
+        self._skiplist_entry_overhead = (self._hashtable_entry_overhead + 2*self.sizeof_pointer() + 8 +
+                                         (self.sizeof_pointer() + 8) * ZSKIPLIST_EXPECTED_LEVEL)
 
     def emit_record(self, record_type, key, byte_count, encoding, size, largest_el, expiry):
         if key is not None:
             key = bytes_to_unicode(key, self._escape, skip_printable=True)
-        record = MemoryRecord(self._dbnum, record_type, key, byte_count, encoding, size, largest_el, expiry)
+        record = MemoryRecord(self._dbnum, record_type, key, byte_count, encoding, size, largest_el,
+                              expiry_to_datetime(expiry))
         self._stream.next_record(record)
 
     def start_rdb(self):
@@ -177,8 +599,8 @@ class MemoryCallback(RdbCallback):
         self._db_expires = 0
 
     def end_database(self, db_number):
-        self.emit_record("dict", None, self.hashtable_overhead(self._db_keys), None, None, None, None)
-        self.emit_record("dict", None, self.hashtable_overhead(self._db_expires), None, None, None, None)
+        self.emit_record("dict", None, self.hashtable_overhead(self.extrapolate(self._db_keys)), None, None, None, None)
+        self.emit_record("dict", None, self.hashtable_overhead(self.extrapolate(self._db_expires)), None, None, None, None)
         if hasattr(self._stream, 'end_database'):
             self._stream.end_database(db_number)
 
@@ -189,42 +611,68 @@ class MemoryCallback(RdbCallback):
             self._stream.set_metadata('used_mem', self._aux_used_mem)
             self._stream.set_metadata('redis_ver', self._aux_redis_ver)
             self._stream.set_metadata('redis_bits', self._aux_redis_bits)
-            self._stream.set_metadata('internal_frag', self._total_internal_frag)
+            self._stream.set_metadata('internal_frag', self.extrapolate(self._total_internal_frag))
+
+    def extrapolate(self, count):
+        """Estimate of `count` over all keys, from its value over the sampled keys"""
+        if self._sample_rate is None:
+            return count
+        return int(round(count / float(self._sample_rate)))
 
     def set(self, key, value, expiry, info):
-        self._current_encoding = info['encoding']
-        size = self.top_level_object_overhead(key, expiry) + self.sizeof_string(value)
+        self._current_encoding = info.encoding
+        size = self.top_level_object_overhead(key, expiry) + self.sizeof_element(value, info.value_encoding)
         length = self.element_length(value)
         self.emit_record("string", key, size, self._current_encoding, length, length, expiry)
         self.end_key()
+
+    def set_start(self, key, length, expiry, info):
+        self._current_encoding = info.encoding
+        self._current_size = self.top_level_object_overhead(key, expiry) + self.sizeof_sds(length)
+        self._current_length = length
+        self._key_expiry = expiry
+
+    def set_end(self, key):
+        self.emit_record("string", key, self._current_size, self._current_encoding, self._current_length,
+                         self._current_length, self._key_expiry)
+        self.end_key()
     
     def start_hash(self, key, length, expiry, info):
-        self._current_encoding = info['encoding']
+        self._current_encoding = info.encoding
         self._current_length = length
         self._key_expiry = expiry
         size = self.top_level_object_overhead(key, expiry)
         
-        if 'sizeof_value' in info:
-            size += info['sizeof_value']
-        elif 'encoding' in info and info['encoding'] == 'hashtable':
+        if info.sizeof_value is not None:
+            size += info.sizeof_value
+        elif info.encoding == 'hashtable':
             size += self.hashtable_overhead(length)
         else:
             raise Exception('start_hash', 'Could not find encoding or sizeof_value in info object %s' % info)
         self._current_size = size
     
     def hset(self, key, field, value):
+        self.hset_encoded(key, field, value, None, None)
+
+    def hset_encoded(self, key, field, value, field_encoding, value_encoding):
         if(self.element_length(field) > self._len_largest_element) :
             self._len_largest_element = self.element_length(field)
         if(self.element_length(value) > self._len_largest_element) :
             self._len_largest_element = self.element_length(value)
         
         if self._current_encoding == 'hashtable':
-            self._current_size += self.sizeof_string(field)
-            self._current_size += self.sizeof_string(value)
-            self._current_size += self.hashtable_entry_overhead()
-            if self._redis_version < StrictVersion('4.0'):
-                self._current_size += 2*self.robj_overhead()
+            self._current_size += self.sizeof_element(field, field_encoding)
+            self._current_size += self.sizeof_element(value, value_encoding)
+            self._current_size += self._hashtable_entry_overhead + 2*self._element_robj_overhead
     
+    def hset_many(self, key, fields, values):
+        if self._current_encoding == 'hashtable':
+            super(MemoryCallback, self).hset_many(key, fields, values)
+        else:
+            # compact encodings are sized from sizeof_value, only the largest element is left to find
+            self.update_len_largest_element(fields)
+            self.update_len_largest_element(values)
+
     def end_hash(self, key):
         self.emit_record("hash", key, self._current_size, self._current_encoding, self._current_length,
                          self._len_largest_element, self._key_expiry)
@@ -235,15 +683,26 @@ class MemoryCallback(RdbCallback):
         self.start_hash(key, cardinality, expiry, info)
 
     def sadd(self, key, member):
+        self.sadd_encoded(key, member, None)
+
+    def sadd_encoded(self, key, member, encoding):
         if(self.element_length(member) > self._len_largest_element) :
             self._len_largest_element = self.element_length(member)
             
         if self._current_encoding == 'hashtable':
-            self._current_size += self.sizeof_string(member)
-            self._current_size += self.hashtable_entry_overhead()
-            if self._redis_version < StrictVersion('4.0'):
-                self._current_size += self.robj_overhead()
+            self._current_size += self.sizeof_element(member, encoding)
+            self._current_size += self._hashtable_entry_overhead + self._element_robj_overhead
     
+    def sadd_many(self, key, members):
+        if self._current_encoding == 'hashtable':
+            super(MemoryCallback, self).sadd_many(key, members)
+        elif self._current_encoding == 'intset':
+            # every member is an integer, there is no need to look at them
+            if len(members) and self._long_size > self._len_largest_element:
+                self._len_largest_element = self._long_size
+        else:
+            self.update_len_largest_element(members)
+
     def end_set(self, key):
         self.emit_record("set", key, self._current_size, self._current_encoding, self._current_length,
                          self._len_largest_element, self._key_expiry)
@@ -253,12 +712,12 @@ class MemoryCallback(RdbCallback):
         self._current_length = 0
         self._list_items_size = 0  # size of all elements in case list ends up using linked list
         self._list_items_zipped_size = 0  # size of all elements in case of ziplist of quicklist
-        self._current_encoding = info['encoding']
+        self._current_encoding = info.encoding
         size = self.top_level_object_overhead(key, expiry)
         self._key_expiry = expiry
 
         # ignore the encoding in the rdb, and predict the encoding that will be used at the target redis version
-        if self._redis_version >= StrictVersion('3.2'):
+        if self._quicklist:
             # default configuration of redis 3.2
             self._current_encoding = "quicklist"
             self._list_max_ziplist_size = 8192 # default is -2 which means 8k
@@ -274,9 +733,12 @@ class MemoryCallback(RdbCallback):
         self._current_size = size
             
     def rpush(self, key, value):
+        self.rpush_encoded(key, value, None)
+
+    def rpush_encoded(self, key, value, encoding):
         self._current_length += 1
         # in linked list, when the robj has integer encoding, the value consumes no memory on top of the robj
-        size_in_list = self.sizeof_string(value) if not self.is_integer_type(value) else 0
+        size_in_list = self.sizeof_element(value, encoding) if not self.is_integer_type(value) else 0
         # in ziplist and quicklist, this is the size of the value and the value header
         size_in_zip = self.ziplist_entry_overhead(value)
 
@@ -296,6 +758,28 @@ class MemoryCallback(RdbCallback):
             self._list_items_zipped_size += self.ziplist_entry_overhead(value)
         self._list_items_size += size_in_list  # not to be used in case of ziplist or quicklist
 
+    def element_summary(self, key, summary):
+        largest = summary.len_largest_string
+        if summary.integers and self._long_size > largest:
+            largest = self._long_size
+        if largest > self._len_largest_element:
+            self._len_largest_element = largest
+        if summary.entry_sizes is not None:
+            # the list is refilled into quicklist nodes, as in rpush_encoded
+            self._current_length += summary.count
+            self._list_items_zipped_size += sum(summary.entry_sizes)
+            max_size = self._list_max_ziplist_size
+            zips = self._cur_zips
+            zip_size = self._cur_zip_size
+            for size_in_zip in summary.entry_sizes:
+                if zip_size + size_in_zip > max_size:
+                    zip_size = size_in_zip
+                    zips += 1
+                else:
+                    zip_size += size_in_zip
+            self._cur_zips = zips
+            self._cur_zip_size = zip_size
+
     def end_list(self, key, info):
         if self._current_encoding == 'quicklist':
             self._current_size += self.quicklist_overhead(self._cur_zips)
@@ -307,8 +791,7 @@ class MemoryCallback(RdbCallback):
         else: #  linkedlist
             self._current_size += self.linkedlist_entry_overhead() * self._current_length
             self._current_size += self.linkedlist_overhead()
-            if self._redis_version < StrictVersion('4.0'):
-                self._current_size += self.robj_overhead() * self._current_length
+            self._current_size += self._element_robj_overhead * self._current_length
             self._current_size += self._list_items_size
         self.emit_record("list", key, self._current_size, self._current_encoding, self._current_length,
                          self._len_largest_element, self._key_expiry)
@@ -331,7 +814,7 @@ class MemoryCallback(RdbCallback):
 
     def start_stream(self, key, listpacks_count, expiry, info):
         self._key_expiry = expiry
-        self._current_encoding = info['encoding']
+        self._current_encoding = info.encoding
         self._current_size = self.top_level_object_overhead(key, expiry)
         self._current_size += self.sizeof_pointer()*2 + 8 + 16  # stream struct
         self._current_size += self.sizeof_pointer() + 8*2  # rax struct
@@ -374,29 +857,36 @@ class MemoryCallback(RdbCallback):
 
     def start_sorted_set(self, key, length, expiry, info):
         self._current_length = length
-        self._current_encoding = info['encoding']
+        self._current_encoding = info.encoding
         size = self.top_level_object_overhead(key, expiry)
         self._key_expiry = expiry
 
-        if 'sizeof_value' in info:
-            size += info['sizeof_value']
-        elif 'encoding' in info and info['encoding'] == 'skiplist':
+        if info.sizeof_value is not None:
+            size += info.sizeof_value
+        elif info.encoding == 'skiplist':
             size += self.skiplist_overhead(length)
         else:
             raise Exception('start_sorted_set', 'Could not find encoding or sizeof_value in info object %s' % info)
         self._current_size = size
     
     def zadd(self, key, score, member):
+        self.zadd_encoded(key, score, member, None)
+
+    def zadd_encoded(self, key, score, member, encoding):
         if(self.element_length(member) > self._len_largest_element):
             self._len_largest_element = self.element_length(member)
         
         if self._current_encoding == 'skiplist':
             self._current_size += 8 # score (double)
-            self._current_size += self.sizeof_string(member)
-            if self._redis_version < StrictVersion('4.0'):
-                self._current_size += self.robj_overhead()
-            self._current_size += self.skiplist_entry_overhead()
+            self._current_size += self.sizeof_element(member, encoding)
+            self._current_size += self._element_robj_overhead + self._skiplist_entry_overhead
     
+    def zadd_many(self, key, scores, members):
+        if self._current_encoding == 'skiplist':
+            super(MemoryCallback, self).zadd_many(key, scores, members)
+        else:
+            self.update_len_largest_element(members)
+
     def end_sorted_set(self, key):
         self.emit_record("sortedset", key, self._current_size, self._current_encoding, self._current_length,
                          self._len_largest_element, self._key_expiry)
@@ -417,10 +907,27 @@ class MemoryCallback(RdbCallback):
                 return 0
             else :
                 return 0  # the integer is part of the robj, no extra memory
-        except ValueError:
-            pass
-        l = len(string)
-        if self._redis_version < StrictVersion('3.2'):
+        except (ValueError, TypeError):
+            pass  # not a number, or a LazyLzfString
+        return self.sizeof_sds(len(string))
+
+    def sizeof_element(self, element, encoding):
+        """
+        `sizeof_string` of a string whose `ElementEncoding` in the dump is `encoding`, or is unknown if it is None.
+        Redis saves the strings that hold a 32 bit integer as integers, so only the raw strings that are long
+        enough to hold a larger integer need to be parsed.
+        """
+        if encoding is None:
+            return self.sizeof_string(element)
+        if encoding.kind == 'int':
+            return 0  # the integer is part of the robj, no extra memory
+        l = len(element)
+        if encoding.kind == 'raw' and MIN_RAW_INTEGER_LENGTH <= l <= MAX_INTEGER_LENGTH:
+            return self.sizeof_string(element)
+        return self.sizeof_sds(l)
+
+    def sizeof_sds(self, l):
+        if self._legacy_sds:
             return self.malloc_overhead(l + 8 + 1)
         if l < 2**5:
             return self.malloc_overhead(l + 1 + 1)
@@ -439,7 +946,7 @@ class MemoryCallback(RdbCallback):
 
     def key_expiry_overhead(self, expiry):
         # If there is no expiry, there isn't any overhead
-        if not expiry:
+        if expiry is None:
             return 0
         self._db_expires += 1
         # Key expiry is stored in a hashtable, so we have to pay for the cost of a hashtable entry
@@ -462,7 +969,7 @@ class MemoryCallback(RdbCallback):
     def hashtable_entry_overhead(self):
         # See  https://github.com/antirez/redis/blob/unstable/src/dict.h
         # Each dictEntry has 2 pointers + int64
-        return 2*self.sizeof_pointer() + 8
+        return self._hashtable_entry_overhead
     
     def linkedlist_overhead(self):
         # See https://github.com/antirez/redis/blob/unstable/src/adlist.h
@@ -485,44 +992,19 @@ class MemoryCallback(RdbCallback):
         return 4 + 4 + 2 + 1
 
     def ziplist_entry_overhead(self, value):
-        # See https://github.com/antirez/redis/blob/unstable/src/ziplist.c
-        if self.is_integer_type(value):
-            header = 1
-            if value < 12:
-                size = 0
-            elif value < 2**8:
-                size = 1
-            elif value < 2**16:
-                size = 2
-            elif value < 2**24:
-                size = 3
-            elif value < 2**32:
-                size = 4
-            else:
-                size = 8
-        else:
-            size = len(value)
-            if size <= 63:
-                header = 1
-            elif size <= 16383:
-                header = 2
-            else:
-                header = 5
-        # add len again for prev_len of the next record
-        prev_len = 1 if size < 254 else 5
-        return prev_len + header + size
+        return ziplist_entry_size(value)
 
     def skiplist_overhead(self, size):
         return 2*self.sizeof_pointer() + self.hashtable_overhead(size) + (2*self.sizeof_pointer() + 16)
     
     def skiplist_entry_overhead(self):
-        return self.hashtable_entry_overhead() + 2*self.sizeof_pointer() + 8 + (self.sizeof_pointer() + 8) * self.zset_random_level()
+        return self._skiplist_entry_overhead
     
     def robj_overhead(self):
         return self.sizeof_pointer() + 8
         
     def malloc_overhead(self, size):
-        alloc = get_jemalloc_allocation(size)
+        alloc = self._allocation(size)
         self._total_internal_frag += alloc - size
         return alloc
 
@@ -541,17 +1023,6 @@ class MemoryCallback(RdbCallback):
             power = power << 1
         return power
  
-    def zset_random_level(self):
-        level = 1
-        rint = random.randint(0, 0xFFFF)
-        while (rint < ZSKIPLIST_P * 0xFFFF):
-            level += 1
-            rint = random.randint(0, 0xFFFF)        
-        if level < ZSKIPLIST_MAXLEVEL :
-            return level
-        else:
-            return ZSKIPLIST_MAXLEVEL
-
     def is_integer_type(self, ob):
         if isinstance(ob, int):
             return True
@@ -560,45 +1031,14 @@ class MemoryCallback(RdbCallback):
                 return True
         return False
 
+    def update_len_largest_element(self, elements):
+        if elements:
+            longest = max(map(self.element_length, elements))
+            if longest > self._len_largest_element:
+                self._len_largest_element = longest
+
     def element_length(self, element):
         if self.is_integer_type(element):
             return self._long_size
         return len(element)
 
-
-# size classes from jemalloc 4.0.4 using LG_QUANTUM=3
-jemalloc_size_classes = [
-    8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384, 448, 512, 640, 768, 896, 1024,
-    1280, 1536, 1792, 2048, 2560, 3072, 3584, 4096, 5120, 6144, 7168, 8192, 10240, 12288, 14336, 16384, 20480, 24576,
-    28672, 32768, 40960, 49152, 57344, 65536, 81920, 98304, 114688,131072, 163840, 196608, 229376, 262144, 327680,
-    393216, 458752, 524288, 655360, 786432, 917504, 1048576, 1310720, 1572864, 1835008, 2097152, 2621440, 3145728,
-    3670016, 4194304, 5242880, 6291456, 7340032, 8388608, 10485760, 12582912, 14680064, 16777216, 20971520, 25165824,
-    29360128, 33554432, 41943040, 50331648, 58720256, 67108864, 83886080, 100663296, 117440512, 134217728, 167772160,
-    201326592, 234881024, 268435456, 335544320, 402653184, 469762048, 536870912, 671088640, 805306368, 939524096,
-    1073741824, 1342177280, 1610612736, 1879048192, 2147483648, 2684354560, 3221225472, 3758096384, 4294967296,
-    5368709120, 6442450944, 7516192768, 8589934592, 10737418240, 12884901888, 15032385536, 17179869184, 21474836480,
-    25769803776, 30064771072, 34359738368, 42949672960, 51539607552, 60129542144, 68719476736, 85899345920,
-    103079215104, 120259084288, 137438953472, 171798691840, 206158430208, 240518168576, 274877906944, 343597383680,
-    412316860416, 481036337152, 549755813888, 687194767360, 824633720832, 962072674304, 1099511627776,1374389534720,
-    1649267441664, 1924145348608, 2199023255552, 2748779069440, 3298534883328, 3848290697216, 4398046511104,
-    5497558138880, 6597069766656, 7696581394432, 8796093022208, 10995116277760, 13194139533312, 15393162788864,
-    17592186044416, 21990232555520, 26388279066624, 30786325577728, 35184372088832, 43980465111040, 52776558133248,
-    61572651155456, 70368744177664, 87960930222080, 105553116266496, 123145302310912, 140737488355328, 175921860444160,
-    211106232532992, 246290604621824, 281474976710656, 351843720888320, 422212465065984, 492581209243648,
-    562949953421312, 703687441776640, 844424930131968, 985162418487296, 1125899906842624, 1407374883553280,
-    1688849860263936, 1970324836974592, 2251799813685248, 2814749767106560, 3377699720527872, 3940649673949184,
-    4503599627370496, 5629499534213120, 6755399441055744, 7881299347898368, 9007199254740992, 11258999068426240,
-    13510798882111488, 15762598695796736, 18014398509481984, 22517998136852480, 27021597764222976,31525197391593472,
-    36028797018963968, 45035996273704960, 54043195528445952, 63050394783186944, 72057594037927936, 90071992547409920,
-    108086391056891904, 126100789566373888, 144115188075855872, 180143985094819840, 216172782113783808,
-    252201579132747776, 288230376151711744, 360287970189639680, 432345564227567616, 504403158265495552,
-    576460752303423488, 720575940379279360, 864691128455135232, 1008806316530991104, 1152921504606846976,
-    1441151880758558720, 1729382256910270464, 2017612633061982208, 2305843009213693952, 2882303761517117440,
-    3458764513820540928, 4035225266123964416, 4611686018427387904, 5764607523034234880, 6917529027641081856,
-    8070450532247928832, 9223372036854775808, 11529215046068469760, 13835058055282163712, 16140901064495857664
-]  # TODO: use different table depending oon the redis-version used
-
-def get_jemalloc_allocation(size):
-    idx = bisect.bisect_left(jemalloc_size_classes, size)
-    alloc = jemalloc_size_classes[idx] if idx < len(jemalloc_size_classes) else size
-    return alloc
@@ -0,0 +1,146 @@
+import multiprocessing
+import os
+
+from rdbtools.parser import RdbParser
+from rdbtools.memprofiler import MemoryCallback
+
+# Each worker is handed this many ranges on average, so that a range full of large keys does not hold up the others
+RANGES_PER_WORKER = 4
+
+
+def profile_memory(filename, stream, workers, filters=None, architecture=64, redis_version='5.0', string_escape=None,
+                   allocator='jemalloc4'):
+    """
+    Run a MemoryCallback over the dump `filename` on `workers` processes, and send the records to `stream`.
+
+    Phase one walks the dump through the skip path only, and records the offset of every key.
+    Phase two splits these offsets into ranges of about the same size in bytes. Each worker memory maps
+    the dump and profiles one range at a time with its own MemoryCallback.
+
+    Results are merged in file order, so `stream` sees the same records as with a serial parse.
+    If `stream` has a `merge` method, like `StatsAggregator`, each worker aggregates its range into an
+    empty copy of `stream` and only the aggregates are sent back and merged.
+
+    With a `sample` filter, the database dicts are extrapolated from the sampled keys as in a serial parse.
+    """
+    callback = MemoryCallback(stream, architecture, redis_version, string_escape,
+                              sample_rate=(filters or {}).get('sample'), allocator=allocator)
+    parser = RdbParser(callback, filters, engine='mmap')
+    callback.start_rdb()
+
+    # the scan is not filtered, so that every database is started and ended as in a serial parse
+    dbs = []
+    entries = []
+    for db_number, key, data_type, expiry, offset in RdbParser(callback, engine='mmap').scan_keys(filename):
+        if not dbs or dbs[-1] != db_number:
+            dbs.append(db_number)
+        if parser.matches_filter(db_number, key, data_type):
+            entries.append((db_number, offset))
+
+    # stream has not seen any record yet, so it is pickled to the workers as an empty aggregator
+    template = stream if hasattr(stream, 'merge') else None
+    tasks = [(filename, entries_range, filters, template, architecture, redis_version, string_escape, allocator)
+             for entries_range in split_ranges(entries, workers * RANGES_PER_WORKER, os.path.getsize(filename))]
+
+    # a serial parse ends database 0 at the end of a dump that has no database at all
+    merge = _OrderedMerge(callback, dbs or [0])
+    pool = multiprocessing.Pool(workers)
+    try:
+        for result, db_counts, internal_frag in pool.imap(_profile_range, tasks):
+            merge.add_counts(db_counts, internal_frag)
+            if template is not None:
+                stream.merge(result)
+            else:
+                for record in result:
+                    merge.start_database(record.database)
+                    stream.next_record(record)
+    finally:
+        pool.terminate()
+        pool.join()
+    merge.end_databases()
+    callback.end_rdb()
+
+
+def split_ranges(entries, count, end):
+    """
+    Split `entries`, a list of `(db_number, offset)` pairs sorted by offset, into at most `count`
+    contiguous ranges that each cover about the same number of bytes of a dump of size `end`
+    """
+    if not entries:
+        return []
+    start = entries[0][1]
+    step = max(1, (end - start) // count)
+    ranges = []
+    current = []
+    boundary = start + step
+    for entry in entries:
+        if entry[1] >= boundary and current:
+            ranges.append(current)
+            current = []
+            boundary = start + step * ((entry[1] - start) // step + 1)
+        current.append(entry)
+    ranges.append(current)
+    return ranges
+
+
+class _RecordList(list):
+    def next_record(self, record):
+        self.append(record)
+
+
+class _RangeMemoryCallback(MemoryCallback):
+    """
+    A MemoryCallback for one range of keys. The size of a database's dicts depends on all of its keys,
+    so the key counts are handed back to the parent process instead of emitting dict records.
+    """
+    def __init__(self, stream, architecture, redis_version, string_escape, allocator):
+        super(_RangeMemoryCallback, self).__init__(stream, architecture, redis_version, string_escape,
+                                                   allocator=allocator)
+        self.db_counts = {}
+
+    def end_database(self, db_number):
+        self.db_counts[db_number] = (self._db_keys, self._db_expires)
+
+    def end_rdb(self):
+        pass
+
+
+def _profile_range(task):
+    filename, entries, filters, template, architecture, redis_version, string_escape, allocator = task
+    stream = template if template is not None else _RecordList()
+    callback = _RangeMemoryCallback(stream, architecture, redis_version, string_escape, allocator)
+    RdbParser(callback, filters, engine='mmap').parse_offsets(filename, entries)
+    return stream, callback.db_counts, callback._total_internal_frag
+
+
+class _OrderedMerge(object):
+    """Starts and ends the databases of the parent MemoryCallback in file order, with the key counts of all workers"""
+    def __init__(self, callback, dbs):
+        self._callback = callback
+        self._pending = list(reversed(dbs))
+        self._current = None
+        self._counts = dict((db, [0, 0]) for db in dbs)
+        self._internal_frag = 0
+
+    def add_counts(self, db_counts, internal_frag):
+        for db_number, (keys, expires) in db_counts.items():
+            self._counts[db_number][0] += keys
+            self._counts[db_number][1] += expires
+        self._internal_frag += internal_frag
+
+    def start_database(self, db_number):
+        while self._current != db_number:
+            self._end_current()
+            self._current = self._pending.pop()
+            self._callback.start_database(self._current)
+
+    def end_databases(self):
+        while self._pending:
+            self.start_database(self._pending[-1])
+        self._end_current()
+        self._callback._total_internal_frag += self._internal_frag
+
+    def _end_current(self):
+        if self._current is not None:
+            self._callback._db_keys, self._callback._db_expires = self._counts[self._current]
+            self._callback.end_database(self._current)
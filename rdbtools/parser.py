@@ -1,11 +1,18 @@
 import struct
 import io
+import sys
+import array
 import datetime
-import re
+import weakref
+from collections import namedtuple, deque
+from multiprocessing.pool import ThreadPool, ApplyResult
 
 from rdbtools.encodehelpers import STRING_ESCAPE_RAW, apply_escape_bytes, bval
-from .compat import range, str2regexp
+from .compat import range, indexable_bytes, array_from_bytes, integer_types
 from .iowrapper import IOWrapper
+from . import pylzf
+from .readers import open_reader, open_stream, ReadAheadReader, STREAM_BUFFER_SIZE
+from .filters import compile_db_filter, compile_key_filter, compile_header_filter, compile_value_filter, compile_stop_condition, exact_key_set
 
 try:
     try:
@@ -65,6 +72,44 @@ REDIS_RDB_MODULE_OPCODE_FLOAT = 3
 REDIS_RDB_MODULE_OPCODE_DOUBLE = 4
 REDIS_RDB_MODULE_OPCODE_STRING = 5
 
+# Returned by a callback event to stop the parse, see RdbCallback
+STOP_PARSING = 'STOP_PARSING'
+
+# Element and batch methods of RdbCallback, and the data types they receive the elements of
+ELEMENT_METHODS = (
+    (('rpush', 'rpush_many', 'rpush_encoded'), (REDIS_RDB_TYPE_LIST, REDIS_RDB_TYPE_LIST_ZIPLIST, REDIS_RDB_TYPE_LIST_QUICKLIST)),
+    (('sadd', 'sadd_many', 'sadd_encoded'), (REDIS_RDB_TYPE_SET, REDIS_RDB_TYPE_SET_INTSET)),
+    (('zadd', 'zadd_many', 'zadd_encoded'), (REDIS_RDB_TYPE_ZSET, REDIS_RDB_TYPE_ZSET_2, REDIS_RDB_TYPE_ZSET_ZIPLIST)),
+    (('hset', 'hset_many', 'hset_encoded'), (REDIS_RDB_TYPE_HASH, REDIS_RDB_TYPE_HASH_ZIPLIST)),
+)
+
+# How a string is stored in the dump :
+#     kind               'int' for a string saved as an integer, 'raw' or 'lzf'
+#     width              the number of bytes of an integer
+#     compressed_length  the number of bytes of an LZF compressed string
+ElementEncoding = namedtuple('ElementEncoding', ['kind', 'width', 'compressed_length'])
+ELEMENT_RAW = ElementEncoding('raw', None, None)
+ELEMENT_INT8 = ElementEncoding('int', 1, None)
+ELEMENT_INT16 = ElementEncoding('int', 2, None)
+ELEMENT_INT32 = ElementEncoding('int', 4, None)
+
+# Data types whose elements go through the *_encoded methods of callbacks that set `element_encodings`
+ENCODED_ELEMENT_TYPES = frozenset((REDIS_RDB_TYPE_STRING, REDIS_RDB_TYPE_LIST, REDIS_RDB_TYPE_SET, REDIS_RDB_TYPE_ZSET,
+                                   REDIS_RDB_TYPE_ZSET_2, REDIS_RDB_TYPE_HASH))
+
+# The elements of a value in a compact encoding, read from the headers of its entries for callbacks that set
+# `element_summaries` :
+#     count               the number of elements, or of fields of a hash and members of a sorted set
+#     len_largest_string  the length of the longest string element, 0 if there is none
+#     integers            the number of integer elements
+#     entry_sizes         for lists, the `ziplist_entry_size` of each element in order, None for other types
+# The fields and the values of a hash are all elements, the scores of a sorted set are not.
+ElementSummary = namedtuple('ElementSummary', ['count', 'len_largest_string', 'integers', 'entry_sizes'])
+
+# Data types in a compact encoding, whose elements are delivered as an `ElementSummary` to callbacks that set `element_summaries`
+SUMMARISED_TYPES = frozenset((REDIS_RDB_TYPE_HASH_ZIPMAP, REDIS_RDB_TYPE_LIST_ZIPLIST, REDIS_RDB_TYPE_SET_INTSET,
+                              REDIS_RDB_TYPE_ZSET_ZIPLIST, REDIS_RDB_TYPE_HASH_ZIPLIST, REDIS_RDB_TYPE_LIST_QUICKLIST))
+
 DATA_TYPE_MAPPING = {
     0 : "string", 1 : "list", 2 : "set", 3 : "sortedset", 4 : "hash", 5 : "sortedset", 6 : "module", 7: "module",
     9 : "hash", 10 : "list", 11 : "set", 12 : "sortedset", 13 : "hash", 14 : "list", 15 : "stream"}
@@ -73,8 +118,47 @@ class RdbCallback(object):
     """
     A Callback to handle events as the Redis dump file is parsed.
     This callback provides a serial and fast access to the dump file.
+
+    Set `lazy_lzf_strings` to True in a subclass that rarely looks at the bytes of values.
+    LZF compressed values and elements are then delivered as `LazyLzfString` objects, which know
+    their length and are only decompressed when their bytes are used.
+
+    To stop the parse early, return `STOP_PARSING` from `aux_field`, `start_database`, `db_size`
+    or from the event that ends a key : `set`, `set_end`, `end_hash`, `end_set`, `end_list`,
+    `end_sorted_set`, `end_module` or `end_stream`. A decision made in any other event can be returned from the end
+    of the current key. The parser then calls `end_database` and `end_rdb`, and returns.
+    Any other true value returned from `aux_field` aborts the parse at once, without these two events.
+
+    Set `raw_key_metadata` to True in a subclass that does not keep the `info` of keys or only needs
+    expiries as numbers. `info` is then a `KeyInfo` object, which the parser reuses for every key,
+    and `expiry` is the number of milliseconds since the epoch, see `expiry_to_datetime`.
+
+    Set `element_encodings` to True in a subclass that needs to know how strings are stored in the dump.
+    The elements of lists, sets, sorted sets and hashes that are not in a compact encoding are then
+    delivered through `rpush_encoded`, `sadd_encoded`, `zadd_encoded` and `hset_encoded` along with
+    their `ElementEncoding`, and the `info` of `set` has a `value_encoding`. Elements of compact
+    encodings keep going through the batch methods : there, integers are always integer encoded
+    and strings never hold an integer.
+
+    Set `string_chunk_size` to a number of bytes in a subclass that can handle string values piece
+    by piece. String values longer than that are then delivered through `set_start`, `set_chunk`
+    and `set_end` rather than `set`, in chunks of about that size, so that a huge value is never held
+    in memory at once. Their chunks are skipped if the subclass does not implement `set_chunk`.
+    LZF compressed values are read whole before they are decompressed chunk by chunk, and are
+    still delivered to `set` when `lazy_lzf_strings` is set.
+
+    Set `element_summaries` to True in a subclass that only needs the number and the lengths of the
+    elements of ziplists, intsets and zipmaps. Their elements are then read from the entry headers
+    and never decoded : `element_summary` is called once between the start and the end event of
+    such a value, instead of the batch methods.
     
     """
+    lazy_lzf_strings = False
+    raw_key_metadata = False
+    element_encodings = False
+    string_chunk_size = None
+    element_summaries = False
+
     def __init__(self, string_escape):
         if string_escape is None:
             self._escape = STRING_ESCAPE_RAW
@@ -157,6 +241,23 @@ class RdbCallback(object):
         
         """
         pass
+
+    def set_start(self, key, length, expiry, info):
+        """
+        Callback to handle the start of a key with a string value longer than `string_chunk_size`
+
+        `length` is the length of the value. After `set_start`, `set_chunk` is called with the
+        successive pieces of the value, and then `set_end`.
+        """
+        pass
+
+    def set_chunk(self, key, chunk):
+        """Callback to handle the next piece of a string value, as bytes"""
+        pass
+
+    def set_end(self, key):
+        """Called when the whole string value has been delivered through `set_chunk`"""
+        pass
     
     def start_hash(self, key, length, expiry, info):
         """Callback to handle the start of a hash
@@ -182,6 +283,25 @@ class RdbCallback(object):
         
         """
         pass
+
+    def hset_many(self, key, fields, values):
+        """
+        Callback to insert several field=value pairs in an existing hash at once
+
+        `fields` and `values` are sequences of the same length.
+        Compact encodings are delivered through this method, the default implementation calls `hset` for each pair.
+        """
+        for field, value in zip(fields, values):
+            self.hset(key, field, value)
+
+    def hset_encoded(self, key, field, value, field_encoding, value_encoding):
+        """
+        Callback to insert a field=value pair in an existing hash, for callbacks that set `element_encodings`
+
+        `field_encoding` and `value_encoding` are the `ElementEncoding` of `field` and `value`.
+        The default implementation calls `hset`.
+        """
+        self.hset(key, field, value)
     
     def end_hash(self, key):
         """
@@ -218,6 +338,24 @@ class RdbCallback(object):
         
         """
         pass
+
+    def sadd_many(self, key, members):
+        """
+        Callback to insert several members to this set at once
+
+        For intsets `members` is an `array.array` of the integers, decoded in one go.
+        Compact encodings are delivered through this method, the default implementation calls `sadd` for each member.
+        """
+        for member in members:
+            self.sadd(key, member)
+
+    def sadd_encoded(self, key, member, encoding):
+        """
+        Callback to insert a new member to this set, for callbacks that set `element_encodings`
+
+        `encoding` is the `ElementEncoding` of `member`. The default implementation calls `sadd`.
+        """
+        self.sadd(key, member)
     
     def end_set(self, key):
         """
@@ -255,6 +393,23 @@ class RdbCallback(object):
         
         """
         pass
+
+    def rpush_many(self, key, values):
+        """
+        Callback to insert several values, in order, at the end of this list
+
+        Compact encodings are delivered through this method, the default implementation calls `rpush` for each value.
+        """
+        for value in values:
+            self.rpush(key, value)
+
+    def rpush_encoded(self, key, value, encoding):
+        """
+        Callback to insert a new value at the end of this list, for callbacks that set `element_encodings`
+
+        `encoding` is the `ElementEncoding` of `value`. The default implementation calls `rpush`.
+        """
+        self.rpush(key, value)
     
     def end_list(self, key, info):
         """
@@ -292,6 +447,24 @@ class RdbCallback(object):
         `value` is the element being inserted
         """
         pass
+
+    def zadd_many(self, key, scores, members):
+        """
+        Callback to insert several values into this sorted set at once
+
+        `scores` and `members` are sequences of the same length.
+        Compact encodings are delivered through this method, the default implementation calls `zadd` for each member.
+        """
+        for score, member in zip(scores, members):
+            self.zadd(key, score, member)
+
+    def zadd_encoded(self, key, score, member, encoding):
+        """
+        Callback to insert a new value into this sorted set, for callbacks that set `element_encodings`
+
+        `encoding` is the `ElementEncoding` of `member`. The default implementation calls `zadd`.
+        """
+        self.zadd(key, score, member)
     
     def end_sorted_set(self, key):
         """
@@ -302,6 +475,15 @@ class RdbCallback(object):
         """
         pass
 
+    def element_summary(self, key, summary):
+        """
+        Callback for the elements of a list, set, sorted set or hash in a compact encoding,
+        for callbacks that set `element_summaries`
+
+        `summary` is an `ElementSummary`. For a list in a quicklist, it covers the elements of all its ziplists.
+        """
+        pass
+
     def start_stream(self, key, listpacks_count, expiry, info):
         """Callback to handle the start of a stream
 
@@ -373,27 +555,71 @@ class RdbParser(object):
         
         If filter is None, results will not be filtered
         If dbs, keys or types is None or Empty, no filtering will be done on that axis
+
+    engine selects how `parse` reads the dump file
+        file : a regular buffered file (the default)
+        mmap : the file is memory mapped and walked with an offset cursor,
+               ziplists and intsets are decoded straight from the mapping
+        readahead : the file, or the stream given to `parse_stream`, is read ahead on a background thread
+               while the parse goes on, see `readers.ReadAheadReader`. `read_stats` then tells how long
+               the parse waited for I/O. `parse_offsets` reads the file as with the file engine.
+
+    lzf_threads is the number of threads that decompress the LZF compressed values of at least
+    LZF_THREAD_MIN_LENGTH bytes while the parse goes on, see `OrderedCallback`. python-lzf lets these
+    threads run in parallel, the pure python decompressor does not. Values are still decompressed on
+    the parse thread by default, and for callbacks that set `lazy_lzf_strings`.
     """
-    def __init__(self, callback, filters = None) :
+    def __init__(self, callback, filters = None, engine = 'file', lzf_threads = 0) :
         """
             `callback` is the object that will receive parse events
         """
         self._callback = callback
+        self._engine = engine
+        self._lazy_lzf_strings = getattr(callback, 'lazy_lzf_strings', False)
+        self._lzf_threads = 0 if self._lazy_lzf_strings else lzf_threads
+        self._lzf_pool = None
+        if getattr(callback, 'element_encodings', False):
+            self._encoded_element_types = ENCODED_ELEMENT_TYPES
+        else:
+            self._encoded_element_types = frozenset()
+        if getattr(callback, 'element_summaries', False):
+            self._summarised_types = SUMMARISED_TYPES
+        else:
+            self._summarised_types = frozenset()
+        self._string_chunk_size = getattr(callback, 'string_chunk_size', None)
+        self._skip_string_chunks = not _overrides(callback, 'set_chunk')
+        self._elementless_types = self.find_elementless_types(callback) - self._summarised_types
+        self._raw_key_metadata = getattr(callback, 'raw_key_metadata', False)
+        self._key_info = KeyInfo() if self._raw_key_metadata else None
         self._key = None
         self._expiry = None
         self._idle = None
         self._freq = None
         self.init_filter(filters)
         self._rdb_version = 0
+        self.read_stats = None
 
     def parse(self, filename):
         """
         Parse a redis rdb dump file, and call methods in the 
         callback object during the parsing operation.
         """
-        self.parse_fd(open(filename, "rb"))
+        self.parse_fd(open_reader(filename, self._engine))
+
+    def parse_stream(self, stream, buffer_size=STREAM_BUFFER_SIZE):
+        """
+        Parse a redis rdb dump read from a non seekable stream, such as stdin
+        or the output of `redis-cli --rdb -`. See `readers.open_stream`.
+        """
+        if self._engine == 'readahead':
+            self.parse_fd(ReadAheadReader(open_stream(stream, buffer_size), buffer_size))
+        else:
+            self.parse_fd(open_stream(stream, buffer_size))
 
     def parse_fd(self, fd):
+        if self._lzf_threads and self._lzf_pool is None:
+            return self.run_lzf_pipeline(self.parse_fd, fd)
+        read_stats = getattr(fd, 'read_stats', None)
         with fd as f:
             self.verify_magic_string(f.read(5))
             self.verify_version(f.read(4))
@@ -401,47 +627,44 @@ class RdbParser(object):
 
             is_first_database = True
             db_number = 0
+            db_selected = self.matches_db(db_number)
+            header_filter = self._header_filter
+            key_filter = self._key_filter
+            value_filter = self._value_filter
+            if value_filter is not None and not _is_seekable(f):
+                raise Exception('parse_fd', 'Filters on the elements or size of values need a seekable dump file')
+            stop_condition = compile_stop_condition(self._filters, self._key_set)
             while True :
-                self._expiry = None
-                self._idle = None
-                self._freq = None
-                data_type = read_unsigned_char(f)
-
-                if data_type == REDIS_RDB_OPCODE_EXPIRETIME_MS :
-                    self._expiry = read_milliseconds_time(f)
-                    data_type = read_unsigned_char(f)
-                elif data_type == REDIS_RDB_OPCODE_EXPIRETIME :
-                    self._expiry = to_datetime(read_unsigned_int(f) * 1000000)
-                    data_type = read_unsigned_char(f)
-
-                if data_type == REDIS_RDB_OPCODE_IDLE:
-                    self._idle = self.read_length(f)
-                    data_type = read_unsigned_char(f)
-
-                if data_type == REDIS_RDB_OPCODE_FREQ:
-                    self._freq = read_unsigned_char(f)
-                    data_type = read_unsigned_char(f)
+                data_type = self.read_key_header(f)
 
                 if data_type == REDIS_RDB_OPCODE_SELECTDB :
                     if not is_first_database :
                         self._callback.end_database(db_number)
                     is_first_database = False
                     db_number = self.read_length(f)
-                    self._callback.start_database(db_number)
+                    db_selected = self.matches_db(db_number)
+                    if self._callback.start_database(db_number) is STOP_PARSING:
+                        self.stop_parsing(db_number)
+                        break
                     continue
 
                 if data_type == REDIS_RDB_OPCODE_AUX:
                     aux_key = self.read_string(f)
                     aux_val = self.read_string(f)
-                    ret = self._callback.aux_field(aux_key, aux_val)
-                    if ret:
-                        break  # TODO: make all callbacks return abort flag
+                    result = self._callback.aux_field(aux_key, aux_val)
+                    if result is STOP_PARSING:
+                        self.stop_parsing(db_number)
+                        break
+                    elif result:
+                        break  # other true values abort the parse without ending it, as they always have
                     continue
 
                 if data_type == REDIS_RDB_OPCODE_RESIZEDB:
                     db_size = self.read_length(f)
                     expire_size = self.read_length(f)
-                    self._callback.db_size(db_size, expire_size)
+                    if self._callback.db_size(db_size, expire_size) is STOP_PARSING:
+                        self.stop_parsing(db_number)
+                        break
                     continue
 
                 if data_type == REDIS_RDB_OPCODE_MODULE_AUX:
@@ -455,16 +678,212 @@ class RdbParser(object):
                         f.read(8)
                     break
 
-                if self.matches_filter(db_number):
+                if db_selected and (header_filter is None or header_filter(self._expiry, self._idle, self._freq)):
                     self._key = self.read_string(f)
-                    if self.matches_filter(db_number, self._key, data_type):
-                        self.read_object(f, data_type)
+                    if ((key_filter is None or key_filter(self._key, data_type)) and
+                            (value_filter is None or self.matches_value(f, data_type))):
+                        if (self.read_object(f, data_type) is STOP_PARSING or
+                                (stop_condition is not None and stop_condition(self._key))):
+                            self._key = None
+                            self.stop_parsing(db_number)
+                            break
                     else:
                         self.skip_object(f, data_type)
                 else :
                     self.skip_key_and_object(f, data_type)
                 self._key = None
+        if read_stats is not None:
+            self.read_stats = read_stats()
+
+    def run_lzf_pipeline(self, parse, *args):
+        """Call `parse` with large LZF values decompressed by a pool of `lzf_threads` threads"""
+        callback = self._callback
+        self._lzf_pool = ThreadPool(self._lzf_threads)
+        self._callback = OrderedCallback(callback, self._lzf_threads * LZF_WINDOW_PER_THREAD)
+        try:
+            parse(*args)
+            self._callback.drain()
+        finally:
+            self._lzf_pool.terminate()
+            self._lzf_pool.join()
+            self._lzf_pool = None
+            self._callback = callback
+
+    def stop_parsing(self, db_number):
+        """Deliver the events that end a parse stopped before the end of the dump"""
+        self._callback.end_database(db_number)
+        self._callback.end_rdb()
+
+    def key_info(self, encoding, zips=None, sizeof_value=None, value_encoding=None):
+        """The `info` of the event that starts a key, see `RdbCallback.raw_key_metadata`"""
+        if self._raw_key_metadata:
+            return self.key_info_object(encoding, zips, sizeof_value, value_encoding)
+        return self.key_info_dict(encoding, zips, sizeof_value, value_encoding)
+
+    def end_info(self, encoding, zips=None, sizeof_value=None):
+        """The `info` of the event that ends a key, see `RdbCallback.raw_key_metadata`"""
+        if self._raw_key_metadata:
+            return self.end_info_object(encoding, zips, sizeof_value)
+        return self.end_info_dict(encoding, zips, sizeof_value)
+
+    def key_info_dict(self, encoding, zips=None, sizeof_value=None, value_encoding=None):
+        """The `info` of the event that starts a key, as a new dict"""
+        info = {'idle': self._idle, 'freq': self._freq}
+        if encoding is not None:
+            info['encoding'] = encoding
+        if zips is not None:
+            info['zips'] = zips
+        if sizeof_value is not None:
+            info['sizeof_value'] = sizeof_value
+        if value_encoding is not None:
+            info['value_encoding'] = value_encoding
+        return info
+
+    def end_info_dict(self, encoding, zips=None, sizeof_value=None):
+        """The `info` of the event that ends a key, as a new dict"""
+        info = {'encoding': encoding}
+        if zips is not None:
+            info['zips'] = zips
+        if sizeof_value is not None:
+            info['sizeof_value'] = sizeof_value
+        return info
+
+    def key_info_object(self, encoding, zips=None, sizeof_value=None, value_encoding=None):
+        """The `info` of the event that starts a key, as the reused `KeyInfo`"""
+        info = self._key_info
+        info.encoding = encoding
+        info.idle = self._idle
+        info.freq = self._freq
+        info.zips = zips
+        info.sizeof_value = sizeof_value
+        info.value_encoding = value_encoding
+        return info
+
+    def end_info_object(self, encoding, zips=None, sizeof_value=None):
+        """The `info` of the event that ends a key, as the reused `KeyInfo`"""
+        info = self._key_info
+        info.encoding = encoding
+        info.idle = None
+        info.freq = None
+        info.zips = zips
+        info.sizeof_value = sizeof_value
+        info.value_encoding = None
+        return info
+
+    def read_key_header(self, f):
+        """
+        Read the expiry, idle and freq opcodes that may precede a key into
+        `_expiry`, `_idle` and `_freq`, and return the opcode or data type that follows them
+        """
+        self._expiry = None
+        self._idle = None
+        self._freq = None
+        data_type = read_unsigned_char(f)
+
+        if data_type == REDIS_RDB_OPCODE_EXPIRETIME_MS :
+            if self._raw_key_metadata :
+                self._expiry = read_unsigned_long(f)
+            else :
+                self._expiry = read_milliseconds_time(f)
+            data_type = read_unsigned_char(f)
+        elif data_type == REDIS_RDB_OPCODE_EXPIRETIME :
+            if self._raw_key_metadata :
+                self._expiry = read_unsigned_int(f) * 1000
+            else :
+                self._expiry = to_datetime(read_unsigned_int(f) * 1000000)
+            data_type = read_unsigned_char(f)
+
+        if data_type == REDIS_RDB_OPCODE_IDLE:
+            self._idle = self.read_length(f)
+            data_type = read_unsigned_char(f)
 
+        if data_type == REDIS_RDB_OPCODE_FREQ:
+            self._freq = read_unsigned_char(f)
+            data_type = read_unsigned_char(f)
+        return data_type
+
+    def scan_keys(self, filename):
+        """
+        Walk the dump file without decoding any value, and yield a
+        `(db_number, key, data_type, expiry, offset)` tuple for every key.
+
+        `offset` is where the key's record starts, including any expiry, idle or freq opcode,
+        and can be passed back to `parse_offsets`. The `dbs` filter is honoured, other filters are not.
+        Aux fields are passed to the callback's `aux_field` as they are found, nothing else is.
+        """
+        with open_reader(filename, self._engine) as f:
+            self.verify_magic_string(f.read(5))
+            self.verify_version(f.read(4))
+            db_number = 0
+            while True :
+                offset = f.tell()
+                data_type = self.read_key_header(f)
+
+                if data_type == REDIS_RDB_OPCODE_SELECTDB :
+                    db_number = self.read_length(f)
+                elif data_type == REDIS_RDB_OPCODE_AUX :
+                    aux_key = self.read_string(f)
+                    aux_val = self.read_string(f)
+                    self._callback.aux_field(aux_key, aux_val)
+                elif data_type == REDIS_RDB_OPCODE_RESIZEDB :
+                    self.read_length(f)
+                    self.read_length(f)
+                elif data_type == REDIS_RDB_OPCODE_MODULE_AUX :
+                    self.skip_module(f)
+                elif data_type == REDIS_RDB_OPCODE_EOF :
+                    break
+                elif self.matches_db(db_number) :
+                    self._key = self.read_string(f)
+                    self.skip_object(f, data_type)
+                    yield (db_number, self._key, data_type, self._expiry, offset)
+                else :
+                    self.skip_key_and_object(f, data_type)
+                self._key = None
+
+    def parse_offsets(self, filename, entries):
+        """
+        Parse only the keys whose records start at the given offsets, typically found through
+        a key index (see `rdbtools.keyindex`). `entries` is a sequence of `(db_number, offset)` pairs.
+
+        The callback sees the usual sequence of events, with just these keys in each database.
+        Filters are applied to the keys as usual, and the parse stops early as in `parse`.
+        """
+        if self._lzf_threads and self._lzf_pool is None:
+            return self.run_lzf_pipeline(self.parse_offsets, filename, entries)
+        # reading ahead does not help with keys scattered over the file, and needs a file read in order
+        engine = 'file' if self._engine == 'readahead' else self._engine
+        with open_reader(filename, engine) as f:
+            self.verify_magic_string(f.read(5))
+            self.verify_version(f.read(4))
+            self._callback.start_rdb()
+
+            db_number = None
+            if self._value_filter is not None and not _is_seekable(f):
+                raise Exception('parse_offsets', 'Filters on the elements or size of values need a seekable dump file')
+            stop_condition = compile_stop_condition(self._filters, self._key_set)
+            for entry_db, offset in sorted(set(entries), key=lambda e: e[1]):
+                if entry_db != db_number :
+                    if db_number is not None :
+                        self._callback.end_database(db_number)
+                    db_number = entry_db
+                    if self._callback.start_database(db_number) is STOP_PARSING:
+                        break
+                f.seek(offset)
+                data_type = self.read_key_header(f)
+                if self._header_filter is not None and not self._header_filter(self._expiry, self._idle, self._freq):
+                    continue
+                self._key = self.read_string(f)
+                if (self.matches_filter(db_number, self._key, data_type) and
+                        (self._value_filter is None or self.matches_value(f, data_type))):
+                    if (self.read_object(f, data_type) is STOP_PARSING or
+                            (stop_condition is not None and stop_condition(self._key))):
+                        break
+                self._key = None
+
+            self._key = None
+            if db_number is not None :
+                self._callback.end_database(db_number)
+            self._callback.end_rdb()
 
     def read_length_with_encoding(self, f):
         length = 0
@@ -513,6 +932,104 @@ class RdbParser(object):
             val = f.read(length)
         return val
 
+    def read_value_string(self, f) :
+        """Read a string that is delivered to the callback, see `read_lazy_string` and `read_pipelined_string`"""
+        if self._lazy_lzf_strings :
+            return self.read_lazy_string(f)
+        elif self._lzf_threads :
+            return self.read_pipelined_string(f)
+        return self.read_string(f)
+
+    def read_lazy_string(self, f) :
+        """
+        Like `read_string`, but an LZF compressed string is returned undecompressed, as a `LazyLzfString`
+        """
+        length, is_encoded = self.read_length_with_encoding(f)
+        if is_encoded and length == REDIS_RDB_ENC_LZF :
+            clen = self.read_length(f)
+            l = self.read_length(f)
+            return LazyLzfString(f.read(clen), l, self._key)
+        elif is_encoded :
+            if length == REDIS_RDB_ENC_INT8 :
+                return read_signed_char(f)
+            elif length == REDIS_RDB_ENC_INT16 :
+                return read_signed_short(f)
+            elif length == REDIS_RDB_ENC_INT32 :
+                return read_signed_int(f)
+            raise Exception('read_string', "Invalid string encoding %s"%(length))
+        return f.read(length)
+
+    def read_encoded_string(self, f) :
+        """
+        Like `read_value_string`, but return the string along with its `ElementEncoding`
+        """
+        length, is_encoded = self.read_length_with_encoding(f)
+        if not is_encoded :
+            return f.read(length), ELEMENT_RAW
+        if length == REDIS_RDB_ENC_INT8 :
+            return read_signed_char(f), ELEMENT_INT8
+        elif length == REDIS_RDB_ENC_INT16 :
+            return read_signed_short(f), ELEMENT_INT16
+        elif length == REDIS_RDB_ENC_INT32 :
+            return read_signed_int(f), ELEMENT_INT32
+        elif length == REDIS_RDB_ENC_LZF :
+            clen = self.read_length(f)
+            l = self.read_length(f)
+            if self._lazy_lzf_strings :
+                val = LazyLzfString(f.read(clen), l, self._key)
+            else :
+                val = self.decompress_value(f.read(clen), l)
+            return val, ElementEncoding('lzf', None, clen)
+        raise Exception('read_string', "Invalid string encoding %s"%(length))
+
+    def read_pipelined_string(self, f) :
+        """
+        Like `read_string`, but a large LZF compressed string is handed to the decompression threads,
+        and returned as the pending result of its decompression, see `decompress_value`
+        """
+        length, is_encoded = self.read_length_with_encoding(f)
+        if is_encoded and length == REDIS_RDB_ENC_LZF :
+            clen = self.read_length(f)
+            l = self.read_length(f)
+            return self.decompress_value(f.read(clen), l)
+        elif is_encoded :
+            if length == REDIS_RDB_ENC_INT8 :
+                return read_signed_char(f)
+            elif length == REDIS_RDB_ENC_INT16 :
+                return read_signed_short(f)
+            elif length == REDIS_RDB_ENC_INT32 :
+                return read_signed_int(f)
+            raise Exception('read_string', "Invalid string encoding %s"%(length))
+        return f.read(length)
+
+    def decompress_value(self, compressed, expected_length):
+        """
+        Decompress a value that is delivered to the callback. While `lzf_threads` decompress large values,
+        these are returned as an `ApplyResult`, which `OrderedCallback` waits for before it delivers them.
+        """
+        if self._lzf_pool is not None and expected_length >= LZF_THREAD_MIN_LENGTH :
+            return self._lzf_pool.apply_async(lzf_decompress, (compressed, expected_length, self._key))
+        return self.lzf_decompress(compressed, expected_length)
+
+    def read_blob(self, f):
+        """
+        Read an encoded string holding a serialized structure (ziplist, intset, zipmap).
+
+        When `f` can hand out views of its buffer (see `MmapReader.read_view`), an uncompressed
+        blob is returned as a memoryview and is never copied, otherwise this is `read_string`.
+        """
+        read_view = getattr(f, 'read_view', None)
+        if read_view is None:
+            return self.read_string(f)
+        length, is_encoded = self.read_length_with_encoding(f)
+        if is_encoded:
+            if length != REDIS_RDB_ENC_LZF:
+                raise Exception('read_blob', "Invalid blob encoding %s for key %s" % (length, self._key))
+            clen = self.read_length(f)
+            l = self.read_length(f)
+            return self.lzf_decompress(f.read(clen), l)
+        return read_view(length)
+
     def read_float(self, f):
         dbl_length = read_unsigned_char(f)
         if dbl_length == 253:
@@ -529,65 +1046,294 @@ class RdbParser(object):
     # Read an object for the stream
     # f is the redis file 
     # enc_type is the type of object
-    def read_object(self, f, enc_type) :
+    def find_elementless_types(self, callback):
+        """
+        Return the data types whose elements `callback` does not consume, i.e. for which it
+        overrides neither the element method nor the batch method of `RdbCallback`.
+        Values of these types are skipped, and only their start and end events are delivered.
+        """
+        elementless_types = set()
+        for methods, data_types in ELEMENT_METHODS:
+            if not any(_overrides(callback, name) for name in methods):
+                elementless_types.update(data_types)
+        return frozenset(elementless_types)
+
+    def read_object_without_elements(self, f, enc_type) :
+        """Skip the elements of a collection, delivering only its start and end events with the lengths and sizes"""
+        if enc_type == REDIS_RDB_TYPE_LIST :
+            length = self.read_length(f)
+            self._callback.start_list(self._key, self._expiry, info=self.key_info('linkedlist'))
+            for count in range(0, length) :
+                self.skip_string(f)
+            return self._callback.end_list(self._key, info=self.end_info('linkedlist'))
+        elif enc_type == REDIS_RDB_TYPE_SET :
+            length = self.read_length(f)
+            self._callback.start_set(self._key, length, self._expiry, info=self.key_info('hashtable'))
+            for count in range(0, length) :
+                self.skip_string(f)
+            return self._callback.end_set(self._key)
+        elif enc_type == REDIS_RDB_TYPE_ZSET or enc_type == REDIS_RDB_TYPE_ZSET_2 :
+            length = self.read_length(f)
+            self._callback.start_sorted_set(self._key, length, self._expiry, info=self.key_info('skiplist'))
+            for count in range(0, length) :
+                self.skip_string(f)
+                self.skip_binary_double(f) if enc_type == REDIS_RDB_TYPE_ZSET_2 else self.skip_float(f)
+            return self._callback.end_sorted_set(self._key)
+        elif enc_type == REDIS_RDB_TYPE_HASH :
+            length = self.read_length(f)
+            self._callback.start_hash(self._key, length, self._expiry, info=self.key_info('hashtable'))
+            for count in range(0, length * 2) :
+                self.skip_string(f)
+            return self._callback.end_hash(self._key)
+        elif enc_type == REDIS_RDB_TYPE_LIST_ZIPLIST :
+            size = self.skip_blob(f)
+            self._callback.start_list(self._key, self._expiry, info=self.key_info('ziplist', sizeof_value=size))
+            return self._callback.end_list(self._key, info=self.end_info('ziplist'))
+        elif enc_type == REDIS_RDB_TYPE_LIST_QUICKLIST :
+            count = self.read_length(f)
+            total_size = 0
+            for i in range(0, count) :
+                total_size += self.skip_blob(f)
+            self._callback.start_list(self._key, self._expiry, info=self.key_info('quicklist', zips=count))
+            return self._callback.end_list(self._key, info=self.end_info('quicklist', zips=count, sizeof_value=total_size))
+        elif enc_type == REDIS_RDB_TYPE_SET_INTSET :
+            raw_string = self.read_blob(f)
+            encoding, num_entries = _INTSET_HEADER.unpack_from(raw_string, 0)
+            self._callback.start_set(self._key, num_entries, self._expiry, info=self.key_info('intset', sizeof_value=len(raw_string)))
+            return self._callback.end_set(self._key)
+        elif enc_type == REDIS_RDB_TYPE_ZSET_ZIPLIST :
+            raw_string = self.read_blob(f)
+            num_entries = _ZIPLIST_HEADER.unpack_from(raw_string, 0)[2]
+            self._callback.start_sorted_set(self._key, num_entries // 2, self._expiry, info=self.key_info('ziplist', sizeof_value=len(raw_string)))
+            return self._callback.end_sorted_set(self._key)
+        elif enc_type == REDIS_RDB_TYPE_HASH_ZIPLIST :
+            raw_string = self.read_blob(f)
+            num_entries = _ZIPLIST_HEADER.unpack_from(raw_string, 0)[2]
+            self._callback.start_hash(self._key, num_entries // 2, self._expiry, info=self.key_info('ziplist', sizeof_value=len(raw_string)))
+            return self._callback.end_hash(self._key)
+        else :
+            raise Exception('read_object_without_elements', 'Invalid object type %d for key %s' % (enc_type, self._key))
+
+    def read_object_summary(self, f, enc_type) :
+        """Read a value in a compact encoding, delivering its elements as one `ElementSummary` rather than decoding them"""
+        if enc_type == REDIS_RDB_TYPE_LIST_ZIPLIST :
+            raw_string = self.read_blob(f)
+            self._callback.start_list(self._key, self._expiry, info=self.key_info('ziplist', sizeof_value=len(raw_string)))
+            entry_sizes = []
+            count, largest, integers = self.scan_ziplist(raw_string, 1, entry_sizes, 'read_ziplist')
+            self._callback.element_summary(self._key, ElementSummary(count, largest, integers, entry_sizes))
+            return self._callback.end_list(self._key, info=self.end_info('ziplist'))
+        elif enc_type == REDIS_RDB_TYPE_LIST_QUICKLIST :
+            zips = self.read_length(f)
+            total_size = 0
+            count = 0
+            largest = 0
+            integers = 0
+            entry_sizes = []
+            self._callback.start_list(self._key, self._expiry, info=self.key_info('quicklist', zips=zips))
+            for i in range(0, zips) :
+                raw_string = self.read_blob(f)
+                total_size += len(raw_string)
+                zip_count, zip_largest, zip_integers = self.scan_ziplist(raw_string, 1, entry_sizes, 'read_quicklist')
+                count += zip_count
+                largest = max(largest, zip_largest)
+                integers += zip_integers
+            self._callback.element_summary(self._key, ElementSummary(count, largest, integers, entry_sizes))
+            return self._callback.end_list(self._key, info=self.end_info('quicklist', zips=zips, sizeof_value=total_size))
+        elif enc_type == REDIS_RDB_TYPE_SET_INTSET :
+            raw_string = self.read_blob(f)
+            encoding, num_entries = _INTSET_HEADER.unpack_from(raw_string, 0)
+            if encoding not in _INTSET_ENTRY:
+                raise Exception('read_intset', 'Invalid encoding %d for key %s' % (encoding, self._key))
+            if _INTSET_HEADER.size + num_entries * encoding > len(raw_string):
+                raise Exception('read_intset', 'Expected %d entries, but found only %d bytes for key %s' % (
+                    num_entries, len(raw_string) - _INTSET_HEADER.size, self._key))
+            self._callback.start_set(self._key, num_entries, self._expiry, info=self.key_info('intset', sizeof_value=len(raw_string)))
+            self._callback.element_summary(self._key, ElementSummary(num_entries, 0, num_entries, None))
+            return self._callback.end_set(self._key)
+        elif enc_type == REDIS_RDB_TYPE_ZSET_ZIPLIST :
+            raw_string = self.read_blob(f)
+            num_entries = _ZIPLIST_HEADER.unpack_from(raw_string, 0)[2]
+            if (num_entries % 2) :
+                raise Exception('read_zset_from_ziplist', "Expected even number of elements, but found %d for key %s" % (num_entries, self._key))
+            self._callback.start_sorted_set(self._key, num_entries // 2, self._expiry, info=self.key_info('ziplist', sizeof_value=len(raw_string)))
+            count, largest, integers = self.scan_ziplist(raw_string, 2, None, 'read_zset_from_ziplist')
+            self._callback.element_summary(self._key, ElementSummary(count // 2, largest, integers, None))
+            return self._callback.end_sorted_set(self._key)
+        elif enc_type == REDIS_RDB_TYPE_HASH_ZIPLIST :
+            raw_string = self.read_blob(f)
+            num_entries = _ZIPLIST_HEADER.unpack_from(raw_string, 0)[2]
+            if (num_entries % 2) :
+                raise Exception('read_hash_from_ziplist', "Expected even number of elements, but found %d for key %s" % (num_entries, self._key))
+            self._callback.start_hash(self._key, num_entries // 2, self._expiry, info=self.key_info('ziplist', sizeof_value=len(raw_string)))
+            count, largest, integers = self.scan_ziplist(raw_string, 1, None, 'read_hash_from_ziplist')
+            self._callback.element_summary(self._key, ElementSummary(count // 2, largest, integers, None))
+            return self._callback.end_hash(self._key)
+        elif enc_type == REDIS_RDB_TYPE_HASH_ZIPMAP :
+            raw_string = self.read_string(f)
+            buff = indexable_bytes(raw_string)
+            self._callback.start_hash(self._key, buff[0], self._expiry, info=self.key_info('zipmap', sizeof_value=len(raw_string)))
+            self._callback.element_summary(self._key, self.scan_zipmap(buff))
+            return self._callback.end_hash(self._key)
+        else :
+            raise Exception('read_object_summary', 'Invalid object type %d for key %s' % (enc_type, self._key))
+
+    def read_object_with_encodings(self, f, enc_type) :
+        """Read a string or the elements of a collection that is not compactly encoded, along with their `ElementEncoding`"""
         if enc_type == REDIS_RDB_TYPE_STRING :
-            val = self.read_string(f)
-            self._callback.set(self._key, val, self._expiry, info={'encoding':'string','idle':self._idle,'freq':self._freq})
+            val, encoding = self.read_encoded_string(f)
+            return self._callback.set(self._key, val, self._expiry, info=self.key_info('string', value_encoding=encoding))
+        elif enc_type == REDIS_RDB_TYPE_LIST :
+            length = self.read_length(f)
+            self._callback.start_list(self._key, self._expiry, info=self.key_info('linkedlist'))
+            for count in range(0, length) :
+                val, encoding = self.read_encoded_string(f)
+                self._callback.rpush_encoded(self._key, val, encoding)
+            return self._callback.end_list(self._key, info=self.end_info('linkedlist'))
+        elif enc_type == REDIS_RDB_TYPE_SET :
+            length = self.read_length(f)
+            self._callback.start_set(self._key, length, self._expiry, info=self.key_info('hashtable'))
+            for count in range(0, length) :
+                val, encoding = self.read_encoded_string(f)
+                self._callback.sadd_encoded(self._key, val, encoding)
+            return self._callback.end_set(self._key)
+        elif enc_type == REDIS_RDB_TYPE_ZSET or enc_type == REDIS_RDB_TYPE_ZSET_2 :
+            length = self.read_length(f)
+            self._callback.start_sorted_set(self._key, length, self._expiry, info=self.key_info('skiplist'))
+            for count in range(0, length) :
+                val, encoding = self.read_encoded_string(f)
+                score = read_binary_double(f) if enc_type == REDIS_RDB_TYPE_ZSET_2 else self.read_float(f)
+                self._callback.zadd_encoded(self._key, score, val, encoding)
+            return self._callback.end_sorted_set(self._key)
+        elif enc_type == REDIS_RDB_TYPE_HASH :
+            length = self.read_length(f)
+            self._callback.start_hash(self._key, length, self._expiry, info=self.key_info('hashtable'))
+            for count in range(0, length) :
+                field, field_encoding = self.read_encoded_string(f)
+                value, value_encoding = self.read_encoded_string(f)
+                self._callback.hset_encoded(self._key, field, value, field_encoding, value_encoding)
+            return self._callback.end_hash(self._key)
+        else :
+            raise Exception('read_object_with_encodings', 'Invalid object type %d for key %s' % (enc_type, self._key))
+
+    def read_string_object(self, f) :
+        """Read a string value, and deliver it through `set` or, when it is longer than `string_chunk_size`, in chunks"""
+        chunk_size = self._string_chunk_size
+        length, is_encoded = self.read_length_with_encoding(f)
+        if not is_encoded :
+            if length <= chunk_size :
+                return self.deliver_string(f.read(length), ELEMENT_RAW)
+            self._callback.set_start(self._key, length, self._expiry, info=self.key_info('string', value_encoding=self.string_encoding(ELEMENT_RAW)))
+            if self._skip_string_chunks :
+                skip(f, length)
+            else :
+                while length > 0 :
+                    chunk = f.read(min(chunk_size, length))
+                    if not chunk :
+                        raise Exception('read_string_object', 'Truncated string value for key %s' % self._key)
+                    length -= len(chunk)
+                    self._callback.set_chunk(self._key, chunk)
+            return self._callback.set_end(self._key)
+        elif length == REDIS_RDB_ENC_LZF :
+            clen = self.read_length(f)
+            l = self.read_length(f)
+            encoding = ElementEncoding('lzf', None, clen)
+            if self._lazy_lzf_strings :
+                return self.deliver_string(LazyLzfString(f.read(clen), l, self._key), encoding)
+            elif l <= chunk_size :
+                return self.deliver_string(self.lzf_decompress(f.read(clen), l), encoding)
+            self._callback.set_start(self._key, l, self._expiry, info=self.key_info('string', value_encoding=self.string_encoding(encoding)))
+            if self._skip_string_chunks :
+                skip(f, clen)
+            else :
+                try :
+                    for chunk in pylzf.decompress_chunks(f.read(clen), l, chunk_size) :
+                        self._callback.set_chunk(self._key, chunk)
+                except ValueError as e :
+                    raise Exception('lzf_decompress', 'Invalid LZF data, %s for key %s' % (e, self._key))
+            return self._callback.set_end(self._key)
+        elif length == REDIS_RDB_ENC_INT8 :
+            return self.deliver_string(read_signed_char(f), ELEMENT_INT8)
+        elif length == REDIS_RDB_ENC_INT16 :
+            return self.deliver_string(read_signed_short(f), ELEMENT_INT16)
+        elif length == REDIS_RDB_ENC_INT32 :
+            return self.deliver_string(read_signed_int(f), ELEMENT_INT32)
+        raise Exception('read_string', "Invalid string encoding %s"%(length))
+
+    def string_encoding(self, encoding):
+        """The `value_encoding` of the `info` of a string value, for callbacks that set `element_encodings`"""
+        return encoding if self._encoded_element_types else None
+
+    def deliver_string(self, val, encoding):
+        return self._callback.set(self._key, val, self._expiry, info=self.key_info('string', value_encoding=self.string_encoding(encoding)))
+
+    def read_object(self, f, enc_type) :
+        if enc_type == REDIS_RDB_TYPE_STRING and self._string_chunk_size is not None :
+            return self.read_string_object(f)
+        elif enc_type in self._elementless_types :
+            return self.read_object_without_elements(f, enc_type)
+        elif enc_type in self._summarised_types :
+            return self.read_object_summary(f, enc_type)
+        elif enc_type in self._encoded_element_types :
+            return self.read_object_with_encodings(f, enc_type)
+        elif enc_type == REDIS_RDB_TYPE_STRING :
+            val = self.read_value_string(f)
+            return self._callback.set(self._key, val, self._expiry, info=self.key_info('string'))
         elif enc_type == REDIS_RDB_TYPE_LIST :
             # A redis list is just a sequence of strings
             # We successively read strings from the stream and create a list from it
             # The lists are in order i.e. the first string is the head, 
             # and the last string is the tail of the list
             length = self.read_length(f)
-            self._callback.start_list(self._key, self._expiry, info={'encoding':'linkedlist','idle':self._idle,'freq':self._freq})
+            self._callback.start_list(self._key, self._expiry, info=self.key_info('linkedlist'))
             for count in range(0, length) :
-                val = self.read_string(f)
+                val = self.read_value_string(f)
                 self._callback.rpush(self._key, val)
-            self._callback.end_list(self._key, info={'encoding':'linkedlist' })
+            return self._callback.end_list(self._key, info=self.end_info('linkedlist'))
         elif enc_type == REDIS_RDB_TYPE_SET:
             # A redis list is just a sequence of strings
             # We successively read strings from the stream and create a set from it
             # Note that the order of strings is non-deterministic
             length = self.read_length(f)
-            self._callback.start_set(self._key, length, self._expiry, info={'encoding':'hashtable','idle':self._idle,'freq':self._freq})
+            self._callback.start_set(self._key, length, self._expiry, info=self.key_info('hashtable'))
             for count in range(0, length):
-                val = self.read_string(f)
+                val = self.read_value_string(f)
                 self._callback.sadd(self._key, val)
-            self._callback.end_set(self._key)
+            return self._callback.end_set(self._key)
         elif enc_type == REDIS_RDB_TYPE_ZSET or enc_type == REDIS_RDB_TYPE_ZSET_2 :
             length = self.read_length(f)
-            self._callback.start_sorted_set(self._key, length, self._expiry, info={'encoding':'skiplist','idle':self._idle,'freq':self._freq})
+            self._callback.start_sorted_set(self._key, length, self._expiry, info=self.key_info('skiplist'))
             for count in range(0, length):
-                val = self.read_string(f)
+                val = self.read_value_string(f)
                 score = read_binary_double(f) if enc_type == REDIS_RDB_TYPE_ZSET_2 else self.read_float(f)
                 self._callback.zadd(self._key, score, val)
-            self._callback.end_sorted_set(self._key)
+            return self._callback.end_sorted_set(self._key)
         elif enc_type == REDIS_RDB_TYPE_HASH:
             length = self.read_length(f)
-            self._callback.start_hash(self._key, length, self._expiry, info={'encoding':'hashtable','idle':self._idle,'freq':self._freq})
+            self._callback.start_hash(self._key, length, self._expiry, info=self.key_info('hashtable'))
             for count in range(0, length):
-                field = self.read_string(f)
-                value = self.read_string(f)
+                field = self.read_value_string(f)
+                value = self.read_value_string(f)
                 self._callback.hset(self._key, field, value)
-            self._callback.end_hash(self._key)
+            return self._callback.end_hash(self._key)
         elif enc_type == REDIS_RDB_TYPE_HASH_ZIPMAP:
-            self.read_zipmap(f)
+            return self.read_zipmap(f)
         elif enc_type == REDIS_RDB_TYPE_LIST_ZIPLIST:
-            self.read_ziplist(f)
+            return self.read_ziplist(f)
         elif enc_type == REDIS_RDB_TYPE_SET_INTSET:
-            self.read_intset(f)
+            return self.read_intset(f)
         elif enc_type == REDIS_RDB_TYPE_ZSET_ZIPLIST:
-            self.read_zset_from_ziplist(f)
+            return self.read_zset_from_ziplist(f)
         elif enc_type == REDIS_RDB_TYPE_HASH_ZIPLIST:
-            self.read_hash_from_ziplist(f)
+            return self.read_hash_from_ziplist(f)
         elif enc_type == REDIS_RDB_TYPE_LIST_QUICKLIST:
-            self.read_list_from_quicklist(f)
+            return self.read_list_from_quicklist(f)
         elif enc_type == REDIS_RDB_TYPE_MODULE:
             raise Exception('read_object', 'Unable to read Redis Modules RDB objects (key %s)' % self._key)
         elif enc_type == REDIS_RDB_TYPE_MODULE_2:
-            self.read_module(f)
+            return self.read_module(f)
         elif enc_type == REDIS_RDB_TYPE_STREAM_LISTPACKS:
-            self.read_stream(f)
+            return self.read_stream(f)
         else:
             raise Exception('read_object', 'Invalid object type %d for key %s' % (enc_type, self._key))
 
@@ -616,6 +1362,19 @@ class RdbParser(object):
         
         skip(f, bytes_to_skip)
         
+    def skip_blob(self, f):
+        """Skip an encoded string holding a serialized structure, and return its length once decompressed"""
+        length, is_encoded = self.read_length_with_encoding(f)
+        if is_encoded :
+            if length != REDIS_RDB_ENC_LZF :
+                raise Exception('skip_blob', "Invalid blob encoding %s for key %s" % (length, self._key))
+            clen = self.read_length(f)
+            length = self.read_length(f)
+            skip(f, clen)
+        else :
+            skip(f, length)
+        return length
+
     def skip_float(self, f):
         dbl_length = read_unsigned_char(f)
         if dbl_length < 253:
@@ -664,97 +1423,217 @@ class RdbParser(object):
 
 
     def read_intset(self, f) :
-        raw_string = self.read_string(f)
-        buff = BytesIO(raw_string)
-        encoding = read_unsigned_int(buff)
-        num_entries = read_unsigned_int(buff)
-        self._callback.start_set(self._key, num_entries, self._expiry, info={'encoding':'intset', 'sizeof_value':len(raw_string),'idle':self._idle,'freq':self._freq})
-        for x in range(0, num_entries) :
-            if encoding == 8 :
-                entry = read_signed_long(buff)
-            elif encoding == 4 :
-                entry = read_signed_int(buff)
-            elif encoding == 2 :
-                entry = read_signed_short(buff)
-            else :
-                raise Exception('read_intset', 'Invalid encoding %d for key %s' % (encoding, self._key))
-            self._callback.sadd(self._key, entry)
-        self._callback.end_set(self._key)
+        raw_string = self.read_blob(f)
+        encoding, num_entries = _INTSET_HEADER.unpack_from(raw_string, 0)
+        if encoding not in _INTSET_ENTRY:
+            raise Exception('read_intset', 'Invalid encoding %d for key %s' % (encoding, self._key))
+        self._callback.start_set(self._key, num_entries, self._expiry, info=self.key_info('intset', sizeof_value=len(raw_string)))
+        start = _INTSET_HEADER.size
+        end = start + num_entries * encoding
+        if end > len(raw_string):
+            raise Exception('read_intset', 'Expected %d entries, but found only %d bytes for key %s' % (num_entries, len(raw_string) - start, self._key))
+        if encoding in _INTSET_ARRAY_TYPECODE:
+            members = array_from_bytes(_INTSET_ARRAY_TYPECODE[encoding], raw_string[start:end])
+            if _BIG_ENDIAN_HOST:
+                members.byteswap()
+        else:
+            unpack_entry = _INTSET_ENTRY[encoding].unpack_from
+            members = [unpack_entry(raw_string, pos)[0] for pos in range(start, end, encoding)]
+        self._callback.sadd_many(self._key, members)
+        return self._callback.end_set(self._key)
 
     def read_ziplist(self, f) :
-        raw_string = self.read_string(f)
-        buff = BytesIO(raw_string)
-        zlbytes = read_unsigned_int(buff)
-        tail_offset = read_unsigned_int(buff)
-        num_entries = read_unsigned_short(buff)
-        self._callback.start_list(self._key, self._expiry, info={'encoding':'ziplist', 'sizeof_value':len(raw_string),'idle':self._idle,'freq':self._freq})
-        for x in range(0, num_entries) :
-            val = self.read_ziplist_entry(buff)
-            self._callback.rpush(self._key, val)
-        zlist_end = read_unsigned_char(buff)
-        if zlist_end != 255 : 
-            raise Exception('read_ziplist', "Invalid zip list end - %d for key %s" % (zlist_end, self._key))
-        self._callback.end_list(self._key, info={'encoding':'ziplist'})
+        raw_string = self.read_blob(f)
+        buff = indexable_bytes(raw_string)
+        zlbytes, tail_offset, num_entries = _ZIPLIST_HEADER.unpack_from(buff, 0)
+        pos = _ZIPLIST_HEADER.size
+        self._callback.start_list(self._key, self._expiry, info=self.key_info('ziplist', sizeof_value=len(raw_string)))
+        values, pos = self.read_ziplist_entries(buff, pos, num_entries)
+        self.verify_ziplist_end(buff, pos, 'read_ziplist')
+        self._callback.rpush_many(self._key, values)
+        return self._callback.end_list(self._key, info=self.end_info('ziplist'))
 
     def read_list_from_quicklist(self, f):
         count = self.read_length(f)
         total_size = 0
-        self._callback.start_list(self._key, self._expiry, info={'encoding': 'quicklist', 'zips': count,'idle':self._idle,'freq':self._freq})
+        self._callback.start_list(self._key, self._expiry, info=self.key_info('quicklist', zips=count))
         for i in range(0, count):
-            raw_string = self.read_string(f)
+            raw_string = self.read_blob(f)
             total_size += len(raw_string)
-            buff = BytesIO(raw_string)
-            zlbytes = read_unsigned_int(buff)
-            tail_offset = read_unsigned_int(buff)
-            num_entries = read_unsigned_short(buff)
-            for x in range(0, num_entries):
-                self._callback.rpush(self._key, self.read_ziplist_entry(buff))
-            zlist_end = read_unsigned_char(buff)
-            if zlist_end != 255:
-                raise Exception('read_quicklist', "Invalid zip list end - %d for key %s" % (zlist_end, self._key))
-        self._callback.end_list(self._key, info={'encoding': 'quicklist', 'zips': count, 'sizeof_value': total_size})
+            buff = indexable_bytes(raw_string)
+            zlbytes, tail_offset, num_entries = _ZIPLIST_HEADER.unpack_from(buff, 0)
+            values, pos = self.read_ziplist_entries(buff, _ZIPLIST_HEADER.size, num_entries)
+            self.verify_ziplist_end(buff, pos, 'read_quicklist')
+            self._callback.rpush_many(self._key, values)
+        return self._callback.end_list(self._key, info=self.end_info('quicklist', zips=count, sizeof_value=total_size))
 
     def read_zset_from_ziplist(self, f) :
-        raw_string = self.read_string(f)
-        buff = BytesIO(raw_string)
-        zlbytes = read_unsigned_int(buff)
-        tail_offset = read_unsigned_int(buff)
-        num_entries = read_unsigned_short(buff)
+        raw_string = self.read_blob(f)
+        buff = indexable_bytes(raw_string)
+        zlbytes, tail_offset, num_entries = _ZIPLIST_HEADER.unpack_from(buff, 0)
+        pos = _ZIPLIST_HEADER.size
         if (num_entries % 2) :
             raise Exception('read_zset_from_ziplist', "Expected even number of elements, but found %d for key %s" % (num_entries, self._key))
         num_entries = num_entries // 2
-        self._callback.start_sorted_set(self._key, num_entries, self._expiry, info={'encoding':'ziplist', 'sizeof_value':len(raw_string),'idle':self._idle,'freq':self._freq})
-        for x in range(0, num_entries) :
-            member = self.read_ziplist_entry(buff)
-            score = self.read_ziplist_entry(buff)
-            if isinstance(score, bytes) :
-                score = float(score)
-            self._callback.zadd(self._key, score, member)
-        zlist_end = read_unsigned_char(buff)
-        if zlist_end != 255 : 
-            raise Exception('read_zset_from_ziplist', "Invalid zip list end - %d for key %s" % (zlist_end, self._key))
-        self._callback.end_sorted_set(self._key)
+        self._callback.start_sorted_set(self._key, num_entries, self._expiry, info=self.key_info('ziplist', sizeof_value=len(raw_string)))
+        entries, pos = self.read_ziplist_entries(buff, pos, num_entries * 2)
+        self.verify_ziplist_end(buff, pos, 'read_zset_from_ziplist')
+        scores = [float(score) if isinstance(score, bytes) else score for score in entries[1::2]]
+        self._callback.zadd_many(self._key, scores, entries[0::2])
+        return self._callback.end_sorted_set(self._key)
 
     def read_hash_from_ziplist(self, f) :
-        raw_string = self.read_string(f)
-        buff = BytesIO(raw_string)
-        zlbytes = read_unsigned_int(buff)
-        tail_offset = read_unsigned_int(buff)
-        num_entries = read_unsigned_short(buff)
+        raw_string = self.read_blob(f)
+        buff = indexable_bytes(raw_string)
+        zlbytes, tail_offset, num_entries = _ZIPLIST_HEADER.unpack_from(buff, 0)
+        pos = _ZIPLIST_HEADER.size
         if (num_entries % 2) :
             raise Exception('read_hash_from_ziplist', "Expected even number of elements, but found %d for key %s" % (num_entries, self._key))
         num_entries = num_entries // 2
-        self._callback.start_hash(self._key, num_entries, self._expiry, info={'encoding':'ziplist', 'sizeof_value':len(raw_string),'idle':self._idle,'freq':self._freq})
-        for x in range(0, num_entries) :
-            field = self.read_ziplist_entry(buff)
-            value = self.read_ziplist_entry(buff)
-            self._callback.hset(self._key, field, value)
-        zlist_end = read_unsigned_char(buff)
-        if zlist_end != 255 : 
-            raise Exception('read_hash_from_ziplist', "Invalid zip list end - %d for key %s" % (zlist_end, self._key))
-        self._callback.end_hash(self._key)
-    
-    
+        self._callback.start_hash(self._key, num_entries, self._expiry, info=self.key_info('ziplist', sizeof_value=len(raw_string)))
+        entries, pos = self.read_ziplist_entries(buff, pos, num_entries * 2)
+        self.verify_ziplist_end(buff, pos, 'read_hash_from_ziplist')
+        self._callback.hset_many(self._key, entries[0::2], entries[1::2])
+        return self._callback.end_hash(self._key)
+
+    def verify_ziplist_end(self, buff, pos, caller):
+        zlist_end = buff[pos]
+        if zlist_end != 255 :
+            raise Exception(caller, "Invalid zip list end - %d for key %s" % (zlist_end, self._key))
+
+    def read_ziplist_entries(self, buff, pos, num_entries) :
+        """
+        Decode `num_entries` consecutive ziplist entries starting at offset `pos` of `buff`
+        in one pass, without copying anything but the entry values themselves.
+
+        Returns a tuple of the list of values and the offset after the last entry.
+        """
+        values = []
+        append = values.append
+        unpack_short = _SIGNED_SHORT.unpack_from
+        unpack_int = _SIGNED_INT.unpack_from
+        unpack_long = _SIGNED_LONG.unpack_from
+        unpack_length = _UNSIGNED_INT_BE.unpack_from
+        for x in range(num_entries) :
+            pos += 5 if buff[pos] == 254 else 1
+            entry_header = buff[pos]
+            pos += 1
+            if entry_header < 0x40 :
+                end = pos + entry_header
+                append(bytes(buff[pos:end]))
+                pos = end
+            elif entry_header < 0x80 :
+                end = pos + 1 + (((entry_header & 0x3F) << 8) | buff[pos])
+                append(bytes(buff[pos + 1:end]))
+                pos = end
+            elif entry_header < 0xC0 :
+                end = pos + 4 + unpack_length(buff, pos)[0]
+                append(bytes(buff[pos + 4:end]))
+                pos = end
+            elif entry_header >= 241 and entry_header <= 253 :
+                append(entry_header - 241)
+            elif (entry_header >> 4) == 12 :
+                append(unpack_short(buff, pos)[0])
+                pos += 2
+            elif (entry_header >> 4) == 13 :
+                append(unpack_int(buff, pos)[0])
+                pos += 4
+            elif (entry_header >> 4) == 14 :
+                append(unpack_long(buff, pos)[0])
+                pos += 8
+            elif entry_header == 240 :
+                num = buff[pos] | (buff[pos + 1] << 8) | (buff[pos + 2] << 16)
+                if num & 0x800000 :
+                    num -= 0x1000000
+                append(num)
+                pos += 3
+            elif entry_header == 254 :
+                append(_SIGNED_CHAR.unpack_from(buff, pos)[0])
+                pos += 1
+            else :
+                raise Exception('read_ziplist_entry', 'Invalid entry_header %d for key %s' % (entry_header, self._key))
+        return values, pos
+
+    def scan_ziplist(self, raw_string, every, entry_sizes, caller) :
+        """
+        Read the entry headers of the ziplist in `raw_string`, skipping over the strings without copying them.
+        One entry in `every` is an element, from the first. When `entry_sizes` is a list, the `ziplist_entry_size`
+        of each entry is appended to it, which is the only case where integers are decoded.
+
+        Returns a tuple of the number of entries, the length of the longest string element and the number of integer elements.
+        """
+        buff = indexable_bytes(raw_string)
+        num_entries = _ZIPLIST_HEADER.unpack_from(buff, 0)[2]
+        pos = _ZIPLIST_HEADER.size
+        largest = 0
+        integers = 0
+        unpack_length = _UNSIGNED_INT_BE.unpack_from
+        for x in range(num_entries) :
+            pos += 5 if buff[pos] == 254 else 1
+            entry_header = buff[pos]
+            pos += 1
+            if entry_header < 0xC0 :
+                if entry_header < 0x40 :
+                    length = entry_header
+                elif entry_header < 0x80 :
+                    length = ((entry_header & 0x3F) << 8) | buff[pos]
+                    pos += 1
+                else :
+                    length = unpack_length(buff, pos)[0]
+                    pos += 4
+                pos += length
+                if length > largest and x % every == 0 :
+                    largest = length
+                if entry_sizes is not None :
+                    entry_sizes.append(ziplist_string_entry_size(length))
+            else :
+                width = _ZIPLIST_INTEGER_WIDTH[entry_header]
+                if width is None :
+                    raise Exception('read_ziplist_entry', 'Invalid entry_header %d for key %s' % (entry_header, self._key))
+                if entry_sizes is not None :
+                    entry_sizes.append(ziplist_entry_size(read_ziplist_integer(buff, pos, entry_header)))
+                pos += width
+                if x % every == 0 :
+                    integers += 1
+        self.verify_ziplist_end(buff, pos, caller)
+        return num_entries, largest, integers
+
+    def scan_zipmap(self, buff) :
+        """
+        Return the `ElementSummary` of the zipmap in `buff`. Like `read_zipmap`, values that hold a number are integers,
+        so only the values are copied, to be parsed.
+        """
+        pos = 1
+        count = 0
+        largest = 0
+        integers = 0
+        unpack_length = _UNSIGNED_INT.unpack_from
+        while True :
+            length = buff[pos]
+            if length == 255 :
+                break
+            if length == 254 :
+                length = unpack_length(buff, pos + 1)[0]
+                pos += 4
+            pos += 1 + length
+            largest = max(largest, length)
+            length = buff[pos]
+            if length == 255 :
+                raise Exception('read_zip_map', 'Unexepcted end of zip map for key %s' % self._key)
+            if length == 254 :
+                length = unpack_length(buff, pos + 1)[0]
+                pos += 4
+            free = buff[pos + 1]
+            pos += 2
+            try:
+                int(bytes(buff[pos:pos + length]))
+                integers += 1
+            except ValueError:
+                largest = max(largest, length)
+            pos += length + free
+            count += 1
+        return ElementSummary(count, largest, integers, None)
+
     def read_ziplist_entry(self, f) :
         length = 0
         value = None
@@ -791,7 +1670,7 @@ class RdbParser(object):
         raw_string = self.read_string(f)
         buff = io.BytesIO(bytearray(raw_string))
         num_entries = read_unsigned_char(buff)
-        self._callback.start_hash(self._key, num_entries, self._expiry, info={'encoding':'zipmap', 'sizeof_value':len(raw_string),'idle':self._idle,'freq':self._freq})
+        self._callback.start_hash(self._key, num_entries, self._expiry, info=self.key_info('zipmap', sizeof_value=len(raw_string)))
         while True :
             next_length = self.read_zipmap_next_length(buff)
             if next_length is None :
@@ -809,7 +1688,7 @@ class RdbParser(object):
             
             skip(buff, free)
             self._callback.hset(self._key, key, value)
-        self._callback.end_hash(self._key)
+        return self._callback.end_hash(self._key)
 
     def read_zipmap_next_length(self, f) :
         num = read_unsigned_char(f)
@@ -843,7 +1722,7 @@ class RdbParser(object):
         iowrapper.start_recording_size()
         iowrapper.start_recording()
         length, encoding = self.read_length_with_encoding(iowrapper)
-        record_buffer = self._callback.start_module(self._key, self._decode_module_id(length), self._expiry, info={'idle':self._idle, 'freq':self._freq})
+        record_buffer = self._callback.start_module(self._key, self._decode_module_id(length), self._expiry, info=self.key_info(None))
 
         if not record_buffer:
             iowrapper.stop_recording()
@@ -869,7 +1748,7 @@ class RdbParser(object):
             # prepand the buffer with REDIS_RDB_TYPE_MODULE_2 type
             buffer = struct.pack('B', REDIS_RDB_TYPE_MODULE_2) + iowrapper.get_recorded_buffer()
             iowrapper.stop_recording()
-        self._callback.end_module(self._key, buffer_size=iowrapper.get_recorded_size(), buffer=buffer)
+        return self._callback.end_module(self._key, buffer_size=iowrapper.get_recorded_size(), buffer=buffer)
 
     def skip_stream(self, f):
         listpacks = self.read_length(f)
@@ -886,20 +1765,19 @@ class RdbParser(object):
             self.read_length(f)
             pending = self.read_length(f)
             for _pel in range(pending):
-                f.read(16)
-                f.read(8)
+                skip(f, 24)  # entry id and delivery time
                 self.read_length(f)
             consumers = self.read_length(f)
             for _c in range(consumers):
                 self.skip_string(f)
-                f.read(8)
+                skip(f, 8)
                 pending = self.read_length(f)
-                f.read(pending*16)
+                skip(f, pending*16)
 
     def read_stream(self, f):
         listpacks = self.read_length(f)
         self._callback.start_stream(self._key, listpacks, self._expiry,
-                                    info={'encoding': 'listpack', 'idle': self._idle, 'freq': self._freq})
+                                    info=self.key_info('listpack'))
         for _lp in range(listpacks):
             self._callback.stream_listpack(self._key, self.read_string(f), self.read_string(f))
         items = self.read_length(f)
@@ -935,7 +1813,7 @@ class RdbParser(object):
                                  'last_entry_id': last_cg_entry_id,
                                  'pending': group_pending_entries,
                                  'consumers': consumers_data})
-        self._callback.end_stream(self._key, items, last_entry_id, cgroups_data)
+        return self._callback.end_stream(self._key, items, last_entry_id, cgroups_data)
 
     charset = 'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-_'
 
@@ -964,101 +1842,377 @@ class RdbParser(object):
         self._rdb_version = version
 
     def init_filter(self, filters):
-        self._filters = {}
+        """
+        Compile `filters` (see `rdbtools.filters.compile_key_filter`) into `_dbs`, the set of
+        selected databases or None for all of them, and `_key_filter`, a function of
+        `(key, data_type)` or None when all keys are selected. `_header_filter` and `_value_filter`
+        check the metadata and the size of values before they are decoded, see `rdbtools.filters`.
+        """
         if not filters:
-            filters={}
-
-        if not 'dbs' in filters:
-            self._filters['dbs'] = None
-        elif isinstance(filters['dbs'], int):
-            self._filters['dbs'] = (filters['dbs'], )
-        elif isinstance(filters['dbs'], list):
-            self._filters['dbs'] = [int(x) for x in filters['dbs']]
-        else:
-            raise Exception('init_filter', 'invalid value for dbs in filter %s' %filters['dbs'])
-        
-        if not ('keys' in filters and filters['keys']):
-            self._filters['keys'] = re.compile(b".*")
-        else:
-            self._filters['keys'] = str2regexp(filters['keys'])
-        
-        if not ('not_keys' in filters and filters['not_keys']):
-            self._filters['not_keys'] = None
-        else:
-            self._filters['not_keys'] = str2regexp(filters['not_keys'])
-
-        if 'types' in filters:
-            if isinstance(filters['types'], bytes):
-                self._filters['types'] = (filters['types'], )
-            elif isinstance(filters['types'], list):
-                self._filters['types'] = [str(x) for x in filters['types']]
-            else:
-                raise Exception('init_filter', 'invalid value for types in filter %s' %filters['types'])
-        
-    def matches_filter(self, db_number, key=None, data_type=None):
+            filters = {}
+        self._filters = filters
+        self._key_set = exact_key_set(filters)
+        self._dbs = compile_db_filter(filters)
+        self._key_filter = compile_key_filter(filters, DATA_TYPE_MAPPING, self._key_set)
+        self._header_filter = compile_header_filter(filters, self._raw_key_metadata)
+        self._value_filter = compile_value_filter(filters)
+        self._count_elements = filters.get('min_elements') is not None
+        # stop conditions keep count of the keys, so each parse compiles its own, this only checks them
+        compile_stop_condition(filters, self._key_set)
+
+    def matches_value(self, f, data_type):
+        elements, size = self.probe_value(f, data_type)
+        return self._value_filter(self._key, elements, size)
+
+    def probe_value(self, f, enc_type):
+        """
+        Return `(elements, size)` for the value that starts at the current position of the seekable `f`,
+        without decoding its elements, and go back to that position. `size` is the length of the value
+        before compression, or None for encodings whose elements are stored one by one. `elements` is None
+        for the values stored in one piece when no filter needs it, and these are then not decompressed.
+        """
+        start = f.tell()
+        count = self._count_elements
+        try:
+            if enc_type == REDIS_RDB_TYPE_STRING :
+                length, is_encoded = self.read_length_with_encoding(f)
+                if not is_encoded :
+                    return 1, length
+                elif length == REDIS_RDB_ENC_LZF :
+                    self.read_length(f)
+                    return 1, self.read_length(f)
+                else :
+                    f.seek(start)
+                    return 1, len(str(self.read_string(f)))
+            elif enc_type in (REDIS_RDB_TYPE_LIST, REDIS_RDB_TYPE_SET, REDIS_RDB_TYPE_ZSET, REDIS_RDB_TYPE_ZSET_2, REDIS_RDB_TYPE_HASH) :
+                return self.read_length(f), None
+            elif enc_type in (REDIS_RDB_TYPE_LIST_ZIPLIST, REDIS_RDB_TYPE_ZSET_ZIPLIST, REDIS_RDB_TYPE_HASH_ZIPLIST) :
+                if not count :
+                    return None, self.read_blob_header(f, 0)[1]
+                header, size = self.read_blob_header(f, _ZIPLIST_HEADER.size)
+                num_entries = _ZIPLIST_HEADER.unpack_from(header, 0)[2]
+                return (num_entries if enc_type == REDIS_RDB_TYPE_LIST_ZIPLIST else num_entries // 2), size
+            elif enc_type == REDIS_RDB_TYPE_SET_INTSET :
+                if not count :
+                    return None, self.read_blob_header(f, 0)[1]
+                header, size = self.read_blob_header(f, _INTSET_HEADER.size)
+                return _INTSET_HEADER.unpack_from(header, 0)[1], size
+            elif enc_type == REDIS_RDB_TYPE_LIST_QUICKLIST :
+                elements = 0
+                size = 0
+                for i in range(0, self.read_length(f)) :
+                    header, node_size = self.read_blob_header(f, _ZIPLIST_HEADER.size if count else 0)
+                    if count :
+                        elements += _ZIPLIST_HEADER.unpack_from(header, 0)[2]
+                    size += node_size
+                return (elements if count else None), size
+            elif enc_type == REDIS_RDB_TYPE_HASH_ZIPMAP :
+                if not count :
+                    return None, self.read_blob_header(f, 0)[1]
+                raw_string = self.read_string(f)
+                num_entries = indexable_bytes(raw_string)[0]
+                if num_entries >= 254 :
+                    # the count is only stored for small zipmaps
+                    num_entries = self.count_zipmap_entries(raw_string)
+                return num_entries, len(raw_string)
+            elif enc_type == REDIS_RDB_TYPE_STREAM_LISTPACKS :
+                for _lp in range(self.read_length(f)) :
+                    self.skip_string(f)
+                    self.skip_string(f)
+                return self.read_length(f), None
+            else :
+                return 1, None
+        finally :
+            f.seek(start)
 
-        if isinstance(key, bytes):
-            key_to_match = key
-        elif isinstance(key, str): # bytes key in python2
-            key_to_match = key
-        else:
-            key_to_match = str(key).encode('utf-8')
+    def read_blob_header(self, f, n):
+        """
+        Read the first `n` bytes of an encoded string holding a serialized structure, and return them
+        with the length of the whole structure, and move past it. With `n` 0, return None for the bytes.
+        Compressed structures are only decompressed up to the chunk of `pylzf.decompress_chunks` with
+        the header, and not at all when `n` is 0.
+        """
+        length, is_encoded = self.read_length_with_encoding(f)
+        if is_encoded :
+            if length != REDIS_RDB_ENC_LZF :
+                raise Exception('read_blob_header', "Invalid blob encoding %s for key %s" % (length, self._key))
+            clen = self.read_length(f)
+            length = self.read_length(f)
+            if not n :
+                skip(f, clen)
+                return None, length
+            chunks = pylzf.decompress_chunks(f.read(clen), length, n)
+            try :
+                return next(chunks)[:n], length
+            finally :
+                chunks.close()
+        if not n :
+            skip(f, length)
+            return None, length
+        header = f.read(n)
+        skip(f, length - n)
+        return header, length
+
+    def count_zipmap_entries(self, raw_string):
+        buff = io.BytesIO(bytearray(raw_string))
+        read_unsigned_char(buff)
+        num_entries = 0
+        while True :
+            next_length = self.read_zipmap_next_length(buff)
+            if next_length is None :
+                return num_entries
+            skip(buff, next_length)
+            next_length = self.read_zipmap_next_length(buff)
+            free = read_unsigned_char(buff)
+            skip(buff, next_length + free)
+            num_entries += 1
 
-        if self._filters['dbs'] and (not db_number in self._filters['dbs']):
-            return False
-        if key and self._filters['not_keys'] and (self._filters['not_keys'].match(key_to_match)):
-            return False
-        if key and (not self._filters['keys'].match(key_to_match)):
-            return False
+    def matches_db(self, db_number):
+        return self._dbs is None or db_number in self._dbs
 
-        if data_type is not None and 'types' in self._filters and (not self.get_logical_type(data_type) in self._filters['types']):
+    def matches_filter(self, db_number, key=None, data_type=None):
+        if self._dbs is not None and not db_number in self._dbs:
             return False
-        return True
+        if key is None or self._key_filter is None:
+            return True
+        return self._key_filter(key, data_type)
     
     def get_logical_type(self, data_type):
         return DATA_TYPE_MAPPING[data_type]
         
     def lzf_decompress(self, compressed, expected_length):
-        if HAS_PYTHON_LZF:
-            return lzf.decompress(compressed, expected_length)
+        return lzf_decompress(compressed, expected_length, self._key)
+
+def lzf_decompress(compressed, expected_length, key=None):
+    if HAS_PYTHON_LZF:
+        return lzf.decompress(compressed, expected_length)
+    else:
+        try:
+            return pylzf.decompress(compressed, expected_length)
+        except ValueError as e:
+            raise Exception('lzf_decompress', 'Invalid LZF data, %s for key %s' % (e, key))
+
+class LazyLzfString(object):
+    """
+    An LZF compressed string value, that is only decompressed when its bytes are used.
+
+    `len()` is the uncompressed length, and does not decompress anything.
+    `bytes()` (or `str()` on python 2) and `value()` return the decompressed bytes.
+    Callbacks receive these instead of bytes when they set `lazy_lzf_strings`, see `RdbCallback`.
+    """
+    __slots__ = ('_compressed', '_length', '_key', '_value')
+
+    def __init__(self, compressed, length, key=None):
+        self._compressed = compressed
+        self._length = length
+        self._key = key
+        self._value = None
+
+    def value(self):
+        if self._value is None:
+            self._value = lzf_decompress(self._compressed, self._length, self._key)
+            self._compressed = None
+        return self._value
+
+    def __len__(self):
+        return self._length
+
+    def __bytes__(self):
+        return self.value()
+
+    if sys.version_info < (3,):
+        __str__ = __bytes__
+
+    def __eq__(self, other):
+        if isinstance(other, LazyLzfString):
+            other = other.value()
+        return self.value() == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.value())
+
+    def __repr__(self):
+        return 'LazyLzfString(%d bytes)' % self._length
+
+class KeyInfo(object):
+    """
+    The `info` of key events for callbacks that set `raw_key_metadata`, see `RdbCallback`.
+
+    The parser reuses one KeyInfo for all keys, so callbacks must copy the attributes they keep.
+    Attributes that do not apply to a key are None. A KeyInfo can also be read like the `info` dict,
+    where these attributes are missing.
+    """
+    __slots__ = ('encoding', 'idle', 'freq', 'zips', 'sizeof_value', 'value_encoding')
+
+    def __init__(self):
+        self.encoding = None
+        self.idle = None
+        self.freq = None
+        self.zips = None
+        self.sizeof_value = None
+        self.value_encoding = None
+
+    def __getitem__(self, name):
+        value = self.get(name)
+        if value is None:
+            raise KeyError(name)
+        return value
+
+    def __contains__(self, name):
+        return self.get(name) is not None
+
+    def get(self, name, default=None):
+        value = getattr(self, name) if name in KeyInfo.__slots__ else None
+        return default if value is None else value
+
+    def copy(self):
+        info = KeyInfo()
+        for name in KeyInfo.__slots__:
+            setattr(info, name, getattr(self, name))
+        return info
+
+    def __repr__(self):
+        return 'KeyInfo(%s)' % ', '.join('%s=%r' % (name, getattr(self, name)) for name in KeyInfo.__slots__
+                                         if getattr(self, name) is not None)
+
+class OrderedCallback(object):
+    """
+    Stands in for the callback of a parser that decompresses large values on other threads, and
+    delivers its events in file order. Events that carry values still being decompressed, and all
+    the events after them, are queued. Queued events are delivered as soon as their values are ready,
+    and the parse waits for the oldest values when more than `window` of them are pending.
+
+    A key's `info` is copied when its events are queued, as a `KeyInfo` is reused for the next keys.
+    Once the callback stops the parse, every later event returns STOP_PARSING and is dropped, except
+    for `end_database` and `end_rdb`, which end the last database the callback saw.
+    """
+    # events whose result the parser needs at once
+    SYNCHRONOUS_EVENTS = frozenset(('start_module', ))
+
+    def __init__(self, callback, window):
+        self._callback = callback
+        self._window = window
+        self._events = deque()
+        self._pending = 0
+        self._stopped = False
+        self._db_number = None
+        self._ended = set()
+
+    def __getattr__(self, name):
+        method = getattr(self._callback, name)
+        if not callable(method):
+            return method
+        # the events are cached on this object, and only refer to it weakly, so that it is freed on return
+        ordered = weakref.proxy(self)
+        if name in OrderedCallback.SYNCHRONOUS_EVENTS:
+            def event(*args, **kwargs):
+                ordered.drain()
+                return None if ordered._stopped else method(*args, **kwargs)
         else:
-            in_stream = bytearray(compressed)
-            in_len = len(in_stream)
-            in_index = 0
-            out_stream = bytearray()
-            out_index = 0
-
-            while in_index < in_len :
-                ctrl = in_stream[in_index]
-                if not isinstance(ctrl, int) :
-                    raise Exception('lzf_decompress', 'ctrl should be a number %s for key %s' % (str(ctrl), self._key))
-                in_index = in_index + 1
-                if ctrl < 32 :
-                    for x in range(0, ctrl + 1) :
-                        out_stream.append(in_stream[in_index])
-                        #sys.stdout.write(chr(in_stream[in_index]))
-                        in_index = in_index + 1
-                        out_index = out_index + 1
-                else :
-                    length = ctrl >> 5
-                    if length == 7 :
-                        length = length + in_stream[in_index]
-                        in_index = in_index + 1
-
-                    ref = out_index - ((ctrl & 0x1f) << 8) - in_stream[in_index] - 1
-                    in_index = in_index + 1
-                    for x in range(0, length + 2) :
-                        out_stream.append(out_stream[ref])
-                        ref = ref + 1
-                        out_index = out_index + 1
-            if len(out_stream) != expected_length :
-                raise Exception('lzf_decompress', 'Expected lengths do not match %d != %d for key %s' % (len(out_stream), expected_length, self._key))
-            return bytes(out_stream)
+            def event(*args, **kwargs):
+                return ordered.call(name, method, args, kwargs)
+        setattr(self, name, event)
+        return event
+
+    def call(self, name, method, args, kwargs):
+        if self._stopped:
+            if name == 'end_database' or name == 'end_rdb':
+                return self.deliver_end(name, method, args)
+            return STOP_PARSING
+        pending = sum(1 for arg in args if isinstance(arg, ApplyResult))
+        if not pending and not self._events:
+            return self.deliver(name, method, args, kwargs)
+        kwargs = dict((k, v.copy() if isinstance(v, KeyInfo) else v) for k, v in kwargs.items())
+        args = tuple(arg.copy() if isinstance(arg, KeyInfo) else arg for arg in args)
+        self._events.append((name, method, args, kwargs, pending))
+        self._pending += pending
+        self.flush(False)
+        while self._pending > self._window:
+            self.flush_one()
+        return STOP_PARSING if self._stopped else None
+
+    def deliver(self, name, method, args, kwargs):
+        if name == 'start_database':
+            self._db_number = args[0]
+        result = method(*args, **kwargs)
+        if result is STOP_PARSING or (name == 'aux_field' and result):
+            self._stopped = True
+            if result is not STOP_PARSING:
+                # other true values of aux_field abort the parse without ending it
+                self._ended.update(('end_database', 'end_rdb'))
+            ends = [event for event in self._events if event[0] == 'end_database' or event[0] == 'end_rdb']
+            self._events.clear()
+            self._pending = 0
+            for end_name, end_method, end_args, end_kwargs, pending in ends:
+                self.deliver_end(end_name, end_method, end_args)
+        return result
+
+    def deliver_end(self, name, method, args):
+        """Deliver `end_database` or `end_rdb` once after the callback stopped the parse"""
+        if name in self._ended:
+            return None
+        self._ended.add(name)
+        if name == 'end_rdb':
+            return method()
+        return method(args[0] if self._db_number is None else self._db_number)
+
+    def flush_one(self):
+        """Deliver the oldest queued event, waiting for its values if needed"""
+        name, method, args, kwargs, pending = self._events.popleft()
+        self._pending -= pending
+        if pending:
+            args = tuple(arg.get() if isinstance(arg, ApplyResult) else arg for arg in args)
+        self.deliver(name, method, args, kwargs)
+
+    def flush(self, wait):
+        """Deliver the queued events whose values are ready, or all of them if `wait`"""
+        while self._events:
+            if not wait and not all(arg.ready() for arg in self._events[0][2] if isinstance(arg, ApplyResult)):
+                return
+            self.flush_one()
+
+    def drain(self):
+        self.flush(True)
+
+def _overrides(callback, name):
+    """True if `callback` has its own implementation of the RdbCallback method `name`"""
+    method = getattr(callback, name, None)
+    base = getattr(RdbCallback, name)
+    return getattr(method, '__func__', method) is not getattr(base, '__func__', base)
 
 def skip(f, free):
-    if free :
+    """
+    Advance `f` past the next `free` bytes.
+    Seekable inputs jump over them, other streams read and discard them in bounded chunks.
+    """
+    if not free :
+        return
+    skip_bytes = getattr(f, 'skip', None)
+    if skip_bytes is not None :
+        skip_bytes(free)
+    elif _is_seekable(f) :
+        f.seek(free, io.SEEK_CUR)
+    else :
+        while free > SKIP_CHUNK_SIZE :
+            f.read(SKIP_CHUNK_SIZE)
+            free -= SKIP_CHUNK_SIZE
         f.read(free)
 
+def _is_seekable(f):
+    try :
+        return f.seekable()
+    except AttributeError :
+        return False
+
+def expiry_to_datetime(expiry):
+    """The datetime of an expiry given in milliseconds since the epoch, as with `raw_key_metadata`"""
+    if expiry is None:
+        return None
+    return to_datetime(expiry * 1000)
+
 def to_datetime(usecs_since_epoch):
     seconds_since_epoch = usecs_since_epoch // 1000000
     if seconds_since_epoch > 221925052800 :
@@ -1068,26 +2222,114 @@ def to_datetime(usecs_since_epoch):
     delta = datetime.timedelta(microseconds = useconds)
     return dt + delta
     
+_SIGNED_CHAR = struct.Struct('b')
+_UNSIGNED_CHAR = struct.Struct('B')
+_SIGNED_SHORT = struct.Struct('h')
+_UNSIGNED_SHORT = struct.Struct('H')
+_SIGNED_INT = struct.Struct('i')
+_UNSIGNED_INT = struct.Struct('I')
+_UNSIGNED_INT_BE = struct.Struct('>I')
+_SIGNED_LONG = struct.Struct('q')
+_UNSIGNED_LONG = struct.Struct('Q')
+_UNSIGNED_LONG_BE = struct.Struct('>Q')
+_BINARY_DOUBLE = struct.Struct('d')
+_BINARY_FLOAT = struct.Struct('f')
+
+# <zlbytes><zltail><zllen> header of a ziplist, and <encoding><length> header of an intset
+_ZIPLIST_HEADER = struct.Struct('IIH')
+_INTSET_HEADER = struct.Struct('II')
+_INTSET_ENTRY = {2: _SIGNED_SHORT, 4: _SIGNED_INT, 8: _SIGNED_LONG}
+
+def _array_typecodes():
+    typecodes = {}
+    for typecode in ('h', 'i', 'l', 'q'):
+        try:
+            typecodes.setdefault(array.array(typecode).itemsize, typecode)
+        except ValueError:
+            pass  # no 'q' before python 3.3
+    return typecodes
+
+# array.array typecode for each intset encoding, intsets are little endian
+_INTSET_ARRAY_TYPECODE = _array_typecodes()
+_BIG_ENDIAN_HOST = sys.byteorder == 'big'
+
+# Largest read used to discard skipped bytes on a stream that cannot seek
+SKIP_CHUNK_SIZE = 1024 * 1024
+
+# Default chunk size for callbacks that take large string values in chunks, see RdbCallback.string_chunk_size
+STRING_CHUNK_SIZE = 1024 * 1024
+
+# Smallest LZF compressed value that is decompressed on another thread, see RdbParser and OrderedCallback
+LZF_THREAD_MIN_LENGTH = 16 * 1024
+# Values that can wait for their decompression, per decompression thread
+LZF_WINDOW_PER_THREAD = 4
+
+# Number of bytes after the header of a ziplist entry that holds an integer, for each entry header, None for strings
+_ZIPLIST_INTEGER_WIDTH = [None] * 0xC0 + [2] * 16 + [4] * 16 + [8] * 16 + [3] + [0] * 13 + [1, None]
+
+def read_ziplist_integer(buff, pos, entry_header) :
+    """The integer held by the ziplist entry with header `entry_header`, whose value starts at offset `pos` of `buff`"""
+    if entry_header >= 241 and entry_header <= 253 :
+        return entry_header - 241
+    elif (entry_header >> 4) == 12 :
+        return _SIGNED_SHORT.unpack_from(buff, pos)[0]
+    elif (entry_header >> 4) == 13 :
+        return _SIGNED_INT.unpack_from(buff, pos)[0]
+    elif (entry_header >> 4) == 14 :
+        return _SIGNED_LONG.unpack_from(buff, pos)[0]
+    elif entry_header == 240 :
+        num = buff[pos] | (buff[pos + 1] << 8) | (buff[pos + 2] << 16)
+        return num - 0x1000000 if num & 0x800000 else num
+    return _SIGNED_CHAR.unpack_from(buff, pos)[0]
+
+def ziplist_string_entry_size(length) :
+    """`ziplist_entry_size` of a string of `length` bytes"""
+    header = 1 if length <= 63 else 2 if length <= 16383 else 5
+    prev_len = 1 if length < 254 else 5
+    return prev_len + header + length
+
+def ziplist_entry_size(value) :
+    """
+    Size of the entry that holds `value`, an integer or a string, in a ziplist, counting the length of the previous
+    entry in the next one. Integers are sized by their magnitude, as in a linked list node.
+    See https://github.com/antirez/redis/blob/unstable/src/ziplist.c
+    """
+    if not isinstance(value, integer_types) :
+        return ziplist_string_entry_size(len(value))
+    if value < 12 :
+        size = 0
+    elif value < 2**8 :
+        size = 1
+    elif value < 2**16 :
+        size = 2
+    elif value < 2**24 :
+        size = 3
+    elif value < 2**32 :
+        size = 4
+    else :
+        size = 8
+    return 2 + size
+
 def read_signed_char(f) :
-    return struct.unpack('b', f.read(1))[0]
+    return _SIGNED_CHAR.unpack(f.read(1))[0]
     
 def read_unsigned_char(f) :
-    return struct.unpack('B', f.read(1))[0]
+    return _UNSIGNED_CHAR.unpack(f.read(1))[0]
 
 def read_signed_short(f) :
-    return struct.unpack('h', f.read(2))[0]
+    return _SIGNED_SHORT.unpack(f.read(2))[0]
         
 def read_unsigned_short(f) :
-    return struct.unpack('H', f.read(2))[0]
+    return _UNSIGNED_SHORT.unpack(f.read(2))[0]
 
 def read_signed_int(f) :
-    return struct.unpack('i', f.read(4))[0]
+    return _SIGNED_INT.unpack(f.read(4))[0]
     
 def read_unsigned_int(f) :
-    return struct.unpack('I', f.read(4))[0]
+    return _UNSIGNED_INT.unpack(f.read(4))[0]
 
 def read_unsigned_int_be(f):
-    return struct.unpack('>I', f.read(4))[0]
+    return _UNSIGNED_INT_BE.unpack(f.read(4))[0]
 
 def read_24bit_signed_number(f):
     s = b'0' + f.read(3)
@@ -1095,22 +2337,22 @@ def read_24bit_signed_number(f):
     return num >> 8
     
 def read_signed_long(f) :
-    return struct.unpack('q', f.read(8))[0]
+    return _SIGNED_LONG.unpack(f.read(8))[0]
     
 def read_unsigned_long(f) :
-    return struct.unpack('Q', f.read(8))[0]
+    return _UNSIGNED_LONG.unpack(f.read(8))[0]
     
 def read_milliseconds_time(f) :
     return to_datetime(read_unsigned_long(f) * 1000)
 
 def read_unsigned_long_be(f) :
-    return struct.unpack('>Q', f.read(8))[0]
+    return _UNSIGNED_LONG_BE.unpack(f.read(8))[0]
 
 def read_binary_double(f) :
-    return struct.unpack('d', f.read(8))[0]
+    return _BINARY_DOUBLE.unpack(f.read(8))[0]
 
 def read_binary_float(f) :
-    return struct.unpack('f', f.read(4))[0]
+    return _BINARY_FLOAT.unpack(f.read(4))[0]
 
 def string_as_hexcode(string) :
     for s in string :
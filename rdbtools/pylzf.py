@@ -0,0 +1,110 @@
+from .compat import indexable_bytes
+
+# Pure python LZF decompression, used when the python-lzf package is not installed.
+#
+# An LZF stream is a sequence of chunks, each starting with a control byte :
+#     000LLLLL <L+1 literal bytes>
+#     LLLooooo oooooooo              back reference of L+2 bytes (L < 7) at distance o+1
+#     111ooooo LLLLLLLL oooooooo     back reference of L+7+2 bytes at distance o+1
+# Literal runs and back references are copied with slices, rather than byte by byte.
+
+
+def decompress(compressed, expected_length):
+    """
+    Decompress the LZF data in `compressed`, which should expand to `expected_length` bytes.
+    Raises ValueError if the data is corrupt or does not expand to exactly `expected_length` bytes.
+    """
+    src = indexable_bytes(compressed)
+    in_len = len(src)
+    ip = 0
+    op = 0
+    out = bytearray()
+    try:
+        while ip < in_len:
+            ctrl = src[ip]
+            ip += 1
+            if ctrl < 32:
+                # literal run
+                end = ip + ctrl + 1
+                out += src[ip:end]
+                op += end - ip
+                ip = end
+            else:
+                length = ctrl >> 5
+                if length == 7:
+                    length += src[ip]
+                    ip += 1
+                length += 2
+                ref = op - ((ctrl & 0x1f) << 8) - src[ip] - 1
+                ip += 1
+                if ref < 0:
+                    raise ValueError('back reference before the start of the output')
+                if ref + length <= op:
+                    out += out[ref:ref + length]
+                else:
+                    # the reference overlaps the bytes it produces, so the last op - ref bytes repeat
+                    pattern = out[ref:op]
+                    out += (pattern * (length // len(pattern) + 1))[:length]
+                op += length
+    except IndexError:
+        raise ValueError('back reference past the end of the input')
+    # a truncated literal run copies fewer bytes than it announces
+    if len(out) != op or op != expected_length:
+        raise ValueError('expected %d bytes, but got %d' % (expected_length, len(out)))
+    return bytes(out)
+
+
+# Back references reach at most this many bytes back in the output
+WINDOW_SIZE = 8192
+
+
+def decompress_chunks(compressed, expected_length, chunk_size):
+    """
+    Like `decompress`, but yield the output in chunks of at least `chunk_size` bytes, the last one excepted,
+    rather than as one string. Only the last WINDOW_SIZE bytes of output are kept between chunks.
+    """
+    src = indexable_bytes(compressed)
+    in_len = len(src)
+    ip = 0
+    op = 0
+    base = 0  # offset in the output of out[0]
+    out = bytearray()
+    try:
+        while ip < in_len:
+            ctrl = src[ip]
+            ip += 1
+            if ctrl < 32:
+                end = ip + ctrl + 1
+                out += src[ip:end]
+                op += end - ip
+                ip = end
+            else:
+                length = ctrl >> 5
+                if length == 7:
+                    length += src[ip]
+                    ip += 1
+                length += 2
+                ref = op - ((ctrl & 0x1f) << 8) - src[ip] - 1 - base
+                ip += 1
+                if ref < 0:
+                    raise ValueError('back reference before the start of the output')
+                end = op - base
+                if ref + length <= end:
+                    out += out[ref:ref + length]
+                else:
+                    pattern = out[ref:end]
+                    out += (pattern * (length // len(pattern) + 1))[:length]
+                op += length
+            if len(out) >= chunk_size + WINDOW_SIZE:
+                if base + len(out) != op:
+                    break
+                done = len(out) - WINDOW_SIZE
+                yield bytes(out[:done])
+                del out[:done]
+                base += done
+    except IndexError:
+        raise ValueError('back reference past the end of the input')
+    if base + len(out) != op or op != expected_length:
+        raise ValueError('expected %d bytes, but got %d' % (expected_length, base + len(out)))
+    if out:
+        yield bytes(out)
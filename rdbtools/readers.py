@@ -0,0 +1,231 @@
+import io
+import mmap
+import threading
+import time
+from collections import namedtuple
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+READER_ENGINES = ('file', 'mmap', 'readahead')
+
+# Pipes and stdin are read in chunks of this size
+STREAM_BUFFER_SIZE = 8 * 1024 * 1024
+
+# The read-ahead thread fills a ring of this many buffers of STREAM_BUFFER_SIZE bytes
+READAHEAD_BUFFERS = 4
+
+ReadAheadStats = namedtuple('ReadAheadStats', ['bytes_read', 'read_seconds', 'wait_seconds', 'decode_seconds'])
+
+
+class MmapReader(object):
+    """
+    A read-only, file-like cursor over a memory mapped dump file.
+
+    `read`, `seek` and `tell` are bound directly to the underlying mmap object,
+    so every primitive read is a C level slice of the mapping instead of a call
+    into the buffered file object. `read_view` hands out memoryview slices of the
+    mapping, which lets the parser decode ziplists and intsets without copying them.
+
+    Typical usage :
+        with MmapReader(open('/var/redis/6379/dump.rdb', 'rb')) as f:
+            parser.parse_fd(f)
+    """
+    def __init__(self, fileobj):
+        self._file = fileobj
+        self._map = mmap.mmap(fileobj.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._map)
+        self._size = len(self._map)
+        self.read = self._map.read
+        self.seek = self._map.seek
+        self.tell = self._map.tell
+
+    def read_view(self, n):
+        """Return the next `n` bytes as a memoryview into the mapping, and advance past them"""
+        pos = self._map.tell()
+        end = min(pos + n, self._size)
+        self._map.seek(end)
+        return self._view[pos:end]
+
+    def skip(self, n):
+        self._map.seek(min(self._map.tell() + n, self._size))
+
+    def seekable(self):
+        return True
+
+    def close(self):
+        self._view.release()
+        try:
+            self._map.close()
+        except BufferError:
+            pass  # a caller still holds a view into the mapping, it is unmapped once that view is released
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class _RawStream(io.RawIOBase):
+    """Adapts any object with a `read` method to the raw stream interface of `io.BufferedReader`"""
+    def __init__(self, stream):
+        self._stream = stream
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        data = self._stream.read(len(b))
+        n = len(data)
+        b[:n] = data
+        return n
+
+
+class _ReadAheadStream(io.RawIOBase):
+    """
+    Raw stream over a ring of `buffers` bytearrays, which a background thread fills from `fileobj`
+    while the parser decodes the previous ones. The thread blocks once every buffer is full,
+    so at most `buffers * buffer_size` bytes are read ahead.
+    """
+    def __init__(self, fileobj, buffer_size, buffers):
+        self._file = fileobj
+        self._free = queue.Queue()
+        self._full = queue.Queue()
+        for _ in range(buffers):
+            self._free.put(bytearray(buffer_size))
+        self._buffer = None
+        self._view = None
+        self._start = 0
+        self._end = 0
+        self._position = 0
+        self._eof = False
+        self._closing = False
+        self.read_seconds = 0.0
+        self.wait_seconds = 0.0
+        self._opened = time.time()
+        self._closed_at = None
+        self._thread = threading.Thread(target=self._fill, name='rdb-readahead')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _fill(self):
+        try:
+            while True:
+                buf = self._free.get()
+                if buf is None or self._closing:
+                    return
+                started = time.time()
+                n = self._file.readinto(buf)
+                self.read_seconds += time.time() - started
+                self._full.put((buf, n or 0))
+                if not n:
+                    return
+        except Exception as e:
+            self._full.put((e, 0))
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        if self._start == self._end:
+            if self._eof:
+                return 0
+            if self._buffer is not None:
+                self._view = None
+                self._free.put(self._buffer)
+                self._buffer = None
+            started = time.time()
+            buf, n = self._full.get()
+            self.wait_seconds += time.time() - started
+            if isinstance(buf, Exception):
+                self._eof = True
+                raise buf
+            if not n:
+                self._eof = True
+                return 0
+            self._buffer = buf
+            self._view = memoryview(buf)
+            self._start = 0
+            self._end = n
+        n = min(len(b), self._end - self._start)
+        b[:n] = self._view[self._start:self._start + n]
+        self._start += n
+        self._position += n
+        return n
+
+    def tell(self):
+        return self._position
+
+    def stats(self):
+        elapsed = (self._closed_at or time.time()) - self._opened
+        return ReadAheadStats(self._position, self.read_seconds, self.wait_seconds,
+                              max(0.0, elapsed - self.wait_seconds))
+
+    def close(self):
+        if not self.closed:
+            self._closed_at = time.time()
+            self._view = None
+            self._closing = True
+            # wakes the thread up if it waits for a free buffer, otherwise it stops after its current read
+            self._free.put(None)
+            self._thread.join()
+            self._file.close()
+        super(_ReadAheadStream, self).close()
+
+
+class ReadAheadReader(io.BufferedReader):
+    """
+    A buffered reader whose underlying file is read ahead on a background thread, so that reading
+    the dump from a slow disk or network share overlaps with decoding it. Small reads are served
+    from the buffer of io.BufferedReader as with a regular file. The reader is not seekable.
+
+    `read_stats` tells how the time went, see `ReadAheadStats` :
+        bytes_read      bytes handed to the parser
+        read_seconds    time the background thread spent reading the file
+        wait_seconds    time the parser spent waiting for the background thread, that is waiting for I/O
+        decode_seconds  the rest of the time the reader was open, spent decoding
+
+    Typical usage :
+        with ReadAheadReader(open('/var/redis/6379/dump.rdb', 'rb', 0)) as f:
+            parser.parse_fd(f)
+    """
+    def __init__(self, fileobj, buffer_size=STREAM_BUFFER_SIZE, buffers=READAHEAD_BUFFERS):
+        super(ReadAheadReader, self).__init__(_ReadAheadStream(fileobj, buffer_size, buffers))
+
+    def read_stats(self):
+        return self.raw.stats()
+
+
+def open_stream(stream, buffer_size=STREAM_BUFFER_SIZE):
+    """
+    Wrap a non seekable `stream` (stdin, a pipe or a socket file) in a reader with a large buffer.
+
+    Every field the parser reads is then a slice of that buffer, and the underlying stream
+    is only read again once the buffer runs out, `buffer_size` bytes at a time.
+    The stream itself is not closed when the returned reader is closed.
+    """
+    try:
+        fileno = stream.fileno()
+    except (AttributeError, io.UnsupportedOperation):
+        return io.BufferedReader(_RawStream(stream), buffer_size)
+    return io.open(fileno, 'rb', buffering=buffer_size, closefd=False)
+
+
+def open_reader(filename, engine='file'):
+    """
+    Open `filename` for parsing with the given reader `engine`
+        file : a regular buffered file object
+        mmap : a MmapReader over the memory mapped file
+        readahead : a ReadAheadReader over the file
+    """
+    if engine == 'file':
+        return open(filename, 'rb')
+    elif engine == 'mmap':
+        return MmapReader(open(filename, 'rb'))
+    elif engine == 'readahead':
+        return ReadAheadReader(open(filename, 'rb', 0))
+    raise Exception('open_reader', 'Invalid reader engine %s' % engine)
@@ -0,0 +1,117 @@
+import math
+import random
+
+# Histogram buckets are exact below this value, and split each doubling in HISTOGRAM_BUCKETS_PER_DOUBLING above it
+HISTOGRAM_EXACT_BELOW = 8
+HISTOGRAM_BUCKETS_PER_DOUBLING = 4
+
+
+def log_bucket(value):
+    """
+    Return the smallest integer of the histogram bucket of `value`. Buckets are exact below HISTOGRAM_EXACT_BELOW,
+    and grow geometrically above it, so a histogram of any number of values has a few hundred buckets at most.
+    """
+    if value < HISTOGRAM_EXACT_BELOW:
+        return int(value)
+    exponent = math.floor(math.log(value, 2) * HISTOGRAM_BUCKETS_PER_DOUBLING)
+    return int(math.ceil(2 ** (exponent / float(HISTOGRAM_BUCKETS_PER_DOUBLING))))
+
+
+class Reservoir(object):
+    """
+    A uniform random sample of at most `capacity` of the items added to it (Vitter's algorithm R).
+    `items` holds every item, in order, until more than `capacity` items have been added.
+    """
+    def __init__(self, capacity, seed=0):
+        self.capacity = capacity
+        self.count = 0
+        self.items = []
+        self._random = random.Random(seed)
+
+    def add(self, item):
+        self.count += 1
+        if len(self.items) < self.capacity:
+            self.items.append(item)
+        else:
+            slot = self._random.randrange(self.count)
+            if slot < self.capacity:
+                self.items[slot] = item
+
+    def merge(self, other):
+        """Make this a sample of the items added to this reservoir and to `other`, as if they were added here"""
+        if self.count + other.count <= self.capacity:
+            self.items.extend(other.items)
+        else:
+            # take the next item from either sample in proportion to the items each one stands for
+            mine = self._random.sample(self.items, len(self.items))
+            theirs = self._random.sample(other.items, len(other.items))
+            my_count = self.count
+            their_count = other.count
+            items = []
+            while len(items) < self.capacity:
+                if self._random.random() * (my_count + their_count) < my_count:
+                    items.append(mine.pop())
+                    my_count -= 1
+                else:
+                    items.append(theirs.pop())
+                    their_count -= 1
+            self.items = items
+        self.count += other.count
+
+
+class QuantileSketch(object):
+    """
+    A mergeable summary of a distribution of non negative values, after DDSketch
+    (Masson, Rim and Lee, VLDB 2019). Values fall in buckets whose bounds grow geometrically,
+    so that `quantile` is within `relative_accuracy` of the value at that quantile, and the number of
+    buckets only grows with the logarithm of the range of the values.
+    """
+    def __init__(self, relative_accuracy=0.01):
+        self.relative_accuracy = relative_accuracy
+        self._gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self._gamma)
+        self.buckets = {}
+        self.zeros = 0
+        self.count = 0
+        self.min = None
+        self.max = None
+
+    def add(self, value, weight=1):
+        if value <= 0:
+            self.zeros += weight
+        else:
+            index = int(math.ceil(math.log(value) / self._log_gamma))
+            self.buckets[index] = self.buckets.get(index, 0) + weight
+        self.count += weight
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def quantile(self, q):
+        """Return the value at quantile `q`, between 0 and 1, or None if the sketch is empty"""
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        seen = self.zeros
+        if seen > rank:
+            return 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen > rank:
+                value = 2 * self._gamma ** index / (self._gamma + 1)
+                return min(max(value, self.min), self.max)
+        return self.max
+
+    def merge(self, other):
+        if other.relative_accuracy != self.relative_accuracy:
+            raise Exception('QuantileSketch.merge', 'cannot merge sketches of accuracy %s and %s' % (
+                self.relative_accuracy, other.relative_accuracy))
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        self.zeros += other.zeros
+        self.count += other.count
+        if other.min is not None and (self.min is None or other.min < self.min):
+            self.min = other.min
+        if other.max is not None and (self.max is None or other.max > self.max):
+            self.max = other.max
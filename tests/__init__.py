@@ -3,6 +3,12 @@ from tests.parser_tests import RedisParserTestCase
 from tests.memprofiler_tests import MemoryCallbackTestCase
 from tests.callbacks_tests import ProtocolTestCase, JsonTestCase, DiffTestCase, KeysTestCase, KeyValsTestCase
 from tests.protocol_tests import ProtocolExpireTestCase
+from tests.keyindex_tests import KeyIndexTestCase
+from tests.parallel_tests import ParallelMemoryTestCase
+from tests.pylzf_tests import PyLzfTestCase
+from tests.filters_tests import FiltersTestCase
+from tests.sketches_tests import SketchesTestCase
+from tests.allocators_tests import AllocatorsTestCase
 
 
 def all_tests():
@@ -14,7 +20,13 @@ def all_tests():
                       DiffTestCase,
                       KeysTestCase,
                       KeyValsTestCase,
-                      ProtocolExpireTestCase]
+                      ProtocolExpireTestCase,
+                      KeyIndexTestCase,
+                      ParallelMemoryTestCase,
+                      PyLzfTestCase,
+                      FiltersTestCase,
+                      SketchesTestCase,
+                      AllocatorsTestCase]
     for case in test_case_list:
         suite.addTest(unittest.makeSuite(case))
     return suite
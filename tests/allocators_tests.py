@@ -0,0 +1,37 @@
+import unittest
+
+from rdbtools.allocators import ALLOCATORS, LOOKUP_TABLE_SIZE, get_allocator, jemalloc_size_classes
+from rdbtools.compat import range
+
+
+class AllocatorsTestCase(unittest.TestCase):
+    def test_jemalloc_size_classes(self):
+        classes = jemalloc_size_classes(3)
+        self.assertEquals(classes[:12], [8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128])
+        self.assertEquals(len(classes), 239)
+        self.assertEquals(classes[-1], 16140901064495857664)
+        self.assertEquals(jemalloc_size_classes(4)[:10], [8, 16, 32, 48, 64, 80, 96, 112, 128, 160])
+
+    def test_table_matches_round_up(self):
+        for name in ALLOCATORS:
+            for architecture in (32, 64):
+                allocator = get_allocator(name, architecture)
+                for size in range(0, LOOKUP_TABLE_SIZE + 100, 7):
+                    self.assertEquals(allocator.allocation(size), allocator.round_up(size), msg=(name, architecture, size))
+                    self.assert_(allocator.allocation(size) >= size)
+
+    def test_jemalloc(self):
+        jemalloc4 = get_allocator('jemalloc4')
+        self.assertEquals([jemalloc4.allocation(s) for s in (1, 8, 9, 17, 100, 4097, 20000)], [8, 8, 16, 24, 112, 5120, 20480])
+        jemalloc5 = get_allocator('jemalloc5')
+        self.assertEquals([jemalloc5.allocation(s) for s in (1, 9, 17, 100)], [8, 16, 32, 112])
+        self.assertEquals(jemalloc4.allocation(2**64), 2**64)
+
+    def test_libc(self):
+        self.assertEquals([get_allocator('libc', 64).allocation(s) for s in (0, 24, 25, 100, 200000)], [32, 32, 48, 112, 200704])
+        self.assertEquals([get_allocator('libc', 32).allocation(s) for s in (0, 12, 13, 100)], [16, 16, 24, 104])
+
+    def test_instances_are_shared(self):
+        self.assert_(get_allocator('jemalloc5', 64) is get_allocator('jemalloc5', '64'))
+        self.assert_(get_allocator('jemalloc5', 64) is not get_allocator('jemalloc5', 32))
+        self.assertRaises(Exception, get_allocator, 'tcmalloc')
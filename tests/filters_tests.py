@@ -0,0 +1,211 @@
+import os
+import re
+import pickle
+import datetime
+import shutil
+import tempfile
+import unittest
+
+from rdbtools import RdbParser, MemoryCallback
+from rdbtools.filters import compile_key_filter, compile_header_filter, compile_stop_condition, glob_to_regexp, prefix_matcher, to_milliseconds, MAX_STARTSWITH_PREFIXES, KeyGroupMatcher
+from rdbtools.parser import DATA_TYPE_MAPPING, REDIS_RDB_TYPE_STRING, REDIS_RDB_TYPE_HASH
+from tests.parser_tests import MockRedis, load_rdb, load_rdb_pipe
+from tests.memprofiler_tests import Stats
+
+
+def element_count(value):
+    return len(value) if isinstance(value, (list, dict)) else 1
+
+
+def key_filter(**filters):
+    return compile_key_filter(filters, DATA_TYPE_MAPPING)
+
+
+class FiltersTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_no_filter(self):
+        self.assertEquals(key_filter(), None)
+        self.assertEquals(key_filter(keys=None, key_prefixes=[]), None)
+
+    def test_prefixes(self):
+        matches = key_filter(key_prefixes=[b'user:', 'session:'])
+        self.assert_(matches(b'user:1', REDIS_RDB_TYPE_STRING))
+        self.assert_(matches(b'session:', REDIS_RDB_TYPE_STRING))
+        self.assertFalse(matches(b'use', REDIS_RDB_TYPE_STRING))
+        self.assertFalse(matches(123, REDIS_RDB_TYPE_STRING))
+        self.assert_(key_filter(key_prefixes=[b'12'])(123, REDIS_RDB_TYPE_STRING))
+
+    def test_many_prefixes(self):
+        prefixes = [('p%d:' % i).encode('ascii') for i in range(MAX_STARTSWITH_PREFIXES * 2)] + [b'q']
+        matches = prefix_matcher(prefixes)
+        for prefix in prefixes:
+            self.assert_(matches(prefix + b'rest'))
+        self.assertFalse(matches(b'p'))
+        self.assertFalse(matches(b'x:p1:'))
+
+    def test_globs(self):
+        matches = key_filter(key_globs=[b'user:[0-9]*:profile', b'h?llo', b'lit\\*eral', b'exact', b'pre*'])
+        for key in (b'user:1:profile', b'user:12:profile', b'hello', b'hallo', b'lit*eral', b'exact', b'pre', b'prefix'):
+            self.assert_(matches(key, REDIS_RDB_TYPE_STRING), msg=key)
+        for key in (b'user:a:profile', b'user:1:profiles', b'hllo', b'literal', b'exactly', b'pr'):
+            self.assertFalse(matches(key, REDIS_RDB_TYPE_STRING), msg=key)
+
+    def test_glob_to_regexp(self):
+        self.assertEquals(glob_to_regexp(b'a*b?'), b'a.*b.\\Z')
+        self.assertEquals(glob_to_regexp(b'[^a-c]x'), b'[^a-c]x\\Z')
+        self.assertEquals(glob_to_regexp(b'[c-a]'), b'[a-c]\\Z')
+
+    def test_key_set(self):
+        keys_file = os.path.join(self.tmpdir, 'keys.txt')
+        with open(keys_file, 'wb') as f:
+            f.write(b'k1\nk 2\r\n\n')
+        matches = key_filter(keys_file=keys_file)
+        self.assert_(matches(b'k1', REDIS_RDB_TYPE_STRING))
+        self.assert_(matches(b'k 2', REDIS_RDB_TYPE_STRING))
+        self.assertFalse(matches(b'', REDIS_RDB_TYPE_STRING))
+        self.assertFalse(matches(b'k', REDIS_RDB_TYPE_STRING))
+
+        matches = key_filter(keys_file=keys_file, key_set=[b'k1', b'k3'])
+        self.assert_(matches(b'k1', REDIS_RDB_TYPE_STRING))
+        self.assertFalse(matches(b'k3', REDIS_RDB_TYPE_STRING))
+
+    def test_all_conditions_must_match(self):
+        matches = key_filter(key_prefixes=[b'h'], not_keys='h2', types=['hash'])
+        self.assert_(matches(b'h1', REDIS_RDB_TYPE_HASH))
+        self.assertFalse(matches(b'h2', REDIS_RDB_TYPE_HASH))
+        self.assertFalse(matches(b'h1', REDIS_RDB_TYPE_STRING))
+
+    def test_parse_with_filters(self):
+        expected = load_rdb('parser_filters.rdb', filters={'keys': 'k[0-9]|set[12]$'})
+        for filters in ({'key_prefixes': [b'k', b'set1', b'set2']}, {'key_globs': [b'k[0-9]', b'set[12]']},
+                        {'key_set': [b'k1', b'k3', b'set1', b'set2', b'no_such_key']}):
+            r = load_rdb('parser_filters.rdb', filters=filters)
+            self.assertEquals(r.databases, expected.databases, msg=filters)
+
+    def test_sample(self):
+        matches = key_filter(sample=0.5)
+        keys = [('key:%d' % i).encode('ascii') for i in range(1000)]
+        sampled = [key for key in keys if matches(key, REDIS_RDB_TYPE_STRING)]
+        self.assert_(400 < len(sampled) < 600, len(sampled))
+        self.assertEquals(sampled, [key for key in keys if key_filter(sample=0.5)(key, REDIS_RDB_TYPE_STRING)])
+        # a smaller sample is a subset of a larger one
+        self.assert_(set(k for k in keys if key_filter(sample=0.1)(k, REDIS_RDB_TYPE_STRING)) <= set(sampled))
+        self.assertEquals(len([k for k in keys if key_filter(sample=1)(k, REDIS_RDB_TYPE_STRING)]), 1000)
+        self.assertRaises(Exception, key_filter, sample=0)
+        self.assertRaises(Exception, key_filter, sample=1.5)
+
+    def test_stop_when_found(self):
+        keys_file = os.path.join(self.tmpdir, 'keys.txt')
+        with open(keys_file, 'wb') as f:
+            f.write(b'k1\nset1\n')
+        expected = load_rdb('parser_filters.rdb', filters={'keys_file': keys_file})
+        r = load_rdb('parser_filters.rdb', filters={'keys_file': keys_file, 'stop_when_found': True})
+        self.assertEquals(r.databases, expected.databases)
+        self.assertEquals(r.methods_called, ['start_rdb', 'end_rdb'])
+        self.assertRaises(Exception, RdbParser, MockRedis(), filters={'stop_when_found': True})
+
+    def test_stop_condition_is_met_once(self):
+        r = load_rdb('multiple_databases.rdb', filters={'key_set': [b'key_in_zeroth_database'], 'stop_when_found': True})
+        self.assertEquals(r.databases, {0: {b'key_in_zeroth_database': b'zero'}})
+        stop = compile_stop_condition({'key_set': [b'a', b'b'], 'stop_when_found': True}, frozenset([b'a', b'b']))
+        self.assertFalse(stop(b'a'))
+        self.assertFalse(stop(b'a'))
+        self.assert_(stop(b'b'))
+
+    def test_max_keys(self):
+        r = load_rdb('parser_filters.rdb', filters={'max_keys': 3, 'key_prefixes': [b'l']})
+        self.assertEquals(len(r.databases[0]), 3)
+        self.assert_(all(key.startswith(b'l') for key in r.databases[0]))
+
+    def test_header_filter(self):
+        expiry = datetime.datetime(2022, 12, 25, 10, 11, 12)
+        self.assertEquals(compile_header_filter({}), None)
+        matches = compile_header_filter({'expires_before': datetime.datetime(2023, 1, 1)})
+        self.assert_(matches(expiry, None, None))
+        self.assertFalse(matches(None, None, None))
+        matches = compile_header_filter({'has_ttl': False, 'min_idle': 10})
+        self.assert_(matches(None, 10, None))
+        self.assertFalse(matches(None, 9, None))
+        self.assertFalse(matches(None, None, None))
+        self.assertFalse(matches(expiry, 10, None))
+        matches = compile_header_filter({'max_freq': 5})
+        self.assert_(matches(None, None, 5))
+        self.assertFalse(matches(None, None, 6))
+
+    def test_parse_with_expiry_filters(self):
+        r = load_rdb('keys_with_expiry.rdb', filters={'has_ttl': True, 'expires_before': datetime.datetime(2023, 1, 1)})
+        self.assertEquals(list(r.databases[0].keys()), [b'expires_ms_precision'])
+        r = load_rdb('keys_with_expiry.rdb', filters={'expires_after': datetime.datetime(2023, 1, 1)})
+        self.assertEquals(r.databases[0], {})
+        r = load_rdb('parser_filters.rdb', filters={'has_ttl': False})
+        self.assertEquals(r.databases, load_rdb('parser_filters.rdb').databases)
+
+    def test_raw_expiry_filters(self):
+        expiry = to_milliseconds(datetime.datetime(2022, 12, 25, 10, 11, 12, 573000))
+        self.assertEquals(expiry, 1671963072573)
+        matches = compile_header_filter({'expires_before': datetime.datetime(2023, 1, 1)}, raw_expiry=True)
+        self.assert_(matches(expiry, None, None))
+        matches = compile_header_filter({'expires_after': datetime.datetime(2023, 1, 1)}, raw_expiry=True)
+        self.assertFalse(matches(expiry, None, None))
+
+        # MemoryCallback takes expiries in milliseconds
+        stats = Stats()
+        RdbParser(MemoryCallback(stats, 64), {'expires_before': datetime.datetime(2023, 1, 1)}).parse(
+            os.path.join(os.path.dirname(__file__), 'dumps', 'keys_with_expiry.rdb'))
+        self.assertEquals(list(stats.records.keys()), ['expires_ms_precision'])
+        self.assertEquals(stats.records['expires_ms_precision'].expiry, datetime.datetime(2022, 12, 25, 10, 11, 12, 573000))
+
+    def test_key_groups(self):
+        keys = ['user:1', 'user:admin:2', 'session:x', 'sess', 'other', 'u', '']
+        for patterns in (['user:.*', 'user:admin', 'sess'],
+                         ['user:admin:[0-9]+', 'user:', 's.*n', '(o)(t)'],
+                         ['user:(a)\\1', 'us', '(?i)SESS'],
+                         ['u\\w*:', 'sess', 'x|u']):
+            matcher = KeyGroupMatcher(patterns)
+            for key in keys:
+                expected = next((p for p in patterns if re.match(p, key)), None)
+                self.assertEquals(matcher.group(key), expected, msg=(patterns, key))
+            unpickled = pickle.loads(pickle.dumps(matcher))
+            self.assertEquals([unpickled.group(key) for key in keys], [matcher.group(key) for key in keys])
+
+    def test_key_groups_are_compiled_once(self):
+        self.assert_(KeyGroupMatcher(['user:', 'session:.*'])._by_length is not None)
+        self.assert_(KeyGroupMatcher(['user:[0-9]+', 'session:.*'])._match is not None)
+        self.assert_(KeyGroupMatcher(['(a)\\1', 'b'])._expressions is not None)
+
+    def test_parse_with_value_filters(self):
+        for dump_name in ('parser_filters.rdb', 'ziplist_that_compresses_easily.rdb', 'zipmap_with_big_values.rdb',
+                          'intset_64.rdb', 'dictionary.rdb', 'multiple_databases.rdb'):
+            everything = load_rdb(dump_name).databases[0]
+            for min_elements in (0, 2, 3, 5, 100):
+                for engine in ('file', 'mmap'):
+                    r = load_rdb(dump_name, filters={'min_elements': min_elements}, engine=engine)
+                    expected = dict((key, value) for key, value in everything.items() if element_count(value) >= min_elements)
+                    self.assertEquals(r.databases[0], expected, msg=(dump_name, min_elements))
+
+        # h1 and set1 to set3 are hashtables, whose size is not known before they are decoded
+        r = load_rdb('parser_filters.rdb', filters={'min_serialized_size': 500})
+        self.assertEquals(sorted(r.databases[0].keys()), [b'h1', b'l3', b's1', b'set1', b'set2', b'set3'])
+
+    def test_size_filters_do_not_decompress(self):
+        class NoLzfParser(RdbParser):
+            def lzf_decompress(self, compressed, expected_length):
+                raise AssertionError('decompressed %d bytes' % expected_length)
+        for dump_name in ('ziplist_that_compresses_easily.rdb', 'zipmap_that_compresses_easily.rdb'):
+            callback = MockRedis()
+            NoLzfParser(callback, filters={'min_serialized_size': 1 << 30}).parse(os.path.join(os.path.dirname(__file__), 'dumps', dump_name))
+            self.assertEquals(callback.databases[0], {}, msg=dump_name)
+
+    def test_value_filters_need_a_seekable_file(self):
+        self.assertRaises(Exception, load_rdb_pipe, 'parser_filters.rdb', filters={'min_elements': 2})
+
+    def test_parse_with_db_and_key_filters(self):
+        r = load_rdb('multiple_databases.rdb', filters={'dbs': [2], 'key_prefixes': [b'key_in']})
+        self.assertEquals(r.databases, {0: {}, 2: {b'key_in_second_database': b'second'}})
+        r = load_rdb('multiple_databases.rdb', filters={'dbs': 0, 'key_set': [b'key_in_second_database']})
+        self.assertEquals(r.databases, {0: {}, 2: {}})
@@ -0,0 +1,142 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from rdbtools import RdbParser
+from rdbtools.keyindex import KeyIndex, build_index, open_index
+from tests.parser_tests import MockRedis, load_rdb
+
+
+def dump_path(file_name):
+    return os.path.join(os.path.dirname(__file__), 'dumps', file_name)
+
+
+class KeyIndexTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def copy_dump(self, file_name):
+        path = os.path.join(self.tmpdir, file_name)
+        shutil.copy(dump_path(file_name), path)
+        return path
+
+    def test_index_has_every_key(self):
+        dump = self.copy_dump('parser_filters.rdb')
+        expected = load_rdb('parser_filters.rdb')
+        with open_index(dump) as index:
+            self.assertEquals(len(index), len(expected.databases[0]))
+            keys = [index.entry(i).key for i in range(len(index))]
+        self.assertEquals(keys, sorted(expected.databases[0].keys()))
+
+    def test_lookup(self):
+        dump = self.copy_dump('parser_filters.rdb')
+        with open_index(dump) as index:
+            entries = index.lookup(b'k1')
+            self.assertEquals(index.lookup(b'no_such_key'), [])
+        self.assertEquals(len(entries), 1)
+        self.assertEquals(entries[0].db, 0)
+        self.assertEquals(entries[0].key, b'k1')
+
+        r = MockRedis()
+        RdbParser(r).parse_offsets(dump, [(e.db, e.offset) for e in entries])
+        self.assertEquals(r.databases, {0: {b'k1': b'ssssssss'}})
+
+    def test_lookup_prefix(self):
+        dump = self.copy_dump('parser_filters.rdb')
+        with open_index(dump) as index:
+            entries = index.lookup_prefix(b'k')
+        self.assertEquals(sorted(e.key for e in entries), [b'k1', b'k3'])
+
+        r = MockRedis()
+        RdbParser(r, engine='mmap').parse_offsets(dump, [(e.db, e.offset) for e in entries])
+        self.assertEquals(r.databases[0][b'k1'], b"ssssssss")
+        self.assertEquals(r.databases[0][b'k3'], b"wwwwwwww")
+        self.assertEquals(len(r.databases[0]), 2)
+
+    def test_lookup_across_databases(self):
+        dump = self.copy_dump('multiple_databases.rdb')
+        with open_index(dump) as index:
+            self.assertEquals([e.db for e in index.lookup(b'key_in_second_database')], [2])
+            self.assertEquals(index.lookup(b'key_in_second_database', dbs=[0]), [])
+            entries = index.lookup_prefix(b'key_in')
+
+        r = MockRedis()
+        RdbParser(r).parse_offsets(dump, [(e.db, e.offset) for e in entries])
+        self.assertEquals(r.databases[0][b"key_in_zeroth_database"], b"zero")
+        self.assertEquals(r.databases[2][b"key_in_second_database"], b"second")
+
+    def test_offsets_keep_expiry_and_values(self):
+        dump = self.copy_dump('keys_with_expiry.rdb')
+        expected = load_rdb('keys_with_expiry.rdb')
+        with open_index(dump) as index:
+            entries = [index.entry(i) for i in range(len(index))]
+        r = MockRedis()
+        RdbParser(r).parse_offsets(dump, [(e.db, e.offset) for e in entries])
+        self.assertEquals(r.databases, expected.databases)
+        self.assertEquals(r.expiry, expected.expiry)
+        for e in entries:
+            self.assertEquals(e.expiry, expected.expiry[e.db][e.key])
+
+    def test_index_of_every_dump(self):
+        for dump_name in ('ziplist_that_compresses_easily.rdb', 'dictionary.rdb', 'redis_50_with_streams.rdb',
+                          'redis_40_with_module.rdb', 'rdb_version_8_with_64b_length_and_scores.rdb',
+                          'integer_keys.rdb', 'non_ascii_values.rdb'):
+            dump = self.copy_dump(dump_name)
+            expected = load_rdb(dump_name)
+            with open_index(dump) as index:
+                entries = [index.entry(i) for i in range(len(index))]
+            r = MockRedis()
+            RdbParser(r).parse_offsets(dump, [(e.db, e.offset) for e in entries])
+            self.assertEquals(r.databases, expected.databases, msg=dump_name)
+
+    def test_stale_index_is_rebuilt(self):
+        dump = self.copy_dump('parser_filters.rdb')
+        index_file = build_index(dump)
+        shutil.copy(dump_path('multiple_databases.rdb'), dump)
+        self.assertRaises(Exception, KeyIndex, index_file, dump)
+        with open_index(dump) as index:
+            self.assertEquals(len(index.lookup(b'key_in_zeroth_database')), 1)
+
+    def test_dump_rewritten_in_the_same_second_is_reindexed(self):
+        dump = self.copy_dump('rdb_version_5_with_checksum.rdb')
+        with open(dump, 'rb') as f:
+            data = f.read()
+        os.utime(dump, (1500000000.25, 1500000000.25))
+        index_file = build_index(dump)
+        self.assert_(KeyIndex(index_file).matches(dump))
+        # the same size in the same second, and then the same size and time with another checksum
+        for mtime, contents in ((1500000000.75, data), (1500000000.25, data[:-8] + b'\0' * 8)):
+            with open(dump, 'wb') as f:
+                f.write(contents)
+            os.utime(dump, (mtime, mtime))
+            self.assertRaises(Exception, KeyIndex, index_file, dump)
+        with open_index(dump) as index:
+            self.assert_(index.matches(dump))
+            self.assertEquals(len(index.lookup(b'foo')), 1)
+
+    def test_index_sorted_in_runs(self):
+        for file_name in ('parser_filters.rdb', 'multiple_databases.rdb', 'regular_set.rdb'):
+            dump = self.copy_dump(file_name)
+            with open(build_index(dump), 'rb') as f:
+                expected = f.read()
+            for run_size in (1, 2, 3):
+                with open(build_index(dump, run_size=run_size), 'rb') as f:
+                    self.assertEquals(f.read(), expected, msg=(file_name, run_size))
+
+    def test_unreadable_index_is_rebuilt(self):
+        dump = self.copy_dump('parser_filters.rdb')
+        index_file = build_index(dump)
+        with open(index_file, 'rb') as f:
+            data = f.read()
+        # an empty file, and an index cut after its header, which still matches the dump
+        for contents in (b'', data[:len(data) // 2]):
+            with open(index_file, 'wb') as f:
+                f.write(contents)
+            self.assertRaises(Exception, KeyIndex, index_file)
+            with open_index(dump) as index:
+                self.assertEquals(len(index.lookup(b'k1')), 1)
+        self.assertEquals(sorted(os.listdir(self.tmpdir)), ['parser_filters.rdb', 'parser_filters.rdb.idx'])
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+"""
+Benchmark the pure python LZF decompressor against the byte at a time decompressor it replaced,
+and against python-lzf when it is installed, on the LZF compressed strings of the test dumps.
+
+Usage : python -m tests.lzf_benchmark [number_of_runs]
+"""
+from __future__ import print_function
+import sys
+import timeit
+
+from rdbtools import RdbParser, RdbCallback
+from rdbtools import pylzf
+from tests.parser_tests import parseable_dumps
+
+try:
+    import lzf
+except ImportError:
+    lzf = None
+
+class RecordingParser(RdbParser):
+    """Parser that keeps a copy of every LZF compressed string it decompresses"""
+    def __init__(self):
+        super(RecordingParser, self).__init__(RdbCallback(None))
+        self.payloads = []
+
+    def lzf_decompress(self, compressed, expected_length):
+        self.payloads.append((bytes(compressed), expected_length))
+        return super(RecordingParser, self).lzf_decompress(compressed, expected_length)
+
+
+def collect_payloads():
+    parser = RecordingParser()
+    for dump_name in parseable_dumps():
+        parser.parse(dump_name)
+    return parser.payloads
+
+
+def legacy_decompress(compressed, expected_length):
+    """The decompressor used before pylzf, which copies one byte at a time"""
+    in_stream = bytearray(compressed)
+    in_len = len(in_stream)
+    in_index = 0
+    out_stream = bytearray()
+    out_index = 0
+    while in_index < in_len :
+        ctrl = in_stream[in_index]
+        in_index = in_index + 1
+        if ctrl < 32 :
+            for x in range(0, ctrl + 1) :
+                out_stream.append(in_stream[in_index])
+                in_index = in_index + 1
+                out_index = out_index + 1
+        else :
+            length = ctrl >> 5
+            if length == 7 :
+                length = length + in_stream[in_index]
+                in_index = in_index + 1
+            ref = out_index - ((ctrl & 0x1f) << 8) - in_stream[in_index] - 1
+            in_index = in_index + 1
+            for x in range(0, length + 2) :
+                out_stream.append(out_stream[ref])
+                ref = ref + 1
+                out_index = out_index + 1
+    return bytes(out_stream)
+
+
+def run(decompress, payloads):
+    for compressed, expected_length in payloads:
+        decompress(compressed, expected_length)
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    payloads = collect_payloads()
+    total = sum(length for compressed, length in payloads)
+    print('%d LZF strings, %d bytes decompressed per run, %d runs' % (len(payloads), total, runs))
+
+    candidates = [('byte at a time', legacy_decompress), ('pylzf', pylzf.decompress)]
+    if lzf is not None:
+        candidates.append(('python-lzf', lzf.decompress))
+    else:
+        print('python-lzf is not installed, skipping it')
+
+    for name, decompress in candidates:
+        seconds = min(timeit.repeat(lambda: run(decompress, payloads), number=runs, repeat=3)) / runs
+        print('%-16s %10.3f ms per run %10.1f MB/s' % (name, seconds * 1000, total / seconds / 1e6))
+
+
+if __name__ == '__main__':
+    main()
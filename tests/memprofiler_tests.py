@@ -1,14 +1,18 @@
 import sys
 import os
+import shutil
+import tempfile
 from io import BytesIO
 
 import unittest
 
 from rdbtools import RdbParser
-from rdbtools import MemoryCallback
+from rdbtools import MemoryCallback, StatsAggregator
 
 
-from rdbtools.memprofiler import MemoryRecord, PrintAllKeys
+from rdbtools.memprofiler import MemoryRecord, PrintAllKeys, NamespaceTree, min_bytes_filters, SNAPSHOT_CHECK_RECORDS
+from rdbtools.parser import ElementEncoding, ELEMENT_RAW, ELEMENT_INT16
+from tests.parser_tests import parseable_dumps
 
 CSV_WITH_EXPIRY = """database,type,key,size_in_bytes,encoding,num_elements,len_largest_element,expiry
 0,string,expires_ms_precision,128,string,27,27,2022-12-25T10:11:12.573000
@@ -43,6 +47,11 @@ def get_stats(file_name):
     parser.parse(os.path.join(os.path.dirname(__file__), 'dumps', file_name))
     return stats.records
 
+def get_stats_with_filters(file_name, filters):
+    stats = Stats()
+    RdbParser(MemoryCallback(stats, 64), filters).parse(os.path.join(os.path.dirname(__file__), 'dumps', file_name))
+    return stats.records
+
 def get_sums(file_name):
     stats = Stats()
     callback = MemoryCallback(stats, 64)
@@ -50,10 +59,30 @@ def get_sums(file_name):
     parser.parse(os.path.join(os.path.dirname(__file__), 'dumps', file_name))
     return stats.sums
 
-def get_csv(dump_file_name):
+def get_aggregator(file_name, sample_rate=None):
+    stats = StatsAggregator(sample_rate=sample_rate)
+    callback = MemoryCallback(stats, 64, sample_rate=sample_rate)
+    parser = RdbParser(callback, {'sample': sample_rate} if sample_rate is not None else None)
+    parser.parse(os.path.join(os.path.dirname(__file__), 'dumps', file_name))
+    return stats
+
+def largest_keys(csv):
+    """The keys of a CSV written by PrintAllKeys, in order"""
+    lines = (csv.getvalue() if hasattr(csv, 'getvalue') else csv.read()).decode().splitlines()
+    return [line.split(',')[2] for line in lines[1:]]
+
+def namespace_record(key, bytes):
+    return MemoryRecord(database=0, type='string', key=key, bytes=bytes, encoding='string', size=1,
+                        len_largest_element=1, expiry=None)
+
+def get_csv(dump_file_name, min_bytes=None, filters=None, string_chunk_size=None, allocator='jemalloc4',
+            element_summaries=True):
     buff = BytesIO()
-    callback = MemoryCallback(PrintAllKeys(buff, None, None), 64)
-    parser = RdbParser(callback)
+    callback = MemoryCallback(PrintAllKeys(buff, min_bytes, None), 64, allocator=allocator)
+    if string_chunk_size is not None:
+        callback.string_chunk_size = string_chunk_size
+    callback.element_summaries = element_summaries
+    parser = RdbParser(callback, filters)
     parser.parse(os.path.join(os.path.dirname(__file__), 
                     'dumps', dump_file_name))
     csv = buff.getvalue().decode()
@@ -106,6 +135,177 @@ class MemoryCallbackTestCase(unittest.TestCase):
         sums = get_sums('redis_60_with_module_aux.rdb')
         self.assertEquals(sums['module'], 32)
 
+    def test_min_bytes_filters_skip_only_smaller_keys(self):
+        for dump_name in ('parser_filters.rdb', 'ziplist_that_compresses_easily.rdb', 'zipmap_with_big_values.rdb',
+                          'uncompressible_string_keys.rdb', 'dictionary.rdb', 'linkedlist.rdb', 'intset_64.rdb',
+                          'sorted_set_as_ziplist.rdb', 'hash_as_ziplist.rdb', 'integer_keys.rdb', 'regular_sorted_set.rdb'):
+            for min_bytes in (1, 100, 200, 300, 500, 1000, 5000, 20000, 200000):
+                self.assertEquals(get_csv(dump_name, min_bytes, min_bytes_filters(min_bytes)), get_csv(dump_name, min_bytes),
+                                  msg=(dump_name, min_bytes))
+        self.assertEquals(min_bytes_filters(1000, '3.0'), {})
+
+    def test_sample_of_all_keys_is_exact(self):
+        expected = get_aggregator('parser_filters.rdb')
+        stats = get_aggregator('parser_filters.rdb', 1.0)
+        self.assertEquals(stats.aggregates, expected.aggregates)
+        for heading, intervals in stats.confidence_intervals().items():
+            for subheading, (low, high) in intervals.items():
+                self.assertEquals(low, high)
+                self.assertEquals(low, expected.aggregates[heading][subheading])
+
+    def test_sample_is_extrapolated(self):
+        expected = get_aggregator('parser_filters.rdb')
+        stats = get_aggregator('parser_filters.rdb', 0.25)
+        sample = get_stats_with_filters('parser_filters.rdb', {'sample': 0.25})
+        self.assert_(0 < len(sample) < len(get_stats('parser_filters.rdb')))
+        self.assertEquals(sum(stats.aggregates['type_count'][t] for t in stats.aggregates['type_count'] if t != 'dict'),
+                          len(sample) * 4)
+        # the dicts are sized from the extrapolated key count, and are not sampled
+        self.assertEquals(stats.aggregates['type_count']['dict'], 2)
+        self.assertEquals(stats.metadata['sample_rate'], 0.25)
+
+        low, high = stats.confidence_intervals()['database_memory']['all']
+        self.assert_(low < expected.aggregates['database_memory']['all'] < high)
+        self.assert_('confidence_intervals' in stats.get_json())
+        self.assertFalse('confidence_intervals' in expected.get_json())
+
+    def test_large_strings_are_not_read(self):
+        # strings that could hold an integer are not chunked
+        for dump_name in ('parser_filters.rdb', 'uncompressible_string_keys.rdb', 'non_ascii_values.rdb'):
+            self.assertEquals(get_csv(dump_name, string_chunk_size=20), get_csv(dump_name), msg=dump_name)
+
+    def test_element_summaries_are_exact(self):
+        for dump_name in parseable_dumps():
+            dump_name = os.path.basename(dump_name)
+            self.assertEquals(get_csv(dump_name), get_csv(dump_name, element_summaries=False), msg=dump_name)
+
+    def test_sizeof_element(self):
+        callback = MemoryCallback(None, 64)
+        self.assertEquals(callback.sizeof_element(300, ELEMENT_INT16), 0)
+        self.assertEquals(callback.sizeof_element(b'abc', ELEMENT_RAW), callback.sizeof_string(b'abc'))
+        self.assertEquals(callback.sizeof_element(b'a' * 100, ElementEncoding('lzf', None, 10)), callback.sizeof_string(b'a' * 100))
+        # Redis would have saved a short integer as an integer, raw strings of 64 bit integers are still integers
+        self.assertEquals(callback.sizeof_element(b'-12', ELEMENT_RAW), callback.sizeof_sds(3))
+        self.assertEquals(callback.sizeof_element(b'12345678901', ELEMENT_RAW), 0)
+        self.assertEquals(callback.sizeof_element(b'-12', None), 0)
+
+    def test_skiplist_size_is_reproducible(self):
+        csv = get_csv('regular_sorted_set.rdb')
+        self.assertEquals(csv, get_csv('regular_sorted_set.rdb'))
+        self.assert_(',force_sorted_set,' in csv)
+
+    def test_allocator(self):
+        for dump_name in ('regular_sorted_set.rdb', 'zipmap_with_big_values.rdb', 'keys_with_expiry.rdb'):
+            self.assertNotEquals(get_csv(dump_name, allocator='libc'), get_csv(dump_name), msg=dump_name)
+        self.assertRaises(Exception, MemoryCallback, None, 64, allocator='tcmalloc')
+
+    def test_key_groups(self):
+        stats = StatsAggregator(key_groupings=['set', 'l1[0-9]', 'n.*'])
+        RdbParser(MemoryCallback(stats, 64)).parse(os.path.join(os.path.dirname(__file__), 'dumps', 'parser_filters.rdb'))
+        self.assertEquals(stats.aggregates['group_count'], {'set': 6, 'l1[0-9]': 3, 'n.*': 9})
+        self.assertEquals(stats.aggregates['group_memory']['l1[0-9]'], 159 + 169 + 169)
+        self.assertEquals(stats.aggregates['group_encoding_count'], {'set (hashtable)': 3, 'set (intset)': 3,
+                                                                     'l1[0-9] (quicklist)': 3, 'n.* (string)': 9})
+        self.assertEquals(stats.aggregates['group_encoding_memory']['set (intset)'], 76 + 72 + 80)
+
+    def test_namespace_tree(self):
+        tree = NamespaceTree(delimiters=':/')
+        self.assertEquals(tree.segments('svc:user:42:name'), ['svc:', 'user:', '*:', 'name'])
+        self.assertEquals(tree.segments('img/0f8fad5b-d9cb-469f-a165-70867728950e/thumb'), ['img/', '*/', 'thumb'])
+        self.assertEquals(tree.segments('cache:9e107d9d372bb6826bd81d3542a419d6:'), ['cache:', '*:'])
+        self.assertEquals(tree.segments('plain'), ['plain'])
+
+        for i in range(100):
+            tree.next_record(namespace_record('svc:user:%d:name' % i, 10))
+            tree.next_record(namespace_record('svc:user:%d:friends' % i, 100 + i))
+        tree.next_record(namespace_record('svc:config', 5))
+        tree.next_record(MemoryRecord(database=0, type='dict', key=None, bytes=1000, encoding=None, size=None,
+                                      len_largest_element=None, expiry=None))
+        rows = dict((row[0], row[1:]) for row in tree.rows())
+        self.assertEquals(list(tree.rows())[0][0], 'svc:')
+        self.assertEquals(rows['svc:'], (201, 1000 + 100 * 100 + 4950 + 5, 'svc:user:99:friends', 199, 0))
+        self.assertEquals(rows['svc:user:*:friends'][:2], (100, 100 * 100 + 4950))
+        self.assertEquals(rows['svc:user:*:name'][:2], (100, 1000))
+        self.assertEquals(rows['svc:config'][:2], (1, 5))
+        self.assertEquals(len(rows), 6)
+
+    def test_namespace_tree_is_bounded(self):
+        tree = NamespaceTree(max_nodes=50, max_children=10)
+        for i in range(3000):
+            tree.next_record(namespace_record('big:key%d' % i, 1000))
+            tree.next_record(namespace_record('n%d:key' % i, 1))
+            self.assert_(tree.root.size() <= 50)
+            self.assertEquals(tree._nodes, tree.root.size())
+        rows = dict((row[0], row[1:]) for row in tree.rows())
+        # the namespace with most of the memory survives, the others are folded into wildcards
+        self.assertEquals(rows['big:'][:2], (3000, 3000000))
+        self.assertEquals(tree.root.keys, 6000)
+        self.assert_(len(rows) < 50)
+
+    def test_namespace_trees_are_merged(self):
+        records = [namespace_record('svc:%s:%d' % (name, i), i) for i in range(50) for name in ('a', 'b', 'c')]
+        expected = NamespaceTree()
+        for record in records:
+            expected.next_record(record)
+        first, second = NamespaceTree(), NamespaceTree()
+        for record in records[:70]:
+            first.next_record(record)
+        for record in records[70:]:
+            second.next_record(record)
+        first.merge(second)
+        self.assertEquals(list(first.rows()), list(expected.rows()))
+        self.assertEquals(first._nodes, first.root.size())
+
+    def test_namespace_tree_csv(self):
+        buff = BytesIO()
+        RdbParser(MemoryCallback(NamespaceTree(buff), 64)).parse(os.path.join(os.path.dirname(__file__), 'dumps', 'keys_with_expiry.rdb'))
+        self.assertEquals(buff.getvalue().decode().splitlines(),
+                          ['namespace,keys,size_in_bytes,largest_key,largest_key_size_in_bytes,error',
+                           'expires_ms_precision,1,128,expires_ms_precision,128,0'])
+
+    def test_largest_keys(self):
+        records = [MemoryRecord(database=i % 2, type=('string', 'hash', 'set')[i % 3], key='k%d' % i, bytes=(i * 37) % 503,
+                                encoding='raw', size=1, len_largest_element=1, expiry=None) for i in range(500)]
+        biggest = sorted(records, key=lambda record: record.bytes, reverse=True)
+
+        buff = BytesIO()
+        printer = PrintAllKeys(buff, None, 5)
+        for record in records:
+            printer.next_record(record)
+        self.assertEquals(sum(len(heap) for heap in printer._heaps.values()), 5)
+        printer.end_rdb()
+        self.assertEquals(sorted(largest_keys(buff)), sorted(record.key for record in biggest[:5]))
+
+        buff = BytesIO()
+        printer = PrintAllKeys(buff, None, 2, largest_by='type')
+        for record in records:
+            printer.next_record(record)
+        printer.end_rdb()
+        expected = []
+        for data_type in ('hash', 'set', 'string'):
+            expected.extend(sorted([record.key for record in biggest if record.type == data_type][:2]))
+        keys = largest_keys(buff)
+        self.assertEquals(sorted(keys[:2]) + sorted(keys[2:4]) + sorted(keys[4:]), expected)
+
+    def test_largest_keys_snapshot(self):
+        records = [MemoryRecord(database=0, type='string', key='k%d' % i, bytes=i, encoding='raw', size=1,
+                                len_largest_element=1, expiry=None) for i in range(SNAPSHOT_CHECK_RECORDS * 2)]
+        temp_dir = tempfile.mkdtemp()
+        try:
+            snapshot_file = os.path.join(temp_dir, 'largest.csv')
+            printer = PrintAllKeys(BytesIO(), None, 3, snapshot_file=snapshot_file, snapshot_interval=0)
+            for record in records[:SNAPSHOT_CHECK_RECORDS]:
+                printer.next_record(record)
+            with open(snapshot_file, 'rb') as f:
+                self.assertEquals(largest_keys(f), ['k999', 'k998', 'k997'])
+            for record in records[SNAPSHOT_CHECK_RECORDS:]:
+                printer.next_record(record)
+            printer.end_rdb()
+            with open(snapshot_file, 'rb') as f:
+                self.assertEquals(largest_keys(f), ['k1999', 'k1998', 'k1997'])
+        finally:
+            shutil.rmtree(temp_dir)
+
     def test_rdb_with_stream(self):
         stats = get_stats('redis_50_with_streams.rdb')
 
@@ -0,0 +1,63 @@
+import os
+from io import BytesIO
+import unittest
+
+from rdbtools import RdbParser, MemoryCallback, StatsAggregator
+from rdbtools.memprofiler import PrintAllKeys
+from rdbtools.parallel import profile_memory, split_ranges
+
+DUMPS = ('dictionary.rdb', 'empty_database.rdb', 'keys_with_expiry.rdb', 'linkedlist.rdb', 'multiple_databases.rdb',
+         'parser_filters.rdb', 'redis_40_with_module.rdb', 'redis_50_with_streams.rdb', 'regular_set.rdb',
+         'regular_sorted_set.rdb', 'ziplist_that_compresses_easily.rdb', 'zipmap_with_big_values.rdb')
+
+
+def dump_path(file_name):
+    return os.path.join(os.path.dirname(__file__), 'dumps', file_name)
+
+
+def serial_csv(file_name, filters=None, largest=None):
+    buff = BytesIO()
+    RdbParser(MemoryCallback(PrintAllKeys(buff, None, largest), 64), filters).parse(dump_path(file_name))
+    return buff.getvalue()
+
+
+def parallel_csv(file_name, filters=None, largest=None):
+    buff = BytesIO()
+    profile_memory(dump_path(file_name), PrintAllKeys(buff, None, largest), 3, filters=filters)
+    return buff.getvalue()
+
+
+class ParallelMemoryTestCase(unittest.TestCase):
+    def test_records_match_serial_parse(self):
+        for dump_name in DUMPS:
+            self.assertEquals(parallel_csv(dump_name), serial_csv(dump_name), msg=dump_name)
+
+    def test_largest_keys_match_serial_parse(self):
+        self.assertEquals(parallel_csv('parser_filters.rdb', largest=3), serial_csv('parser_filters.rdb', largest=3))
+
+    def test_filters(self):
+        filters = {'dbs': [2]}
+        self.assertEquals(parallel_csv('multiple_databases.rdb', filters), serial_csv('multiple_databases.rdb', filters))
+        filters = {'keys': 'k[0-9]', 'types': ['string']}
+        self.assertEquals(parallel_csv('parser_filters.rdb', filters), serial_csv('parser_filters.rdb', filters))
+
+    def test_stats_are_merged(self):
+        for dump_name in DUMPS:
+            expected = StatsAggregator()
+            RdbParser(MemoryCallback(expected, 64)).parse(dump_path(dump_name))
+            stats = StatsAggregator()
+            profile_memory(dump_path(dump_name), stats, 3)
+            self.assertEquals(stats.aggregates, expected.aggregates, msg=dump_name)
+            self.assertEquals(stats.histograms, expected.histograms, msg=dump_name)
+            self.assertEquals(stats.scatters, expected.scatters, msg=dump_name)
+            self.assertEquals(sorted(stats.sketches), sorted(expected.sketches), msg=dump_name)
+            for heading, sketch in expected.sketches.items():
+                self.assertEquals(stats.sketches[heading].buckets, sketch.buckets, msg=dump_name)
+            self.assertEquals(stats.metadata, expected.metadata, msg=dump_name)
+
+    def test_split_ranges(self):
+        entries = [(0, offset) for offset in (10, 20, 30, 500, 510, 990)]
+        ranges = split_ranges(entries, 4, 1000)
+        self.assertEquals(sum(ranges, []), entries)
+        self.assertEquals(ranges, [entries[:3], entries[3:4], entries[4:5], entries[5:]])
+        self.assertEquals(split_ranges([], 4, 1000), [])
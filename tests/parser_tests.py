@@ -1,8 +1,34 @@
 import unittest
 import os
+import glob
+import array
 import math
-from rdbtools import RdbCallback, RdbParser
+import threading
+import io
+import gc
+import weakref
+import shutil
+import struct
+import tempfile
+from io import BytesIO
+import datetime
+from rdbtools import RdbCallback, RdbParser, STOP_PARSING, KeyInfo, ElementEncoding, ElementSummary, expiry_to_datetime, ProtocolCallback
+from rdbtools import parser as rdb_parser
+from rdbtools.parser import LazyLzfString, ziplist_entry_size
+from rdbtools.readers import ReadAheadReader
+from rdbtools.filters import to_milliseconds
 from rdbtools.compat import range
+from rdbtools.keyindex import KeyIndex, build_index
+
+# dumps with module aux data before any database, which MockRedis and the plain RdbCallback do not handle
+SKIPPED_DUMPS = ('redis_60_with_module_aux.rdb', )
+
+
+def parseable_dumps():
+    """The paths of the test dumps that every callback can parse, see SKIPPED_DUMPS"""
+    return [dump_name for dump_name in sorted(glob.glob(os.path.join(os.path.dirname(__file__), 'dumps', '*.rdb')))
+            if os.path.basename(dump_name) not in SKIPPED_DUMPS]
+
 
 class RedisParserTestCase(unittest.TestCase):
     def setUp(self):
@@ -204,6 +230,24 @@ class RedisParserTestCase(unittest.TestCase):
         self.assertEquals(r.databases[0][b"key_in_zeroth_database"], b"zero")
         self.assertEquals(r.databases[2][b"key_in_second_database"], b"second")
 
+    def test_multiple_databases_pipe(self):
+        r = load_rdb_pipe('multiple_databases.rdb')
+        self.assertEquals(r.databases[0][b"key_in_zeroth_database"], b"zero")
+        self.assertEquals(r.databases[2][b"key_in_second_database"], b"second")
+
+    def test_pipe_with_small_buffer(self):
+        expected = load_rdb('ziplist_that_compresses_easily.rdb')
+        r = load_rdb_pipe('ziplist_that_compresses_easily.rdb', buffer_size=7)
+        self.assertEquals(r.databases, expected.databases)
+        self.assertEquals(r.lengths, expected.lengths)
+
+    def test_stream_without_fileno(self):
+        with open(os.path.join(os.path.dirname(__file__), 'dumps', 'regular_set.rdb'), 'rb') as f:
+            stream = BytesIO(f.read())
+        r = MockRedis()
+        RdbParser(r).parse_stream(stream, buffer_size=16)
+        self.assertEquals(r.lengths[0][b"regular_set"], 6)
+
     def test_rdb_version_8_with_module(self):
         r = load_rdb('redis_40_with_module.rdb')
         self.assertEquals(r.databases[0][b'foo']['module_name'], 'ReJSON-RL')
@@ -217,22 +261,419 @@ class RedisParserTestCase(unittest.TestCase):
         self.assertEquals(r.lengths[0][b"mystream"], 4)
         self.assertEquals(len(r.databases[0][b'mystream']), 1)
 
+    def test_mmap_engine_matches_file_engine(self):
+        for dump_name in parseable_dumps():
+            expected = load_rdb(dump_name)
+            r = load_rdb(dump_name, engine='mmap')
+            self.assertEquals(r.databases, expected.databases, msg=dump_name)
+            self.assertEquals(r.lengths, expected.lengths, msg=dump_name)
+            self.assertEquals(r.expiry, expected.expiry, msg=dump_name)
+
+    def test_mmap_engine_with_filters(self):
+        r = load_rdb('parser_filters.rdb', filters={"keys":"k[0-9]"}, engine='mmap')
+        self.assertEquals(r.databases[0][b'k1'], b"ssssssss")
+        self.assertEquals(r.databases[0][b'k3'], b"wwwwwwww")
+        self.assertEquals(len(r.databases[0]), 2)
+
+    def test_readahead_engine_matches_file_engine(self):
+        for dump_name in parseable_dumps():
+            expected = load_rdb(dump_name)
+            r = load_rdb(dump_name, engine='readahead')
+            self.assertEquals(r.databases, expected.databases, msg=dump_name)
+            self.assertEquals(r.lengths, expected.lengths, msg=dump_name)
+            self.assertEquals(r.expiry, expected.expiry, msg=dump_name)
+
+    def test_readahead_with_small_buffers(self):
+        file_name = os.path.join(os.path.dirname(__file__), 'dumps', 'ziplist_that_compresses_easily.rdb')
+        expected = load_rdb('ziplist_that_compresses_easily.rdb')
+        r = MockRedis()
+        parser = RdbParser(r)
+        parser.parse_fd(ReadAheadReader(open(file_name, 'rb', 0), buffer_size=7, buffers=2))
+        self.assertEquals(r.databases, expected.databases)
+        self.assertEquals(parser.read_stats.bytes_read, os.path.getsize(file_name))
+        self.assert_(parser.read_stats.wait_seconds >= 0 and parser.read_stats.decode_seconds >= 0)
+
+    def test_readahead_stops_early(self):
+        r = load_rdb('parser_filters.rdb', filters={'max_keys': 1}, engine='readahead')
+        self.assertEquals(sum(len(keys) for keys in r.databases.values()), 1)
+        self.assertEquals(r.methods_called[-1], 'end_rdb')
+
+    def test_readahead_stream(self):
+        with open(os.path.join(os.path.dirname(__file__), 'dumps', 'regular_set.rdb'), 'rb') as f:
+            stream = BytesIO(f.read())
+        r = MockRedis()
+        parser = RdbParser(r, engine='readahead')
+        parser.parse_stream(stream, buffer_size=16)
+        self.assertEquals(r.lengths[0][b"regular_set"], 6)
+        self.assertEquals(parser.read_stats.bytes_read, len(stream.getvalue()))
+
+    def test_readahead_reports_read_errors(self):
+        class FailingFile(io.RawIOBase):
+            def readinto(self, b):
+                raise IOError('disk on fire')
+        self.assertRaises(IOError, RdbParser(MockRedis()).parse_fd, ReadAheadReader(FailingFile()))
+
+    def test_filtered_keys_are_seeked_over(self):
+        reader = CountingReader(os.path.join(os.path.dirname(__file__), 'dumps', 'dictionary.rdb'))
+        RdbParser(MockRedis(), filters={"keys": "no_such_key"}).parse_fd(reader)
+        # only the length prefixes of the 1000 skipped fields and values are read
+        self.assert_(reader.bytes_read < os.path.getsize(reader.name) // 10, reader.bytes_read)
+
+    def test_filtered_keys_are_skipped_on_pipe(self):
+        r = load_rdb_pipe('parser_filters.rdb', filters={"keys":"k[0-9]"}, buffer_size=7)
+        self.assertEquals(r.databases[0][b'k1'], b"ssssssss")
+        self.assertEquals(r.databases[0][b'k3'], b"wwwwwwww")
+        self.assertEquals(len(r.databases[0]), 2)
+
+    def test_skip_stream_with_pending_entries(self):
+        for engine in ('file', 'mmap'):
+            r = load_rdb('redis_50_with_streams.rdb', filters={"keys":"no_such_key"}, engine=engine)
+            self.assertEquals(r.databases, {0: {}})
+        r = load_rdb_pipe('redis_50_with_streams.rdb', filters={"keys":"no_such_key"})
+        self.assertEquals(r.databases, {0: {}})
+
+    def test_batch_callbacks_match_element_callbacks(self):
+        for dump_name in parseable_dumps():
+            expected = load_rdb(dump_name)
+            r = BatchMockRedis()
+            RdbParser(r).parse(dump_name)
+            self.assertEquals(r.databases, expected.databases, msg=dump_name)
+            self.assertEquals(r.lengths, expected.lengths, msg=dump_name)
+
+    def test_ziplist_is_delivered_in_one_batch(self):
+        r = BatchMockRedis()
+        RdbParser(r).parse(os.path.join(os.path.dirname(__file__), 'dumps', 'ziplist_with_integers.rdb'))
+        self.assertEquals(r.batches, [('rpush_many', b"ziplist_with_integers", r.lengths[0][b"ziplist_with_integers"])])
+
+        r = BatchMockRedis()
+        RdbParser(r).parse(os.path.join(os.path.dirname(__file__), 'dumps', 'sorted_set_as_ziplist.rdb'))
+        self.assertEquals(r.batches, [('zadd_many', b"sorted_set_as_ziplist", 3)])
+
+    def test_lazy_lzf_strings(self):
+        expected = load_rdb('parser_filters.rdb')
+        r = LazyMockRedis()
+        RdbParser(r).parse(os.path.join(os.path.dirname(__file__), 'dumps', 'parser_filters.rdb'))
+        for value, expected_value in ((r.databases[0][b's1'], expected.databases[0][b's1']),
+                                      (r.databases[0][b'h1'][b'c'], expected.databases[0][b'h1'][b'c'])):
+            self.assert_(isinstance(value, LazyLzfString))
+            self.assertEquals(len(value), len(expected_value))
+            self.assertEquals(bytes(value), expected_value)
+        # keys are never lazy
+        self.assert_(all(isinstance(key, bytes) for key in r.databases[0]))
+
+    def test_lazy_lzf_strings_match_eager_strings(self):
+        for dump_name in parseable_dumps():
+            expected = load_rdb(dump_name)
+            r = LazyMockRedis()
+            RdbParser(r).parse(dump_name)
+            self.assertEquals(r.databases, expected.databases, msg=dump_name)
+
+    def test_parser_is_freed_on_return(self):
+        # callbacks that write to a buffered file are only flushed when they are freed
+        gc.disable()
+        try:
+            for callback_class, lzf_threads in ((MockRedis, 0), (LazyMockRedis, 0), (RawMockRedis, 0), (MockRedis, 2)):
+                r = callback_class()
+                RdbParser(r, lzf_threads=lzf_threads).parse(os.path.join(os.path.dirname(__file__), 'dumps', 'parser_filters.rdb'))
+                callback = weakref.ref(r)
+                del r
+                self.assertEquals(callback(), None, msg=(callback_class, lzf_threads))
+        finally:
+            gc.enable()
+
+    def test_intset_is_delivered_as_array(self):
+        for dump_name, key in (('intset_16.rdb', b"intset_16"), ('intset_32.rdb', b"intset_32"), ('intset_64.rdb', b"intset_64")):
+            for engine in ('file', 'mmap'):
+                r = BatchMockRedis()
+                RdbParser(r, engine=engine).parse(os.path.join(os.path.dirname(__file__), 'dumps', dump_name))
+                self.assertEquals(r.batches, [('sadd_many', key, 3)])
+                self.assert_(isinstance(r.member_batches[0], array.array))
+                self.assertEquals(sorted(r.databases[0][key]), sorted(load_rdb(dump_name).databases[0][key]))
+
+    def test_elements_are_skipped_when_not_consumed(self):
+        for dump_name in parseable_dumps():
+            expected = DecodingEventRecorder()
+            RdbParser(expected).parse(dump_name)
+            r = EventRecorder()
+            parser = RdbParser(r)
+            parser.read_ziplist_entries = None
+            parser.read_intset = None
+            parser.parse(dump_name)
+            self.assertEquals(r.events, expected.events, msg=dump_name)
+
+    def test_element_consumers_are_detected(self):
+        self.assertEquals(RdbParser(MockRedis())._elementless_types, frozenset())
+        self.assertEquals(RdbParser(BatchMockRedis())._elementless_types, frozenset())
+        self.assertEquals(len(RdbParser(EventRecorder())._elementless_types), 10)
+        r = EventRecorder()
+        r.rpush = lambda key, value: None
+        self.assertEquals(len(RdbParser(r)._elementless_types), 7)
+
+    def test_callback_stops_parsing(self):
+        r = StoppingMockRedis(2)
+        RdbParser(r).parse(os.path.join(os.path.dirname(__file__), 'dumps', 'parser_filters.rdb'))
+        self.assertEquals(len(r.databases[0]), 2)
+        self.assertEquals(r.methods_called, ['start_rdb', 'end_rdb'])
+
+    def test_stop_parsing_reads_only_the_start_of_the_dump(self):
+        dump_name = os.path.join(os.path.dirname(__file__), 'dumps', 'parser_filters.rdb')
+        reader = CountingReader(dump_name)
+        r = MockRedis()
+        RdbParser(r, filters={'max_keys': 1}).parse_fd(reader)
+        self.assertEquals(len(r.databases[0]), 1)
+        self.assert_(reader.bytes_read < os.path.getsize(dump_name) // 10, reader.bytes_read)
+
+    def test_aux_field_stops_parsing(self):
+        for lzf_threads in (0, 2):
+            r = MockRedis()
+            r.aux_field = lambda key, value: STOP_PARSING
+            RdbParser(r, lzf_threads=lzf_threads).parse(os.path.join(os.path.dirname(__file__), 'dumps', 'redis_50_with_streams.rdb'))
+            self.assertEquals(r.methods_called, ['start_rdb', 'end_rdb'])
+            self.assertEquals(r.databases, {})
+
+    def test_aux_field_aborts_parsing(self):
+        # any other true value aborts the parse, without the events that end it
+        for lzf_threads in (0, 2):
+            r = MockRedis()
+            r.aux_field = lambda key, value: True
+            RdbParser(r, lzf_threads=lzf_threads).parse(os.path.join(os.path.dirname(__file__), 'dumps', 'redis_50_with_streams.rdb'))
+            self.assertEquals(r.methods_called, ['start_rdb'])
+            self.assertEquals(r.databases, {})
+
+    def test_start_database_stops_parsing_offsets(self):
+        dump_name = os.path.join(os.path.dirname(__file__), 'dumps', 'multiple_databases.rdb')
+        tmpdir = tempfile.mkdtemp()
+        try:
+            with KeyIndex(build_index(dump_name, os.path.join(tmpdir, 'index'))) as index:
+                entries = [(e.db, e.offset) for e in (index.entry(i) for i in range(len(index)))]
+        finally:
+            shutil.rmtree(tmpdir)
+        for lzf_threads in (0, 2):
+            results = []
+            for parse in ('parse', 'parse_offsets'):
+                r = MockRedis()
+                start_database = r.start_database
+                r.start_database = lambda db_number: start_database(db_number) or (STOP_PARSING if db_number == 2 else None)
+                parser = RdbParser(r, lzf_threads=lzf_threads)
+                if parse == 'parse':
+                    parser.parse(dump_name)
+                else:
+                    parser.parse_offsets(dump_name, entries)
+                self.assertEquals(r.methods_called, ['start_rdb', 'end_rdb'])
+                results.append(r.databases)
+            self.assertEquals(results[0], {0: {b'key_in_zeroth_database': b'zero'}, 2: {}})
+            self.assertEquals(results[1], results[0])
+
+    def test_raw_key_metadata_matches_info_dicts(self):
+        for dump_name in parseable_dumps():
+            expected = EventRecorder()
+            RdbParser(expected).parse(dump_name)
+            r = RawEventRecorder()
+            RdbParser(r).parse(dump_name)
+            self.assertEquals(r.events, [tuple(raw_metadata(x) for x in event) for event in expected.events], msg=dump_name)
+
+    def test_key_info_is_reused(self):
+        r = RawEventRecorder()
+        parser = RdbParser(r)
+        parser.parse(os.path.join(os.path.dirname(__file__), 'dumps', 'parser_filters.rdb'))
+        self.assertEquals(set(id(info) for info in r.infos), set([id(parser._key_info)]))
+
+    def test_key_info_reads_like_a_dict(self):
+        info = KeyInfo()
+        info.encoding = 'ziplist'
+        info.sizeof_value = 0
+        self.assertEquals(info['encoding'], 'ziplist')
+        self.assertEquals(info['sizeof_value'], 0)
+        self.assert_('sizeof_value' in info)
+        self.assert_('idle' not in info)
+        self.assert_('nothing' not in info)
+        self.assertEquals(info.get('zips', 3), 3)
+        self.assertRaises(KeyError, lambda: info['idle'])
+        self.assertEquals(repr(info), "KeyInfo(encoding='ziplist', sizeof_value=0)")
+
+    def test_element_encodings_match_elements(self):
+        for dump_name in parseable_dumps():
+            expected = load_rdb(dump_name)
+            for r in (EncodingMockRedis(), LazyEncodingMockRedis()):
+                RdbParser(r).parse(dump_name)
+                self.assertEquals(r.databases, expected.databases, msg=dump_name)
+
+    def test_element_encodings(self):
+        r = EncodingMockRedis()
+        RdbParser(r).parse(os.path.join(os.path.dirname(__file__), 'dumps', 'parser_filters.rdb'))
+        self.assertEquals(set(encoding.kind for value, encoding in r.encodings), set(['int', 'raw', 'lzf']))
+        for value, encoding in r.encodings:
+            if encoding.kind == 'int':
+                self.assert_(-2 ** (encoding.width * 8 - 1) <= value < 2 ** (encoding.width * 8 - 1), (value, encoding))
+            elif encoding.kind == 'lzf':
+                self.assert_(encoding.compressed_length < len(value), (value, encoding))
+            else:
+                self.assertEquals(encoding, ElementEncoding('raw', None, None))
+
+    def test_element_summaries_match_elements(self):
+        summarised = 0
+        for dump_name in parseable_dumps():
+            expected = load_rdb(dump_name)
+            events = EventRecorder()
+            RdbParser(events).parse(dump_name)
+            for engine in ('file', 'mmap'):
+                r = SummaryRecorder()
+                RdbParser(r, engine=engine).parse(dump_name)
+                self.assertEquals(r.events, events.events, msg=dump_name)
+                for dbnum, start_event, key, summary in r.summaries:
+                    value = expected.databases[dbnum][key]
+                    self.assertEquals(summary, element_summary(start_event, value), msg=(dump_name, key))
+                summarised += len(r.summaries)
+        self.assert_(summarised > 20, summarised)
+
+    def test_string_values_in_chunks(self):
+        for dump_name in parseable_dumps():
+            expected = load_rdb(dump_name)
+            for engine in ('file', 'mmap'):
+                r = ChunkingMockRedis(8)
+                RdbParser(r, engine=engine).parse(dump_name)
+                self.assertEquals(r.databases, expected.databases, msg=dump_name)
+                self.assertEquals(r.expiry, expected.expiry, msg=dump_name)
+
+        r = ChunkingMockRedis(8)
+        RdbParser(r).parse(os.path.join(os.path.dirname(__file__), 'dumps', 'parser_filters.rdb'))
+        # the string values of parser_filters.rdb longer than 8 bytes, s1 is LZF compressed
+        self.assertEquals(sorted(r.chunked), [b's1', b's2'])
+
+    def test_string_chunks_are_skipped(self):
+        r = MockRedis()
+        r.string_chunk_size = 8
+        chunked_lengths = {}
+        def set_start(key, length, expiry, info):
+            chunked_lengths[key] = length
+        r.set_start = set_start
+        RdbParser(r).parse(os.path.join(os.path.dirname(__file__), 'dumps', 'parser_filters.rdb'))
+        expected = load_rdb('parser_filters.rdb')
+        self.assertEquals(sorted(chunked_lengths), [b's1', b's2'])
+        for key in chunked_lengths:
+            self.assertEquals(chunked_lengths[key], len(expected.databases[0][key]))
+            self.assert_(key not in r.databases[0])
+
+    def test_lzf_threads_deliver_events_in_order(self):
+        lzf_thread_min_length = rdb_parser.LZF_THREAD_MIN_LENGTH
+        rdb_parser.LZF_THREAD_MIN_LENGTH = 0
+        try:
+            for dump_name in parseable_dumps():
+                expected = load_rdb(dump_name)
+                r = MockRedis()
+                RdbParser(r, lzf_threads=2).parse(dump_name)
+                self.assertEquals(r.databases, expected.databases, msg=dump_name)
+                self.assertEquals(r.lengths, expected.lengths, msg=dump_name)
+                self.assertEquals(r.expiry, expected.expiry, msg=dump_name)
+
+                expected = BytesIO()
+                RdbParser(ProtocolCallback(expected)).parse(dump_name)
+                out = BytesIO()
+                RdbParser(ProtocolCallback(out), lzf_threads=2).parse(dump_name)
+                self.assertEquals(out.getvalue(), expected.getvalue(), msg=dump_name)
+        finally:
+            rdb_parser.LZF_THREAD_MIN_LENGTH = lzf_thread_min_length
+
+    def test_lzf_threads_wait_for_the_oldest_values(self):
+        values = [(b'key%d' % i, (b'value %d ' % i) * (i + 10)) for i in range(200)]
+        out_dir = tempfile.mkdtemp()
+        dump_name = os.path.join(out_dir, 'lzf_values.rdb')
+        lzf_thread_min_length = rdb_parser.LZF_THREAD_MIN_LENGTH
+        rdb_parser.LZF_THREAD_MIN_LENGTH = 100
+        try:
+            write_lzf_dump(dump_name, values)
+            expected = BytesIO()
+            RdbParser(ProtocolCallback(expected)).parse(dump_name)
+            for threads in (1, 3):
+                out = BytesIO()
+                RdbParser(ProtocolCallback(out), lzf_threads=threads).parse(dump_name)
+                self.assertEquals(out.getvalue(), expected.getvalue())
+            self.assertEquals(load_rdb(dump_name).databases[0], dict(values))
+        finally:
+            rdb_parser.LZF_THREAD_MIN_LENGTH = lzf_thread_min_length
+            shutil.rmtree(out_dir)
+
+    def test_lzf_threads_stop_parsing(self):
+        lzf_thread_min_length = rdb_parser.LZF_THREAD_MIN_LENGTH
+        rdb_parser.LZF_THREAD_MIN_LENGTH = 0
+        try:
+            dump_name = os.path.join(os.path.dirname(__file__), 'dumps', 'parser_filters.rdb')
+            for max_keys in (1, 2, 5, 10):
+                expected = StoppingMockRedis(max_keys)
+                RdbParser(expected).parse(dump_name)
+                r = StoppingMockRedis(max_keys)
+                RdbParser(r, lzf_threads=2).parse(dump_name)
+                self.assertEquals(r.databases, expected.databases)
+                self.assertEquals(r.methods_called, ['start_rdb', 'end_rdb'])
+
+                r = MockRedis()
+                RdbParser(r, filters={'max_keys': max_keys}, lzf_threads=2).parse(dump_name)
+                self.assertEquals(r.databases, load_rdb('parser_filters.rdb', filters={'max_keys': max_keys}).databases)
+        finally:
+            rdb_parser.LZF_THREAD_MIN_LENGTH = lzf_thread_min_length
+
+    def test_raw_expiry(self):
+        r = RawEventRecorder()
+        r.raw_expiries = []
+        r.set = lambda key, value, expiry, info: r.raw_expiries.append(expiry)
+        RdbParser(r).parse(os.path.join(os.path.dirname(__file__), 'dumps', 'keys_with_expiry.rdb'))
+        self.assertEquals(r.raw_expiries, [1671963072573])
+        self.assertEquals(expiry_to_datetime(r.raw_expiries[0]), datetime.datetime(2022, 12, 25, 10, 11, 12, 573000))
+        self.assertEquals(expiry_to_datetime(None), None)
+
+
+class CountingReader(io.FileIO):
+    """Unbuffered file that counts the bytes actually read"""
+    bytes_read = 0
+
+    def read(self, n):
+        data = super(CountingReader, self).read(n)
+        self.bytes_read += len(data)
+        return data
+
 
 def floateq(f1, f2) :
     return math.fabs(f1 - f2) < 0.00001
 
-def load_rdb(file_name, filters=None) :
+def load_rdb(file_name, filters=None, engine='file') :
     r = MockRedis()
-    parser = RdbParser(r, filters)
+    parser = RdbParser(r, filters, engine=engine)
     parser.parse(os.path.join(os.path.dirname(__file__), 'dumps', file_name))
     return r
 
+def write_lzf_dump(file_name, values) :
+    """Write a dump with one database of string keys, whose `values` are LZF compressed as literal runs"""
+    with open(file_name, 'wb') as f:
+        f.write(b'REDIS0006\xfe\x00')
+        for key, value in values:
+            compressed = b''.join(struct.pack('B', len(value[i:i + 32]) - 1) + value[i:i + 32]
+                                  for i in range(0, len(value), 32))
+            f.write(b'\x00' + struct.pack('B', len(key)) + key)
+            f.write(b'\xc3\x80' + struct.pack('>I', len(compressed)) + b'\x80' + struct.pack('>I', len(value)) + compressed)
+        f.write(b'\xff' + b'\x00' * 8)
+
 def load_rdb_stream(file_name, filters=None) :
     r = MockRedis()
     parser = RdbParser(r, filters)
     parser.parse_fd(open(os.path.join(os.path.dirname(__file__), 'dumps', file_name), 'rb'))
     return r
     
+def load_rdb_pipe(file_name, filters=None, buffer_size=1024) :
+    with open(os.path.join(os.path.dirname(__file__), 'dumps', file_name), 'rb') as f:
+        data = f.read()
+    read_fd, write_fd = os.pipe()
+    def writer():
+        with os.fdopen(write_fd, 'wb') as out:
+            out.write(data)
+    thread = threading.Thread(target=writer)
+    thread.start()
+    r = MockRedis()
+    parser = RdbParser(r, filters)
+    with os.fdopen(read_fd, 'rb', 0) as pipe:
+        parser.parse_stream(pipe, buffer_size=buffer_size)
+    thread.join()
+    return r
+
 class MockRedis(RdbCallback):
     def __init__(self):
         super(MockRedis, self).__init__(string_escape=None)
@@ -396,3 +837,231 @@ class MockRedis(RdbCallback):
         self.methods_called.append('end_rdb')
 
 
+class LazyMockRedis(MockRedis):
+    lazy_lzf_strings = True
+
+
+class RawMockRedis(MockRedis):
+    raw_key_metadata = True
+
+
+class EncodingMockRedis(MockRedis):
+    """MockRedis that sets `element_encodings`, and records the strings along with their encodings"""
+    element_encodings = True
+
+    def __init__(self):
+        super(EncodingMockRedis, self).__init__()
+        self.encodings = []
+
+    def set(self, key, value, expiry, info):
+        self.encodings.append((value, info['value_encoding']))
+        super(EncodingMockRedis, self).set(key, value, expiry, info)
+
+    def hset_encoded(self, key, field, value, field_encoding, value_encoding):
+        self.encodings.extend(((field, field_encoding), (value, value_encoding)))
+        self.hset(key, field, value)
+
+    def sadd_encoded(self, key, member, encoding):
+        self.encodings.append((member, encoding))
+        self.sadd(key, member)
+
+    def rpush_encoded(self, key, value, encoding):
+        self.encodings.append((value, encoding))
+        self.rpush(key, value)
+
+    def zadd_encoded(self, key, score, member, encoding):
+        self.encodings.append((member, encoding))
+        self.zadd(key, score, member)
+
+
+class LazyEncodingMockRedis(EncodingMockRedis):
+    lazy_lzf_strings = True
+
+
+class ChunkingMockRedis(MockRedis):
+    """MockRedis that takes the string values longer than `chunk_size` in chunks"""
+    def __init__(self, chunk_size):
+        super(ChunkingMockRedis, self).__init__()
+        self.string_chunk_size = chunk_size
+        self.chunked = []
+
+    def set_start(self, key, length, expiry, info):
+        self.chunked.append(key)
+        self.pending = (length, expiry, info, [])
+
+    def set_chunk(self, key, chunk):
+        self.pending[3].append(chunk)
+
+    def set_end(self, key):
+        length, expiry, info, chunks = self.pending
+        value = b''.join(chunks)
+        if len(value) != length:
+            raise Exception('set_start called with length %d, but %d bytes were delivered' % (length, len(value)))
+        self.set(key, value, expiry, info)
+
+
+class StoppingMockRedis(MockRedis):
+    """MockRedis that stops the parse after `max_keys` keys"""
+    def __init__(self, max_keys):
+        super(StoppingMockRedis, self).__init__()
+        self.max_keys = max_keys
+
+    def key_done(self):
+        if len(self.currentdb()) >= self.max_keys:
+            return STOP_PARSING
+
+    def set(self, key, value, expiry, info):
+        super(StoppingMockRedis, self).set(key, value, expiry, info)
+        return self.key_done()
+
+    def end_hash(self, key):
+        super(StoppingMockRedis, self).end_hash(key)
+        return self.key_done()
+
+    def end_set(self, key):
+        super(StoppingMockRedis, self).end_set(key)
+        return self.key_done()
+
+    def end_list(self, key, info):
+        super(StoppingMockRedis, self).end_list(key, info)
+        return self.key_done()
+
+    def end_sorted_set(self, key):
+        super(StoppingMockRedis, self).end_sorted_set(key)
+        return self.key_done()
+
+
+class EventRecorder(RdbCallback):
+    """Records the start and end events of every key, and takes no elements"""
+    def __init__(self):
+        super(EventRecorder, self).__init__(string_escape=None)
+        self.events = []
+
+    def set(self, key, value, expiry, info):
+        self.events.append(('set', key, expiry))
+
+    def start_hash(self, key, length, expiry, info):
+        self.events.append(('start_hash', key, length, expiry, info))
+
+    def end_hash(self, key):
+        self.events.append(('end_hash', key))
+
+    def start_set(self, key, cardinality, expiry, info):
+        self.events.append(('start_set', key, cardinality, expiry, info))
+
+    def end_set(self, key):
+        self.events.append(('end_set', key))
+
+    def start_list(self, key, expiry, info):
+        self.events.append(('start_list', key, expiry, info))
+
+    def end_list(self, key, info):
+        self.events.append(('end_list', key, info))
+
+    def start_sorted_set(self, key, length, expiry, info):
+        self.events.append(('start_sorted_set', key, length, expiry, info))
+
+    def end_sorted_set(self, key):
+        self.events.append(('end_sorted_set', key))
+
+
+class SummaryRecorder(EventRecorder):
+    """EventRecorder that sets `element_summaries`, and records the summaries with the start event of their key"""
+    element_summaries = True
+
+    def __init__(self):
+        super(SummaryRecorder, self).__init__()
+        self.summaries = []
+        self.dbnum = 0
+
+    def start_database(self, db_number):
+        self.dbnum = db_number
+
+    def element_summary(self, key, summary):
+        self.summaries.append((self.dbnum, self.events[-1][0], key, summary))
+
+
+def element_summary(start_event, value):
+    """The `ElementSummary` of `value`, as loaded by MockRedis, of a key that started with `start_event`"""
+    if start_event == 'start_hash':
+        elements = list(value.keys()) + list(value.values())
+    else:
+        elements = list(value)
+    lengths = [len(element) for element in elements if not isinstance(element, int)]
+    entry_sizes = [ziplist_entry_size(element) for element in value] if start_event == 'start_list' else None
+    return ElementSummary(len(value), max(lengths or [0]), len(elements) - len(lengths), entry_sizes)
+
+
+def raw_metadata(value):
+    """What a callback that sets `raw_key_metadata` receives instead of `value`"""
+    if isinstance(value, datetime.datetime):
+        return to_milliseconds(value)
+    if isinstance(value, dict):
+        return dict((name, x) for name, x in value.items() if x is not None)
+    return value
+
+
+class RawEventRecorder(EventRecorder):
+    """EventRecorder that sets `raw_key_metadata`, and records the KeyInfo objects as dicts"""
+    raw_key_metadata = True
+
+    def __init__(self):
+        super(RawEventRecorder, self).__init__()
+        self.events = _KeyInfoSnapshots(self)
+        self.infos = []
+
+
+class _KeyInfoSnapshots(list):
+    def __init__(self, recorder):
+        super(_KeyInfoSnapshots, self).__init__()
+        self.recorder = recorder
+
+    def append(self, event):
+        for value in event:
+            if isinstance(value, KeyInfo):
+                self.recorder.infos.append(value)
+        super(_KeyInfoSnapshots, self).append(tuple(
+            dict((name, value[name]) for name in KeyInfo.__slots__ if name in value) if isinstance(value, KeyInfo) else value
+            for value in event))
+
+
+class DecodingEventRecorder(EventRecorder):
+    """EventRecorder that takes the elements, so that the parser decodes them"""
+    def hset(self, key, field, value):
+        pass
+
+    def sadd(self, key, member):
+        pass
+
+    def rpush(self, key, value):
+        pass
+
+    def zadd(self, key, score, member):
+        pass
+
+
+class BatchMockRedis(MockRedis):
+    """MockRedis that takes compact encodings through the batch callbacks"""
+    def __init__(self):
+        super(BatchMockRedis, self).__init__()
+        self.batches = []
+        self.member_batches = []
+
+    def hset_many(self, key, fields, values):
+        self.batches.append(('hset_many', key, len(fields)))
+        self.currentdb()[key].update(zip(fields, values))
+
+    def sadd_many(self, key, members):
+        self.batches.append(('sadd_many', key, len(members)))
+        self.member_batches.append(members)
+        self.currentdb()[key].extend(members)
+
+    def rpush_many(self, key, values):
+        self.batches.append(('rpush_many', key, len(values)))
+        self.currentdb()[key].extend(values)
+
+    def zadd_many(self, key, scores, members):
+        self.batches.append(('zadd_many', key, len(members)))
+        self.currentdb()[key].update(zip(members, scores))
+
+
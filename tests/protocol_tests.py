@@ -55,3 +55,14 @@ class ProtocolExpireTestCase(unittest.TestCase):
         self.assertEquals(buf.getvalue(), expected)
 
 
+
+    def test_values_in_chunks(self):
+        for dump_name in ('keys_with_expiry.rdb', 'parser_filters.rdb', 'easily_compressible_string_key.rdb'):
+            dump_file = os.path.join(os.path.dirname(__file__), 'dumps', dump_name)
+            expected = BytesIO()
+            RdbParser(ProtocolCallback(expected)).parse(dump_file)
+            buf = BytesIO()
+            callback = ProtocolCallback(buf)
+            callback.string_chunk_size = 4
+            RdbParser(callback).parse(dump_file)
+            self.assertEquals(buf.getvalue(), expected.getvalue(), msg=dump_name)
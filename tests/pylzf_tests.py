@@ -0,0 +1,36 @@
+import unittest
+
+from rdbtools import pylzf
+from tests.lzf_benchmark import collect_payloads, legacy_decompress
+
+
+class PyLzfTestCase(unittest.TestCase):
+    def test_matches_byte_at_a_time_decompressor(self):
+        payloads = collect_payloads()
+        self.assert_(len(payloads) > 0)
+        for compressed, expected_length in payloads:
+            self.assertEquals(pylzf.decompress(compressed, expected_length),
+                              legacy_decompress(compressed, expected_length))
+
+    def test_literal_run_and_back_reference(self):
+        # "abc" followed by a 3 byte copy from distance 3
+        self.assertEquals(pylzf.decompress(b'\x02abc\x20\x02', 6), b'abcabc')
+
+    def test_overlapping_back_reference(self):
+        # "ab" followed by a 9 byte copy from distance 2, which repeats "ab"
+        self.assertEquals(pylzf.decompress(b'\x01ab\xe0\x00\x01', 11), b'abababababa')
+        # a single byte repeated by a long back reference at distance 1
+        self.assertEquals(pylzf.decompress(b'\x00a\xe0\xf6\x00', 256), b'a' * 256)
+
+    def test_memoryview_input(self):
+        self.assertEquals(pylzf.decompress(memoryview(b'\x02abc\x20\x02'), 6), b'abcabc')
+
+    def test_corrupt_data(self):
+        # back reference before the start of the output
+        self.assertRaises(ValueError, pylzf.decompress, b'\x00a\x20\x05', 4)
+        # truncated back reference
+        self.assertRaises(ValueError, pylzf.decompress, b'\x00a\xe0', 10)
+        # truncated literal run
+        self.assertRaises(ValueError, pylzf.decompress, b'\x05ab', 6)
+        # wrong expected length
+        self.assertRaises(ValueError, pylzf.decompress, b'\x02abc', 4)
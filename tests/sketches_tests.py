@@ -0,0 +1,99 @@
+import random
+import unittest
+
+from rdbtools import StatsAggregator
+from rdbtools.memprofiler import MemoryRecord, SCATTER_POINTS
+from rdbtools.sketches import Reservoir, QuantileSketch, log_bucket
+from rdbtools.compat import range
+
+
+def exact_quantile(values, q):
+    values = sorted(values)
+    return values[int(q * (len(values) - 1))]
+
+
+class SketchesTestCase(unittest.TestCase):
+    def test_log_bucket(self):
+        self.assertEquals([log_bucket(v) for v in range(8)], list(range(8)))
+        self.assertEquals([log_bucket(v) for v in (8, 9, 10, 11, 12, 13, 14, 15, 16)], [8, 8, 10, 10, 12, 12, 14, 14, 16])
+        values = list(range(1, 100000))
+        buckets = sorted(set(log_bucket(v) for v in values))
+        self.assert_(len(buckets) < 70, len(buckets))
+        # every value falls in the last bucket that starts at or below it
+        for v in values[::97]:
+            self.assertEquals(log_bucket(v), max(b for b in buckets if b <= v))
+
+    def test_reservoir_keeps_everything_under_capacity(self):
+        reservoir = Reservoir(10)
+        for i in range(10):
+            reservoir.add(i)
+        self.assertEquals(reservoir.items, list(range(10)))
+        other = Reservoir(10)
+        other.add(10)
+        reservoir.merge(other)
+        self.assertEquals(reservoir.count, 11)
+        self.assertEquals(len(reservoir.items), 10)
+
+    def test_reservoir_is_uniform(self):
+        first_half = 0
+        for seed in range(200):
+            reservoir = Reservoir(10, seed)
+            for i in range(1000):
+                reservoir.add(i)
+            self.assertEquals(len(reservoir.items), 10)
+            first_half += sum(1 for i in reservoir.items if i < 500)
+        self.assert_(900 < first_half < 1100, first_half)
+
+    def test_merged_reservoir_is_uniform(self):
+        from_small = 0
+        for seed in range(200):
+            small = Reservoir(10, seed)
+            large = Reservoir(10, seed + 1000)
+            for i in range(100):
+                small.add(('small', i))
+            for i in range(900):
+                large.add(('large', i))
+            small.merge(large)
+            self.assertEquals(small.count, 1000)
+            from_small += sum(1 for source, i in small.items if source == 'small')
+        # a tenth of the items come from the small reservoir
+        self.assert_(150 < from_small < 250, from_small)
+
+    def test_quantiles_are_within_relative_accuracy(self):
+        rand = random.Random(1)
+        values = [int(rand.lognormvariate(6, 2)) for _ in range(20000)]
+        sketch = QuantileSketch(0.01)
+        for v in values:
+            sketch.add(v)
+        for q in (0, 0.5, 0.9, 0.99, 1):
+            expected = exact_quantile(values, q)
+            self.assert_(abs(sketch.quantile(q) - expected) <= 0.01 * expected + 1e-9, (q, sketch.quantile(q), expected))
+        self.assert_(len(sketch.buckets) < 1000)
+        self.assertEquals(QuantileSketch().quantile(0.5), None)
+
+    def test_merged_sketch_matches_one_sketch(self):
+        values = [i * i for i in range(1000)]
+        expected = QuantileSketch()
+        first = QuantileSketch()
+        second = QuantileSketch()
+        for i, v in enumerate(values):
+            expected.add(v)
+            (first if i % 3 else second).add(v)
+        first.merge(second)
+        self.assertEquals(first.buckets, expected.buckets)
+        self.assertEquals((first.zeros, first.count, first.min, first.max), (expected.zeros, expected.count, 0, 998001))
+        self.assertRaises(Exception, first.merge, QuantileSketch(0.05))
+
+    def test_aggregator_memory_is_bounded(self):
+        stats = StatsAggregator()
+        for i in range(20000):
+            stats.next_record(MemoryRecord(database=0, type='hash', key='k%d' % i, bytes=100 + i * 7, encoding='hashtable',
+                                           size=i, len_largest_element=8, expiry=None))
+        self.assertEquals(len(stats.scatters['hash_memory_by_length']), SCATTER_POINTS)
+        self.assert_(len(stats.histograms['hash_memory']) < 100, len(stats.histograms['hash_memory']))
+        self.assert_(len(stats.histograms['hash_length']) < 100, len(stats.histograms['hash_length']))
+        self.assertEquals(sum(stats.histograms['hash_memory'].values()), 20000)
+        p99 = stats.quantile('hash_length', 0.99)
+        self.assert_(abs(p99 - 19800) <= 0.01 * 19800, p99)
+        self.assertEquals(stats.quantile('set_length', 0.5), None)
+        self.assert_('"p99"' in stats.get_json())